@@ -0,0 +1,531 @@
+"""
+This module implements benchmarks for the bot's persistence, scheduling and
+gateway layers. Benchmarks only use temporary files and synthetic data, they
+never touch the database or scheduler queue configured in `config.py` or
+connect to Discord.
+
+Run a benchmark with
+    python benchmark.py <benchmark> [size]
+and list all benchmarks with
+    python benchmark.py
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import typing
+
+# benchmark name -> (function taking the size, default size)
+_benchmarks: typing.Dict[str, typing.Tuple[typing.Callable, int]] = {}
+
+
+def benchmark(name: str, default_size: int):
+    """
+    Function decorator that registers a benchmark.
+    """
+
+    def register(func):
+        _benchmarks[name] = (func, default_size)
+        return func
+
+    return register
+
+
+def _snowflakes(amount: int) -> typing.List[int]:
+    # Discord IDs are 64 bit integers, recent ones are around 1e18
+    return random.sample(range(10**17, 10**18), amount)
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _release_free_memory() -> None:
+    gc.collect()
+    # return memory freed earlier to the OS, otherwise it is reused without
+    # growing the resident set
+    ctypes.CDLL(ctypes.util.find_library("c")).malloc_trim(0)
+
+
+def _measure_memory(func: typing.Callable) -> typing.Tuple[typing.Any, int]:
+    """
+    Returns the result of `func()` and by how many bytes it grew the resident
+    set size of the process. Unlike tracemalloc, this includes memory
+    allocated by C extensions such as BTrees. Keep the results of earlier
+    measurements alive, otherwise `func` can reuse their memory. Only works
+    on Linux with glibc.
+    """
+    _release_free_memory()
+    before = _rss()
+    result = func()
+    return result, _rss() - before
+
+
+def _report(variant: str, **results: str) -> None:
+    print(f"{variant:>20}: " + ", ".join(f"{k} {v}" for k, v in results.items()))
+
+
+@benchmark("btrees", 10_000)
+def bench_btrees(size: int) -> None:
+    """
+    Party affiliations of `size` users (user id -> party message id) stored in
+    the containers of previous versions and in integer keyed BTrees: size of
+    the initial commit and of a commit changing a single user, memory and
+    lookup time.
+    """
+    import transaction
+    import ZODB
+    import ZODB.FileStorage
+    from BTrees.LLBTree import LLBTree
+    from persistent.mapping import PersistentMapping
+
+    user_ids = _snowflakes(size)
+    message_ids = _snowflakes(max(1, size // 4))
+    affiliations = [(user_id, random.choice(message_ids)) for user_id in user_ids]
+
+    # build all containers before committing any of them, since committing
+    # turns their contents into ghosts and frees memory (see `_measure_memory`)
+    results = {}
+    for variant, container_class in (
+        ("PersistentMapping", PersistentMapping),
+        ("LLBTree", LLBTree),
+    ):
+
+        def build():
+            container = container_class()
+            for user_id, message_id in affiliations:
+                container[user_id] = message_id
+            return container
+
+        container, memory = _measure_memory(build)
+
+        lookups = user_ids * max(1, 100_000 // size)
+        start = time.perf_counter()
+        for user_id in lookups:
+            container.get(user_id)
+        lookup_time = (time.perf_counter() - start) / len(lookups)
+        results[variant] = (container, memory, lookup_time)
+
+    for variant, (container, memory, lookup_time) in results.items():
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "benchmark.fs")
+            db = ZODB.DB(ZODB.FileStorage.FileStorage(filename))
+            connection = db.open()
+            connection.root.container = container
+            transaction.commit()
+            initial_size = os.path.getsize(filename)
+
+            container[user_ids[0]] = message_ids[0]
+            transaction.commit()
+            change_size = os.path.getsize(filename) - initial_size
+            db.close()
+
+        _report(
+            variant,
+            initial_commit=f"{initial_size / 1024:.0f} KiB",
+            single_change_commit=f"{change_size / 1024:.1f} KiB",
+            memory=f"{memory / 1024:.0f} KiB",
+            lookup=f"{lookup_time * 1e6:.2f} us",
+        )
+
+
+_fired_late_by = []
+
+
+def _record_firing(due: float) -> None:
+    _fired_late_by.append(time.time() - due)
+
+
+def _report_firings(variant: str) -> None:
+    late_by = sorted(_fired_late_by)
+    _report(
+        f"{variant} fired",
+        jobs=str(len(late_by)),
+        min=f"{late_by[0] * 1000:.1f} ms",
+        median=f"{late_by[len(late_by) // 2] * 1000:.1f} ms",
+        p99=f"{late_by[len(late_by) * 99 // 100] * 1000:.1f} ms",
+        max=f"{late_by[-1] * 1000:.1f} ms",
+    )
+
+
+def _bench_delay_queue(size: int, fired: int) -> None:
+    import asyncio
+
+    from delay_queue import DelayQueue, callable_name
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "benchmark.log")
+        queue = DelayQueue(filename)
+        queue.load()
+        start = time.perf_counter()
+        for i in range(size):
+            queue.schedule(print, [i], 24 * 60 * 60 + i)
+        schedule_time = (time.perf_counter() - start) / size
+        queue._log.close()
+
+        queue = DelayQueue(filename)
+        start = time.perf_counter()
+        queue.load()
+        load_time = time.perf_counter() - start
+        queue._log.close()
+        log_size = os.path.getsize(filename)
+
+    _fired_late_by.clear()
+
+    async def fire():
+        with tempfile.TemporaryDirectory() as directory:
+            queue = DelayQueue(os.path.join(directory, "benchmark.log"))
+            queue.load()
+            queue.start()
+            now = time.time()
+            for i in range(fired):
+                due = now + random.uniform(0.1, 2)
+                queue.schedule_at(callable_name(_record_firing), [due], due)
+            while len(_fired_late_by) < fired:
+                await asyncio.sleep(0.1)
+            queue._runner.cancel()
+            queue._log.close()
+
+    asyncio.run(fire())
+
+    _report(
+        "DelayQueue",
+        schedule=f"{schedule_time * 1e6:.1f} us",
+        load=f"{load_time:.2f} s",
+        store=f"{log_size / 1024 / 1024:.1f} MiB",
+    )
+    _report_firings("DelayQueue")
+
+
+def _bench_apscheduler(size: int, fired: int) -> None:
+    # the job store of previous versions
+    import asyncio
+    from datetime import datetime, timedelta
+
+    try:
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    except ImportError:
+        _report("APScheduler", skipped="apscheduler or sqlalchemy is not installed")
+        return
+
+    def scheduler(filename):
+        return AsyncIOScheduler(
+            jobstores={"default": SQLAlchemyJobStore(url="sqlite:///" + filename)},
+            job_defaults={"misfire_grace_time": None},
+        )
+
+    async def schedule_and_load(filename):
+        old_scheduler = scheduler(filename)
+        old_scheduler.start(paused=True)
+        now = datetime.now()
+        start = time.perf_counter()
+        for i in range(size):
+            old_scheduler.add_job(
+                print,
+                "date",
+                run_date=now + timedelta(days=1, seconds=i),
+                args=[i],
+            )
+        schedule_time = (time.perf_counter() - start) / size
+        old_scheduler.shutdown(wait=False)
+
+        # APScheduler loads jobs lazily, starting it only looks up the next one
+        old_scheduler = scheduler(filename)
+        start = time.perf_counter()
+        old_scheduler.start(paused=True)
+        old_scheduler.get_jobs()
+        load_time = time.perf_counter() - start
+        old_scheduler.shutdown(wait=False)
+        return schedule_time, load_time
+
+    async def fire(filename):
+        old_scheduler = scheduler(filename)
+        old_scheduler.start()
+        now = time.time()
+        for i in range(fired):
+            due = now + random.uniform(0.1, 2)
+            old_scheduler.add_job(
+                _record_firing,
+                "date",
+                run_date=datetime.fromtimestamp(due),
+                args=[due],
+            )
+        while len(_fired_late_by) < fired:
+            await asyncio.sleep(0.1)
+        old_scheduler.shutdown(wait=False)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "benchmark.sqlite")
+        schedule_time, load_time = asyncio.run(schedule_and_load(filename))
+        store_size = os.path.getsize(filename)
+
+        _fired_late_by.clear()
+        asyncio.run(fire(os.path.join(directory, "fire.sqlite")))
+
+    _report(
+        "APScheduler",
+        schedule=f"{schedule_time * 1e6:.1f} us",
+        load=f"{load_time:.2f} s",
+        store=f"{store_size / 1024 / 1024:.1f} MiB",
+    )
+    _report_firings("APScheduler")
+
+
+@benchmark("delay_queue", 100_000)
+def bench_delay_queue(size: int) -> None:
+    """
+    Delay queue with `size` pending jobs, compared to APScheduler with the
+    SQLAlchemy job store of previous versions (if installed): time to
+    schedule a job, time to load the queue at startup, size of the stored
+    jobs and how late jobs fire (including
+    `delay_queue.BATCH_WINDOW_SECONDS`).
+    """
+    fired = min(size, 1000)
+    _bench_delay_queue(size, fired)
+    _bench_apscheduler(size, fired)
+
+
+@benchmark("snapshot", 100_000)
+def bench_snapshot(size: int) -> None:
+    """
+    Snapshot of a state with `size` party members in 100 party channels and
+    `size // 10` scheduled jobs: time to restore it into an empty database,
+    to collect and encode it (as `exportstate` does) and to decode it.
+    """
+    import database
+    import scheduling
+    import snapshot
+    import ZODB.FileStorage
+    from delay_queue import DelayQueue
+
+    channel_ids = _snowflakes(100)
+    user_ids = _snowflakes(size)
+    message_ids = _snowflakes(max(1, size // 4))
+    party_channels = []
+    for i, channel_id in enumerate(channel_ids):
+        party_channels.append(
+            {
+                "id": channel_id,
+                "reference_channel_id": channel_id + 1,
+                "game_name": f"Game {i}",
+                "max_slots": 5,
+                "voice_channel_counter": 1,
+                "open_parties": True,
+                "division_admin_id": channel_id + 2,
+                "use_buttons": False,
+                "party_members": [
+                    (user_id, random.choice(message_ids))
+                    for user_id in user_ids[i :: len(channel_ids)]
+                ],
+                "active_voice_channels": _snowflakes(10),
+                "pooled_voice_channels": _snowflakes(2),
+            }
+        )
+    now = time.time()
+    state = {
+        "party_channels": party_channels,
+        "games_channels": [],
+        "event_channels": [],
+        "event_voice_channels": [],
+        "bot_messages": [],
+        "guild_settings": [],
+        "jobs": [
+            [
+                now + random.uniform(60, 3600),
+                "scheduling:_message_delayed_delete",
+                [message_id, random.choice(channel_ids)],
+            ]
+            for message_id in _snowflakes(size // 10)
+        ],
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.open_database(
+            ZODB.FileStorage.FileStorage(os.path.join(directory, "benchmark.fs"))
+        )
+        scheduling._scheduler = DelayQueue(os.path.join(directory, "benchmark.log"))
+        scheduling._scheduler.load()
+
+        start = time.perf_counter()
+        snapshot.restore_state(state)
+        restore_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data = snapshot.encode(snapshot.collect_state())
+        export_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        snapshot.decode(data)
+        decode_time = time.perf_counter() - start
+
+        scheduling._scheduler._log.close()
+        database.connection.db().close()
+
+    _report(
+        "snapshot",
+        size=f"{len(data) / 1024:.0f} KiB",
+        restore=f"{restore_time:.2f} s",
+        export=f"{export_time:.2f} s",
+        decode=f"{decode_time:.2f} s",
+    )
+
+
+def _synthetic_guild_create(size: int, all_members: bool, presences: bool) -> dict:
+    """
+    Returns a GUILD_CREATE payload of a guild with `size` members, 1% of them
+    connected to a voice channel. Only members in voice channels are included
+    unless `all_members` is set (i.e. after chunking the guild).
+    """
+    guild_id, *channel_ids = _snowflakes(11)
+    member_ids = _snowflakes(size)
+    voice_member_ids = set(member_ids[: max(1, size // 100)])
+    return {
+        "id": str(guild_id),
+        "name": "Benchmark",
+        "member_count": size,
+        "roles": [
+            {
+                "id": str(guild_id),
+                "name": "@everyone",
+                "permissions": "0",
+                "position": 0,
+                "color": 0,
+                "hoist": False,
+                "managed": False,
+                "mentionable": False,
+            }
+        ],
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "channels": [
+            {
+                "id": str(channel_id),
+                "type": 2,
+                "name": f"Voice {i}",
+                "position": i,
+                "permission_overwrites": [],
+                "bitrate": 64000,
+                "user_limit": 0,
+                "parent_id": None,
+            }
+            for i, channel_id in enumerate(channel_ids)
+        ],
+        "voice_states": [
+            {
+                "user_id": str(member_id),
+                "channel_id": str(random.choice(channel_ids)),
+                "session_id": "benchmark",
+                "deaf": False,
+                "mute": False,
+                "self_deaf": False,
+                "self_mute": False,
+                "self_video": False,
+                "suppress": False,
+                "request_to_speak_timestamp": None,
+            }
+            for member_id in voice_member_ids
+        ],
+        "members": [
+            {
+                "user": {
+                    "id": str(member_id),
+                    "username": f"user{member_id}",
+                    "discriminator": "0",
+                    "global_name": None,
+                    "avatar": None,
+                },
+                "roles": [],
+                "joined_at": "2020-01-01T00:00:00+00:00",
+                "deaf": False,
+                "mute": False,
+                "flags": 0,
+            }
+            for member_id in member_ids
+            if all_members or member_id in voice_member_ids
+        ],
+        "presences": [
+            {
+                "user": {"id": str(member_id)},
+                "status": "online",
+                "activities": [],
+                "client_status": {"desktop": "online"},
+            }
+            for member_id in member_ids[: size // 3]
+            if presences
+        ],
+    }
+
+
+@benchmark("gateway", 100_000)
+def bench_gateway(size: int) -> None:
+    """
+    A guild with `size` members, 1% of them in voice channels, received with
+    each gateway profile (see `gateway`): time to build discord.py's guild
+    state from the GUILD_CREATE payload, the memory it keeps and the amount of
+    cached members. With the full profile, the payload contains all members
+    and presences, as after chunking the guild at startup.
+    """
+    import discord
+    import gateway
+    from discord.state import ConnectionState
+
+    guilds = []  # kept alive, see `_measure_memory`
+    for profile in ("full", "lean"):
+        gateway.GATEWAY_PROFILE = profile
+        intents = gateway.get_intents()
+        payload = _synthetic_guild_create(
+            size,
+            all_members=gateway.chunk_guilds_at_startup(),
+            presences=intents.presences,
+        )
+        state = ConnectionState(
+            dispatch=lambda *args: None,
+            handlers={},
+            hooks={},
+            http=None,
+            intents=intents,
+            member_cache_flags=gateway.get_member_cache_flags(),
+            chunk_guilds_at_startup=gateway.chunk_guilds_at_startup(),
+        )
+
+        start = time.perf_counter()
+        guild, memory = _measure_memory(
+            lambda: discord.Guild(data=payload, state=state)
+        )
+        startup_time = time.perf_counter() - start
+        guilds.append(guild)
+
+        _report(
+            profile,
+            startup=f"{startup_time:.2f} s",
+            memory=f"{memory / 1024 / 1024:.1f} MiB",
+            cached_members=str(len(guild.members)),
+        )
+
+
+def _main(argv: typing.List[str]) -> int:
+    if len(argv) not in (2, 3) or argv[1] not in _benchmarks:
+        print(f"Usage: {argv[0]} <benchmark> [size]", file=sys.stderr)
+        for name, (func, default_size) in _benchmarks.items():
+            print(f"\n{name} (default size {default_size}):", file=sys.stderr)
+            print(func.__doc__.rstrip(), file=sys.stderr)
+        return 2
+
+    func, size = _benchmarks[argv[1]]
+    if len(argv) == 3:
+        size = int(argv[2])
+    print(f"Running {argv[1]} with size {size}")
+    func(size)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv))
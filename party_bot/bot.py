@@ -1,11 +1,14 @@
-#!/usr/bin/env -S python3 -u
+#!/usr/bin/env python3
 
 """
 Fear and Terror's bot for party matchmaking on Discord
 """
+
 from typing import Union, Optional
 
+import asyncio
 import discord
+import logging
 import transaction
 from discord.ext import commands
 
@@ -13,30 +16,74 @@ import checks
 import config
 import emoji_handling
 import error_handling
+import gateway
+import guild_settings
+import health
+import logging_config
+import message_registry
+import os
 import party
+import profiling
+import rest
 import scheduling
+import snapshot
+import startup
+import time
 from channelinformation import PartyChannelInformation, GamesChannelInformation
 from database import db
+from deduplication import reaction_deduplicator
 from emojis import Emojis
+from load_shedding import reaction_load_shedder, shed_reaction_remover
+from loop_monitor import loop_monitor
+from message_cache import managed_messages
+from party_events import compute_statistics, event_log, format_statistics
+from reaction_seeding import reaction_seeder
 from strings import Strings
+from voice_channel_pool import voice_channel_pool
+
+logger = logging.getLogger(__name__)
 
-intents = discord.Intents.all()
+SNAPSHOT_OUTPUT_DIR = getattr(config, "SNAPSHOT_OUTPUT_DIR", "snapshots")
 
-bot = commands.Bot(command_prefix=config.BOT_CMD_PREFIX, intents=intents)
+bot = commands.Bot(
+    command_prefix=config.BOT_CMD_PREFIX,
+    intents=gateway.get_intents(),
+    member_cache_flags=gateway.get_member_cache_flags(),
+    chunk_guilds_at_startup=gateway.chunk_guilds_at_startup(),
+    http_trace=rest.http_trace(),
+    max_ratelimit_timeout=rest.MAX_RATELIMIT_WAIT_SECONDS,
+)
 
 
 @bot.event
+@startup.after_ready
 async def on_ready():
-    config.init_config(bot)
-    print("Logged in as")
-    print(bot.user.name)
-    print(bot.user.id)
-    print("------")
-    scheduling.init_scheduler()
+    logger.info("Logged in as %s (%s)", bot.user.name, bot.user.id)
+    logger.info(
+        "Gateway profile %s, %d members cached",
+        gateway.GATEWAY_PROFILE,
+        gateway.member_cache_size(bot),
+    )
+    loop_monitor.start()
+    event_log.start()
+    bot.add_view(party.get_party_view())
+    for guild in bot.guilds:
+        checks.seed_admin_cache(guild)
+    scheduling.start_scheduler()
+    voice_channel_pool.fill_all(bot)
+    party.reconcile_party_messages(bot)
+    startup.gateway_ready()
 
 
 @bot.event
+@startup.after_ready
 async def on_message(message):
+    if checks.author_is_me(message):
+        managed_messages.put(message)
+        if message_registry.track_message(message):
+            transaction.commit()
+        return
+
     await bot.process_commands(message)
 
     # Add first reactions to menu messages (see `activate_side_games`).
@@ -45,32 +92,78 @@ async def on_message(message):
 
 
 @bot.event
+@startup.after_ready
 async def on_raw_reaction_add(payload):
     await emoji_handling.handle_react(payload, True)
 
 
 @bot.event
+@startup.after_ready
 async def on_raw_reaction_remove(payload):
     await emoji_handling.handle_react(payload, False)
 
 
 @bot.event
+@startup.after_ready
 async def on_raw_message_edit(payload):
     """
     Message edit handler that updates the bot's emoji reactions when a menu
     message (see `activate_side_games`) is edited.
     """
+    managed_messages.invalidate_edited(payload)
+    feature, _ = checks.get_channel_feature(payload.channel_id)
+    if feature not in (
+        checks.ActivationState.SIDE_GAMES,
+        checks.ActivationState.EVENT,
+    ):
+        return  # ignore message outside of side games and event channels
+
+    # fetch the message anyway, the emojis are synced with its reactions
     message = await bot.get_channel(payload.channel_id).fetch_message(
         payload.message_id
     )
-    if (
-        payload.channel_id not in db.games_channels
-        and payload.channel_id not in db.event_channels
-    ):
-        return  # ignore message outside of side games and event channels
+    managed_messages.put(message)
+    await emoji_handling.sync_menu_emojis(message)
 
-    await message.clear_reactions()
-    await emoji_handling.add_first_emojis(message)
+
+@bot.event
+@startup.after_ready
+async def on_member_update(before, after):
+    if before.roles != after.roles:
+        checks.invalidate_admin_cache(after.guild, after)
+
+
+@bot.event
+@startup.after_ready
+async def on_member_remove(member):
+    checks.invalidate_admin_cache(member.guild, member)
+
+
+@bot.event
+@startup.after_ready
+async def on_guild_role_delete(role):
+    checks.invalidate_admin_cache(role.guild)
+
+
+@bot.event
+@startup.after_ready
+async def on_raw_message_delete(payload):
+    message_ids = [payload.message_id]
+    managed_messages.invalidate(payload.message_id)
+    tracked = message_registry.forget_messages(payload.channel_id, message_ids)
+    if party.handle_party_messages_deleted(payload.channel_id, message_ids) or tracked:
+        transaction.commit()
+
+
+@bot.event
+@startup.after_ready
+async def on_raw_bulk_message_delete(payload):
+    message_ids = payload.message_ids
+    for message_id in message_ids:
+        managed_messages.invalidate(message_id)
+    tracked = message_registry.forget_messages(payload.channel_id, message_ids)
+    if party.handle_party_messages_deleted(payload.channel_id, message_ids) or tracked:
+        transaction.commit()
 
 
 @bot.event
@@ -79,11 +172,17 @@ async def on_command_error(ctx, error):
 
 
 @bot.event
+@startup.after_ready
 async def on_voice_state_update(member, before, after):
     """
     Event handler that takes cares of deleting bot-created channels when they
     empty out.
     """
+    if after.channel is None and member.guild.get_member(member.id) is None:
+        # the member was evicted from the member cache (see `gateway`), so its
+        # role changes aren't reported anymore
+        checks.invalidate_admin_cache(member.guild, member)
+
     channel = before.channel
     if channel is None or after.channel == channel:  # only tracks disconnects
         return
@@ -119,7 +218,7 @@ async def on_voice_state_update(member, before, after):
 
 
 @bot.command(aliases=["ap"])
-@commands.has_any_role(*config.BOT_ADMIN_ROLES)
+@commands.check(checks.check_admin)
 async def activate_party(
     ctx,
     game_name: str,
@@ -181,9 +280,17 @@ async def activate_party(
     channel_info = PartyChannelInformation(
         game_name, ctx.channel, max_slots, channel_above, open_parties, division_admin
     )
+    previous_info = db.party_channels.get(ctx.channel.id)
+    if previous_info is not None:
+        channel_info.use_buttons = previous_info.use_buttons
 
     db.party_channels[ctx.channel.id] = channel_info
-    await ctx.channel.purge(limit=100, check=checks.author_is_me)
+    if previous_info is not None:
+        # pooled channels may carry the previous game name and position
+        await voice_channel_pool.drain(previous_info, ctx.guild)
+    checks.register_channel(ctx.channel.id, checks.ActivationState.PARTY, channel_info)
+    voice_channel_pool.refill(channel_info, ctx.guild)
+    await message_registry.delete_tracked_messages(ctx.channel)
     embed = discord.Embed.from_dict(
         {
             "title": "Game: %s" % game_name,
@@ -193,26 +300,56 @@ async def activate_party(
         }
     )
     message = await ctx.send("", embed=embed)
-    await message.add_reaction(Emojis.TADA)
+    reaction_seeder.seed(message, [Emojis.TADA])
+
+
+@bot.command(aliases=["pui"])
+@commands.check(checks.check_admin)
+@commands.check(checks.check_party_channel)
+async def party_ui(ctx, ui: str):
+    """
+    Sets how members interact with new party messages in this channel.
+
+    Attributes:
+        ui (str): Either BUTTONS or REACTIONS.
+            With BUTTONS, party messages have Join, Leave, Start and Close
+            buttons. With REACTIONS (default), members react with emojis.
+            Existing party messages keep working as before.
+    """
+    if ui == Strings.BUTTONS:
+        use_buttons = True
+    elif ui == Strings.REACTIONS:
+        use_buttons = False
+    else:
+        raise commands.errors.BadArgument()
+
+    db.party_channels[ctx.channel.id].use_buttons = use_buttons
+    transaction.commit()
+
+    await ctx.message.delete()
+    m = await ctx.send(f"Party messages in this channel now use {ui.lower()}.")
+    scheduling.message_delayed_delete(m)
 
 
 @bot.command(aliases=["dp"])
-@commands.has_any_role(*config.BOT_ADMIN_ROLES)
+@commands.check(checks.check_admin)
 @commands.check(checks.check_party_channel)
 async def deactivate_party(ctx):
     """
     Deactivates the party matchmaking feature for this channel, removing the
     party creation menu.
     """
-    del db.party_channels[ctx.channel.id]
+    channel_info = db.party_channels.pop(ctx.channel.id)
+    checks.unregister_channel(ctx.channel.id)
+    await voice_channel_pool.drain(channel_info, ctx.guild)
     await ctx.message.delete()
-    await ctx.channel.purge(limit=100, check=checks.author_is_me)
+    await message_registry.delete_tracked_messages(ctx.channel, keep_tracking=False)
     message = await ctx.send(f"Party matchmaking disabled for this channel.")
     scheduling.message_delayed_delete(message)
 
 
 # @bot.command()
-# @commands.has_any_role(*config.BOT_ADMIN_ROLES)
+# @commands.check(checks.check_admin)
 # async def nukeparties(ctx):
 #    for channel in ctx.guild.channels:
 #        if " Party #" in channel.name:
@@ -220,7 +357,7 @@ async def deactivate_party(ctx):
 
 
 @bot.command(aliases=["asg"])
-@commands.has_any_role(*config.BOT_ADMIN_ROLES)
+@commands.check(checks.check_admin)
 @commands.check(checks.check_channel_inactive)
 async def activate_side_games(ctx, channel_below_id: int):
     """
@@ -237,7 +374,7 @@ async def activate_side_games(ctx, channel_below_id: int):
         is activated.
         Menu messages are messages that
         - Have been posted by a member that has any of the bot administrator
-          roles specified in the bot configuration (config.BOT_ADMIN_ROLES).
+          roles of the guild (see the `settings` command).
         - Contain at least one menu entry (see below).
 
         Menu entries are lines in a menu message that have the following
@@ -275,10 +412,13 @@ async def activate_side_games(ctx, channel_below_id: int):
 
     channel_info = GamesChannelInformation(ctx.channel, channel_below)
     db.games_channels[ctx.channel.id] = channel_info
+    checks.register_channel(
+        ctx.channel.id, checks.ActivationState.SIDE_GAMES, channel_info
+    )
 
 
 @bot.command(aliases=["dsg"])
-@commands.has_any_role(*config.BOT_ADMIN_ROLES)
+@commands.check(checks.check_admin)
 @commands.check(checks.check_side_games_channel)
 async def deactivate_side_games(ctx):
     """
@@ -292,10 +432,11 @@ async def deactivate_side_games(ctx):
     scheduling.message_delayed_delete(message)
 
     del db.games_channels[ctx.channel.id]
+    checks.unregister_channel(ctx.channel.id)
 
 
 @bot.command(aliases=["aec"])
-@commands.has_any_role(*config.BOT_ADMIN_ROLES)
+@commands.check(checks.check_admin)
 @commands.check(checks.check_channel_inactive)
 async def activate_event_channel(ctx):
     """
@@ -308,7 +449,7 @@ async def activate_event_channel(ctx):
         is activated.
         Menu messages are messages that
         - Have been posted by a member that has any of the bot administrator
-          roles specified in the bot configuration (config.BOT_ADMIN_ROLES).
+          roles of the guild (see the `settings` command).
         - Contain at least one menu entry (see below).
 
         Menu entries are lines in a menu message that have the following
@@ -342,10 +483,11 @@ async def activate_event_channel(ctx):
     scheduling.message_delayed_delete(message)
 
     db.event_channels.add(ctx.channel.id)
+    checks.register_channel(ctx.channel.id, checks.ActivationState.EVENT)
 
 
 @bot.command(aliases=["dec"])
-@commands.has_any_role(*config.BOT_ADMIN_ROLES)
+@commands.check(checks.check_admin)
 @commands.check(checks.check_event_channel)
 async def deactivate_event_channel(ctx):
     """
@@ -359,7 +501,173 @@ async def deactivate_event_channel(ctx):
     scheduling.message_delayed_delete(message)
 
     db.event_channels.remove(ctx.channel.id)
+    checks.unregister_channel(ctx.channel.id)
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def profile(ctx, seconds: int = 30):
+    """
+    Profiles the bot for the given amount of seconds (at most 300).
+
+    Writes a pstats file and flamegraph-ready collapsed stack files for the
+    event loop and for the time spent waiting for REST calls, database commits
+    and locks to the profiling output directory (see `profiling`).
+    """
+    if not 0 < seconds <= 300:
+        raise commands.errors.BadArgument()
+    if profiling.is_running():
+        raise error_handling.ProfilingAlreadyRunningError()
+
+    await ctx.send(f"Profiling for {seconds} seconds...")
+    profiling.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        summary = await profiling.stop()
+    await ctx.send(summary)
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def looplag(ctx):
+    """
+    Shows the event loop lag histogram and the handlers that blocked the event
+    loop for too long. Writes a full report including stack traces to the
+    loop monitor output directory (see `loop_monitor`).
+    """
+    filename = await loop_monitor.dump()
+    await ctx.send(f"{loop_monitor.summary()}\nFull report: `{filename}`")
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def reactionstats(ctx):
+    """
+    Shows how many reaction events are queued and how many were dropped by
+    the deduplication (see `deduplication`) and the load shedding (see
+    `load_shedding`) since the bot was started.
+    """
+    lines = ["Reaction events:"]
+    for name, value in {
+        **reaction_load_shedder.stats(),
+        **shed_reaction_remover.stats(),
+        **reaction_deduplicator.stats(),
+    }.items():
+        lines.append(f"- {name.replace('_', ' ')}: {value}")
+    await ctx.send("\n".join(lines))
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def exportstate(ctx):
+    """
+    Writes a snapshot of all channel configurations and pending scheduled jobs
+    to the snapshot output directory. See `snapshot` on how to restore it.
+    """
+    os.makedirs(SNAPSHOT_OUTPUT_DIR, exist_ok=True)
+    filename = os.path.join(
+        SNAPSHOT_OUTPUT_DIR, time.strftime("snapshot-%Y%m%d-%H%M%S.pbsnap")
+    )
+    await ctx.send(await snapshot.export_snapshot(filename))
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def partystats(ctx, days: int = 30):
+    """
+    Shows party statistics per game for the last `days` days: how many parties
+    filled up, were force started or closed, percentiles of the time until a
+    party started and the hour of the day (UTC) with the most created parties.
+    """
+    if days < 1:
+        raise commands.errors.BadArgument()
+
+    def compute():
+        return compute_statistics(event_log.load(since=time.time() - days * 86400))
+
+    stats = await asyncio.get_event_loop().run_in_executor(None, compute)
+    game_names = {
+        channel_id: channel_info.game_name
+        for channel_id, channel_info in db.party_channels.items()
+    }
+    await ctx.send(format_statistics(stats, game_names))
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def settings(ctx):
+    """
+    Shows the bot settings of this server. Settings marked with * are set for
+    this server, all others are the defaults from the bot configuration.
+    """
+    current = guild_settings.get(ctx.guild.id)
+    overrides = guild_settings.overrides(ctx.guild.id)
+    lines = ["Settings:"]
+    for name in guild_settings.NAMES:
+        value = getattr(current, name)
+        if name == "admin_roles":
+            value = " ".join(f"<@&{role_id}>" for role_id in sorted(value))
+        marker = "*" if name in overrides else ""
+        lines.append(f"- {name}{marker}: {value}")
+    await ctx.send("\n".join(lines), allowed_mentions=discord.AllowedMentions.none())
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def setting(ctx, name: str, *, value: str):
+    """
+    Changes a bot setting for this server. See the `settings` command for all
+    settings and their current values.
+
+    Attributes:
+        name (str): The name of the setting.
+        value (str): The new value. Durations are whole numbers, admin_roles
+            takes one or more mentions or IDs of roles of this server, at
+            least one of which you must have.
+    """
+    try:
+        guild_settings.set_setting(ctx.author, name, value)
+    except guild_settings.AdminLockoutError:
+        raise error_handling.AdminLockoutError()
+    except (KeyError, ValueError):
+        raise commands.errors.BadArgument()
+    transaction.commit()
+    guild_settings.refresh(ctx.guild.id)
+    if name == "admin_roles":
+        checks.invalidate_admin_cache(ctx.guild)
+    await ctx.send(f"Setting {name} changed.")
+
+
+@bot.command()
+@commands.check(checks.check_admin)
+async def resetsetting(ctx, name: str):
+    """
+    Resets a bot setting for this server to the default from the bot
+    configuration.
+    """
+    try:
+        guild_settings.reset_setting(ctx.guild.id, name)
+    except KeyError:
+        raise commands.errors.BadArgument()
+    transaction.commit()
+    guild_settings.refresh(ctx.guild.id)
+    if name == "admin_roles":
+        checks.invalidate_admin_cache(ctx.guild)
+    await ctx.send(f"Setting {name} reset to the default.")
+
+
+async def main():
+    health.start(bot)
+    await startup.run(bot, config.BOT_TOKEN)
 
 
 if __name__ == "__main__":
-    bot.run(config.BOT_TOKEN)
+    logging_config.configure_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        event_log.flush()
+        logging_config.shutdown_logging()
@@ -4,10 +4,11 @@ used to describe channels in which any of the bot's features are activated.
 """
 
 import database
-import discord
 import persistent
-import sys
-from BTrees.OOBTree import TreeSet
+import typing
+from BTrees.LLBTree import LLBTree, LLTreeSet
+from BTrees.LOBTree import LOBTree
+from BTrees.OIBTree import OIBTree
 
 
 async def fetch_reference_channel(reference_channel_id, guild):
@@ -50,10 +51,31 @@ class _BaseChannelInformation(persistent.Persistent):
     async def fetch_channel_below(self, guild):
         return await fetch_reference_channel(self.__reference_channel_id, guild)
 
+    def to_snapshot(self) -> dict:
+        """
+        Returns the state of this object as plain data (see `snapshot`).
+        """
+        return {"id": self.id, "reference_channel_id": self.__reference_channel_id}
+
+    @classmethod
+    def from_snapshot(cls, data: dict):
+        """
+        Creates an object from the plain data returned by `to_snapshot`.
+        """
+        info = cls.__new__(cls)
+        info.id = data["id"]
+        info.__reference_channel_id = data["reference_channel_id"]
+        return info
+
 
 class PartyChannelInformation(_BaseChannelInformation):
     """Contains the relevant information about an active channel."""
 
+    # Whether new party messages use buttons instead of reactions
+    # (see `party.PartyView`). Class attribute so that channels stored by
+    # previous versions default to reactions.
+    use_buttons = False
+
     def __init__(
         self, game_name, channel, max_slots, channel_above, open_parties, division_admin
     ):
@@ -62,41 +84,167 @@ class PartyChannelInformation(_BaseChannelInformation):
         self.game_name = game_name
         self.max_slots = max_slots
         self.voice_channel_counter = 1
-        self.__active_party_members_and_leaders = persistent.mapping.PersistentMapping()
+        self.__active_party_members_and_leaders = LLBTree()
+        # party message id -> IDs of all members and the leader of the party
+        self.__party_message_members = LOBTree()
         self.open_parties = open_parties
-        self.active_voice_channels = TreeSet()
+        self.active_voice_channels = LLTreeSet()
+        # hidden voice channels for future parties (see `voice_channel_pool`)
+        self.pooled_voice_channels = LLTreeSet()
         self.division_admin_id = division_admin.id
 
-    async def get_party_message_of_user(self, member):
-        channel = member.guild.get_channel(self.id)
-        message_id = self.__active_party_members_and_leaders.get(member.id)
-        if message_id is None:
-            return None
-
-        try:
-            message = await channel.fetch_message(message_id)
-        except discord.NotFound as e:
-            print(
-                f"Party message deletion was not tracked!\n"
-                f"- Member: {member}\n"
-                f"- Channel: {channel}\n"
-                f"- Message: {message_id}\n",
-                file=sys.stderr,
-            )
-            self.clear_party_message_of_user(member)
-            message = None
-
-        return message
+    def migrate_integer_btrees(self):
+        """
+        Database migration step, see `database._migrate_integer_btrees`.
+        """
+        if not isinstance(self.__active_party_members_and_leaders, LLBTree):
+            members_and_leaders = LLBTree()
+            members_and_leaders.update(self.__active_party_members_and_leaders)
+            self.__active_party_members_and_leaders = members_and_leaders
+        if not isinstance(self.active_voice_channels, LLTreeSet):
+            self.active_voice_channels = LLTreeSet(self.active_voice_channels)
+
+    def migrate_party_message_index(self):
+        """
+        Database migration step, see `database._migrate_party_message_index`.
+        """
+        self.__party_message_members = LOBTree()
+        for user_id, message_id in self.__active_party_members_and_leaders.items():
+            self.__index_party_message_of_user(user_id, message_id)
+
+    def migrate_voice_channel_pool(self):
+        """
+        Database migration step, see `database._migrate_voice_channel_pool`.
+        """
+        self.pooled_voice_channels = LLTreeSet()
+
+    def to_snapshot(self) -> dict:
+        data = super().to_snapshot()
+        data.update(
+            game_name=self.game_name,
+            max_slots=self.max_slots,
+            voice_channel_counter=self.voice_channel_counter,
+            open_parties=self.open_parties,
+            division_admin_id=self.division_admin_id,
+            use_buttons=self.use_buttons,
+            party_members=list(self.__active_party_members_and_leaders.items()),
+            active_voice_channels=list(self.active_voice_channels),
+            pooled_voice_channels=list(self.pooled_voice_channels),
+        )
+        return data
+
+    @classmethod
+    def from_snapshot(cls, data: dict):
+        info = super().from_snapshot(data)
+        info.game_name = data["game_name"]
+        info.max_slots = data["max_slots"]
+        info.voice_channel_counter = data["voice_channel_counter"]
+        info.open_parties = data["open_parties"]
+        info.division_admin_id = data["division_admin_id"]
+        info.use_buttons = data.get("use_buttons", False)
+        info.__active_party_members_and_leaders = LLBTree(data["party_members"])
+        info.active_voice_channels = LLTreeSet(data["active_voice_channels"])
+        info.pooled_voice_channels = LLTreeSet(data.get("pooled_voice_channels", []))
+        info.migrate_party_message_index()
+        return info
+
+    def get_party_message_id_of_user(self, user) -> typing.Optional[int]:
+        """
+        Returns the ID of the party message of the party the user is part of
+        (either as member or leader), or None if the user is not in any party.
+
+        Deleted party messages are tracked through `forget_party_message` (and
+        reconciled at startup, see `party.reconcile_party_messages`), so this
+        is a local lookup.
+        """
+        return self.__active_party_members_and_leaders.get(user.id)
+
+    def is_in_party(self, user) -> bool:
+        return user.id in self.__active_party_members_and_leaders
+
+    def is_party_message(self, message_id) -> bool:
+        return message_id in self.__party_message_members
+
+    def party_message_ids(self) -> typing.List[int]:
+        """
+        Returns the IDs of all party messages with members or a leader.
+        """
+        return list(self.__party_message_members.keys())
+
+    def party_size(self, message_id) -> int:
+        """
+        Returns the amount of users (members and leader) of the party with the
+        given party message.
+        """
+        return len(self.__party_message_members.get(message_id, ()))
 
     def set_party_message_of_user(self, user, message):
+        self.clear_party_message_of_user(user)
         self.__active_party_members_and_leaders[user.id] = message.id
+        self.__index_party_message_of_user(user.id, message.id)
 
     def clear_party_message_of_user(self, user):
-        del self.__active_party_members_and_leaders[user.id]
+        message_id = self.__active_party_members_and_leaders.pop(user.id, None)
+        if message_id is None:
+            return
+        user_ids = self.__party_message_members.get(message_id)
+        if user_ids is None:
+            return
+        user_ids.remove(user.id)
+        if len(user_ids) == 0:
+            del self.__party_message_members[message_id]
+
+    def forget_party_message(self, message_id) -> bool:
+        """
+        Clears the party affiliations (membership, leadership) of all users of
+        a deleted party message.
+        Returns True if and only if the message was a party message.
+        """
+        user_ids = self.__party_message_members.pop(message_id, None)
+        if user_ids is None:
+            return False
+        for user_id in user_ids:
+            del self.__active_party_members_and_leaders[user_id]
+        return True
+
+    def __index_party_message_of_user(self, user_id, message_id):
+        user_ids = self.__party_message_members.get(message_id)
+        if user_ids is None:
+            user_ids = LLTreeSet()
+            self.__party_message_members[message_id] = user_ids
+        user_ids.add(user_id)
 
 
 class GamesChannelInformation(_BaseChannelInformation):
     def __init__(self, channel, channel_below):
         super(GamesChannelInformation, self).__init__(channel, channel_below)
-        self.counters = persistent.mapping.PersistentMapping()
-        self.channel_owners = persistent.mapping.PersistentMapping()
+        self.counters = OIBTree()
+        self.channel_owners = LLBTree()
+
+    def migrate_integer_btrees(self):
+        """
+        Database migration step, see `database._migrate_integer_btrees`.
+        """
+        if not isinstance(self.counters, OIBTree):
+            counters = OIBTree()
+            counters.update(self.counters)
+            self.counters = counters
+        if not isinstance(self.channel_owners, LLBTree):
+            channel_owners = LLBTree()
+            channel_owners.update(self.channel_owners)
+            self.channel_owners = channel_owners
+
+    def to_snapshot(self) -> dict:
+        data = super().to_snapshot()
+        data.update(
+            counters=list(self.counters.items()),
+            channel_owners=list(self.channel_owners.items()),
+        )
+        return data
+
+    @classmethod
+    def from_snapshot(cls, data: dict):
+        info = super().from_snapshot(data)
+        info.counters = OIBTree(data["counters"])
+        info.channel_owners = LLBTree(data["channel_owners"])
+        return info
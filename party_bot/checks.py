@@ -11,13 +11,14 @@ The checks in this module come in two variants:
 """
 
 from enum import Enum
-from typing import Union
+from typing import Any, Optional, Tuple, Union
 
 import discord
 from discord.ext import commands
 
 import config
 import error_handling
+import guild_settings
 from database import db
 
 
@@ -28,14 +29,83 @@ def author_is_me(message: discord.Message) -> bool:
     return message.author == config.bot.user
 
 
+# (guild id, member id) -> bool
+# invalidated by the member and role event handlers in `bot.py`
+_admin_cache = {}
+
+
 def is_admin(member: Union[discord.Member, discord.User]) -> bool:
     """
-    Returns true if and only if the user has any of the admin roles specified
-    in config.BOT_ADMIN_ROLES.
+    Returns true if and only if the user has any of the admin roles of their
+    guild (see `guild_settings`).
+
+    Results are cached per (guild, member). The cache has to be invalidated
+    whenever a member's roles change (see `invalidate_admin_cache`).
+    Only members in discord.py's member cache are cached, since role changes
+    are not reported for other members (see `gateway`). Their states are
+    removed when they leave the member cache (see `on_voice_state_update`).
+
+    With the lean gateway profile, most members are not in the member cache.
+    For them, the state is computed on every call from the role IDs of the
+    member object of the event or interaction, which costs one lookup per
+    admin role instead of building and sorting the member's role list.
     """
     if not isinstance(member, discord.Member):
         return False
-    return any([role.id in config.BOT_ADMIN_ROLES for role in member.roles])
+    key = (member.guild.id, member.id)
+    admin = _admin_cache.get(key)
+    if admin is None:
+        admin_role_ids = guild_settings.get(member.guild.id).admin_roles
+        admin = any(member.get_role(role_id) is not None for role_id in admin_role_ids)
+        if member.guild.get_member(member.id) is not None:
+            _admin_cache[key] = admin
+    return admin
+
+
+def check_admin(ctx: commands.Context) -> bool:
+    """
+    Raises a MissingAnyRole error if the author of the command does not have
+    any of the admin roles of the guild (see `is_admin`).
+    """
+    if ctx.guild is None:
+        raise commands.NoPrivateMessage()
+    if not is_admin(ctx.author):
+        raise commands.MissingAnyRole(
+            list(guild_settings.get(ctx.guild.id).admin_roles)
+        )
+    return True
+
+
+def invalidate_admin_cache(
+    guild: discord.Guild, member: Union[discord.Member, discord.User, None] = None
+) -> None:
+    """
+    Removes cached admin states set by `is_admin`.
+    If no member is specified, the cached states of all members of the guild
+    are removed.
+    """
+    if member is not None:
+        _admin_cache.pop((guild.id, member.id), None)
+        return
+    for key in [key for key in _admin_cache if key[0] == guild.id]:
+        del _admin_cache[key]
+
+
+def admin_cache_size() -> int:
+    return len(_admin_cache)
+
+
+def seed_admin_cache(guild: discord.Guild) -> None:
+    """
+    Computes the admin state of all cached members of the guild at once.
+    """
+    admin_role_ids = guild_settings.get(guild.id).admin_roles
+    admin_ids = set()
+    for role in guild.roles:
+        if role.id in admin_role_ids:
+            admin_ids.update(member.id for member in role.members)
+    for member in guild.members:
+        _admin_cache[(guild.id, member.id)] = member.id in admin_ids
 
 
 class ActivationState(Enum):
@@ -56,19 +126,77 @@ class ActivationState(Enum):
     EVENT = 3
 
 
+# channel id -> (ActivationState, channel information object)
+# In-memory index of `db.party_channels`, `db.games_channels` and
+# `db.event_channels`. Built on first use and kept up to date by the
+# activate / deactivate commands through `register_channel` and
+# `unregister_channel`.
+_feature_registry = None
+
+_INACTIVE_ENTRY = (ActivationState.INACTIVE, None)
+
+
+def build_feature_registry() -> None:
+    """
+    (Re-)builds the channel feature registry from the database.
+    """
+    global _feature_registry
+    registry = {}
+    for channel_id, info in db.party_channels.items():
+        registry[channel_id] = (ActivationState.PARTY, info)
+    for channel_id, info in db.games_channels.items():
+        registry[channel_id] = (ActivationState.SIDE_GAMES, info)
+    for channel_id in db.event_channels:
+        registry[channel_id] = (ActivationState.EVENT, None)
+    _feature_registry = registry
+
+
+def register_channel(
+    channel_id: int, feature: ActivationState, info: Optional[Any] = None
+) -> None:
+    """
+    Records that a feature has been activated for a channel.
+    Must be called whenever a channel is added to the database.
+    """
+    if _feature_registry is None:
+        build_feature_registry()
+    _feature_registry[channel_id] = (feature, info)
+
+
+def unregister_channel(channel_id: int) -> None:
+    """
+    Records that a channel has been deactivated.
+    Must be called whenever a channel is removed from the database.
+    """
+    if _feature_registry is None:
+        build_feature_registry()
+    _feature_registry.pop(channel_id, None)
+
+
+def get_channel_feature(channel_id: int) -> Tuple[ActivationState, Optional[Any]]:
+    """
+    Returns a tuple of the ActivationState of a channel and its channel
+    information object (see `channelinformation`).
+    The information object is None for inactive channels and event channels.
+    """
+    if _feature_registry is None:
+        build_feature_registry()
+    return _feature_registry.get(channel_id, _INACTIVE_ENTRY)
+
+
 def get_active_feature(channel: discord.TextChannel) -> ActivationState:
     """
     Returns an ActivationState describing which feature is currently activated
     in a `discord.TextChannel`.
     """
-    if channel.id in db.party_channels:
-        return ActivationState.PARTY
-    elif channel.id in db.games_channels:
-        return ActivationState.SIDE_GAMES
-    elif channel.id in db.event_channels:
-        return ActivationState.EVENT
-    else:
-        return ActivationState.INACTIVE
+    return get_channel_feature(channel.id)[0]
+
+
+def get_active_feature_by_id(channel_id: int) -> ActivationState:
+    """
+    Same as `get_active_feature`, but takes a channel ID.
+    """
+    return get_channel_feature(channel_id)[0]
 
 
 def is_channel_inactive(channel: discord.TextChannel) -> bool:
@@ -3,6 +3,10 @@ BOT_TOKEN = "INSERT BOT TOKEN HERE"
 
 # Optional settings (may be changed)
 BOT_CMD_PREFIX = "$"
+# "lean" receives and caches only what the bot needs, "full" everything
+GATEWAY_PROFILE = "lean"
+# Admin roles, grace periods and the message delete delay are defaults that
+# can be changed per server with the setting command
 BOT_ADMIN_ROLES = [
     601467946858184704,  # Clan Leader
     458087769303023617,  # Clan Director
@@ -11,10 +15,26 @@ BOT_ADMIN_ROLES = [
     749112652604899419,  # CMO
 ]
 PARTY_CHANNEL_GRACE_PERIOD_SECONDS = 60
+# Hidden voice channels kept ready per party matchmaking channel
+PARTY_VOICE_CHANNEL_POOL_MIN_SIZE = 1
+PARTY_VOICE_CHANNEL_POOL_MAX_SIZE = 5
 GAMES_CHANNEL_GRACE_PERIOD_HOURS = 4
 EVENT_CHANNEL_GRACE_PERIOD_HOURS = 4
 MESSAGE_DELETE_DELAY_SECONDS = 30
+# Party messages, menus and notices kept in memory to save fetching them
+MANAGED_MESSAGE_CACHE_SIZE = 1000
+# Reaction events queued per channel before load shedding kicks in
+REACTION_QUEUE_DEPTH_SOFT_LIMIT = 20
+REACTION_QUEUE_DEPTH_HARD_LIMIT = 50
 DATABASE_FILENAME = "database.fs"
+SCHEDULER_QUEUE_FILENAME = "scheduler-queue.log"
+PARTY_EVENT_LOG_FILENAME = "party-events.bin"
+# Directory the exportstate command writes snapshots to
+SNAPSHOT_OUTPUT_DIR = "snapshots"
+# Local health check endpoint (set the port to None to disable it)
+HEALTH_CHECK_HOST = "127.0.0.1"
+HEALTH_CHECK_PORT = 8765
+# Job store of previous versions. Pending jobs are imported on startup.
 SCHEDULER_DB_FILENAME = "scheduler-db.sqlite"
 
 
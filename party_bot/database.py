@@ -2,34 +2,191 @@
 This module implements the persistency necessary to preserve channel
 configurations across bot restarts.
 
-Importing this module will create / load the database and populate the `db`
-attribute.
+Importing this module does not do any I/O. The database is opened in two
+steps during startup (see `startup`):
+- `open_storage` loads the storage file and builds its index. It blocks for a
+  while on large databases and may be run in a worker thread.
+- `open_database` opens a connection on the event loop thread, creates the
+  database object if necessary and applies outstanding migrations.
+
+Until then, the `db` attribute is a placeholder that raises a RuntimeError on
+use.
 """
 
 import BTrees
 import config
+import logging
 import persistent
+import typing
 import transaction
-import sys
 import ZODB
+import ZODB.FileStorage
+from BTrees.LLBTree import LLTreeSet
+from BTrees.LOBTree import LOBTree
 from dataclasses import dataclass
+from persistent.TimeStamp import TimeStamp
+
+logger = logging.getLogger(__name__)
+
+# Version of the database layout. Increase this and add a migration step to
+# `_migrations` whenever the layout of the stored objects changes.
+SCHEMA_VERSION = 5
 
 
 class _Database(persistent.Persistent):
+    # databases created before versioning was introduced
+    schema_version = 0
+
     def __init__(self):
-        self.party_channels = persistent.mapping.PersistentMapping()
-        self.games_channels = persistent.mapping.PersistentMapping()
-        self.event_channels = BTrees.OOBTree.OOSet()
-        self.event_voice_channels = BTrees.OOBTree.OOSet()
-
-
-sys.stdout.write("Starting database...")
-connection = ZODB.connection(config.DATABASE_FILENAME)
-root = connection.root
-if not hasattr(root, "db"):
-    database = _Database()
-    root.db = database
+        self.party_channels = LOBTree()
+        self.games_channels = LOBTree()
+        self.event_channels = LLTreeSet()
+        self.event_voice_channels = LLTreeSet()
+        # channel id -> IDs of messages posted by the bot (see `message_registry`)
+        self.bot_messages = LOBTree()
+        # guild id -> overridden settings (see `guild_settings`)
+        self.guild_settings = LOBTree()
+        self.schema_version = SCHEMA_VERSION
+
+
+def _migrate_integer_btrees(db):
+    """
+    Moves all ID-keyed containers from PersistentMapping / OOSet to integer
+    keyed BTrees, which store IDs unboxed and only rewrite changed buckets.
+    """
+    party_channels = LOBTree()
+    party_channels.update(db.party_channels)
+    games_channels = LOBTree()
+    games_channels.update(db.games_channels)
+    db.party_channels = party_channels
+    db.games_channels = games_channels
+    db.event_channels = LLTreeSet(db.event_channels)
+    db.event_voice_channels = LLTreeSet(db.event_voice_channels)
+
+    for info in list(party_channels.values()) + list(games_channels.values()):
+        info.migrate_integer_btrees()
+
+
+def _migrate_party_message_index(db):
+    """
+    Adds the party message -> party members index that allows clearing party
+    affiliations as soon as a party message is deleted.
+    """
+    for info in db.party_channels.values():
+        info.migrate_party_message_index()
+
+
+def _migrate_voice_channel_pool(db):
+    """
+    Adds the pool of hidden voice channels to all party channels.
+    """
+    for info in db.party_channels.values():
+        info.migrate_voice_channel_pool()
+
+
+def _add_bot_message_registry(db):
+    """
+    Adds the registry of messages posted by the bot, see `message_registry`.
+    """
+    db.bot_messages = LOBTree()
+
+
+def _add_guild_settings(db):
+    """
+    Adds the per-guild settings, see `guild_settings`.
+    """
+    db.guild_settings = LOBTree()
+
+
+# schema version -> migration step upgrading the database to that version
+_migrations = {
+    1: _migrate_integer_btrees,
+    2: _migrate_party_message_index,
+    3: _migrate_voice_channel_pool,
+    4: _add_bot_message_registry,
+    5: _add_guild_settings,
+}
+
+
+def migrate(db):
+    """
+    Upgrades the database to `SCHEMA_VERSION`, applying all outstanding
+    migration steps in a single transaction.
+    """
+    if db.schema_version >= SCHEMA_VERSION:
+        return
+
+    for version in range(db.schema_version + 1, SCHEMA_VERSION + 1):
+        logger.info("Migrating database to version %d", version)
+        _migrations[version](db)
+        db.schema_version = version
     transaction.commit()
 
-db = root.db
-sys.stdout.write("done\n")
+
+class _DatabaseProxy:
+    """
+    Stands in for the `_Database` object stored in the database, so that other
+    modules can import `db` before the database has been opened.
+    """
+
+    def __getattr__(self, name):
+        if _db is None:
+            raise RuntimeError("The database has not been opened yet.")
+        return getattr(_db, name)
+
+    def __setattr__(self, name, value):
+        if _db is None:
+            raise RuntimeError("The database has not been opened yet.")
+        setattr(_db, name, value)
+
+
+_db = None
+db = _DatabaseProxy()
+connection = None
+root = None
+
+
+def open_storage() -> ZODB.FileStorage.FileStorage:
+    """
+    Opens the database file. Does not touch any shared state, so it may be run
+    in a worker thread.
+    """
+    logger.info("Opening database storage %s", config.DATABASE_FILENAME)
+    return ZODB.FileStorage.FileStorage(config.DATABASE_FILENAME)
+
+
+def open_database(storage: ZODB.FileStorage.FileStorage) -> None:
+    """
+    Opens the database connection and populates the `db` attribute.
+    Must be called from the thread that commits transactions, i.e. the event
+    loop thread.
+    """
+    global _db, connection, root
+    connection = ZODB.DB(storage).open()
+    root = connection.root
+    if not hasattr(root, "db"):
+        root.db = _Database()
+        transaction.commit()
+
+    _db = root.db
+    migrate(_db)
+    logger.info("Database opened")
+
+
+def last_commit_time() -> typing.Optional[float]:
+    """
+    Returns the time of the last committed transaction in seconds since the
+    epoch, or None if the database has not been opened yet.
+    """
+    if connection is None:
+        return None
+    return TimeStamp(connection.db().lastTransaction()).timeTime()
+
+
+def cache_size() -> int:
+    """
+    Returns the amount of objects in the database's object cache.
+    """
+    if connection is None:
+        return 0
+    return connection.db().cacheSize()
@@ -0,0 +1,145 @@
+"""
+This module implements the suppression of duplicate and flapping reaction
+events before they reach the (expensive) reaction handlers.
+
+Discord may deliver the same reaction event more than once (e.g. after a
+gateway resume) and users tend to double-click.
+Every event that makes it through `emoji_handling.handle_react` costs at least
+two API calls and a database commit, so events that cannot change anything
+are dropped as early as possible.
+"""
+
+import time
+import typing
+from collections import OrderedDict
+
+import discord
+
+# Events for the same (message, user, emoji) that are further apart than this
+# are treated independently.
+DEDUPE_WINDOW_SECONDS = 10
+
+# Maximum amount of (message, user, emoji) keys tracked at the same time.
+DEDUPE_MAX_ENTRIES = 4096
+
+
+class _Entry:
+    __slots__ = ("seq", "seen_added", "seen_at", "applied_added", "applied_at")
+
+    def __init__(self):
+        self.seq = 0
+        self.seen_added = None
+        self.seen_at = 0.0
+        self.applied_added = None
+        self.applied_at = 0.0
+
+
+class ReactionTicket(typing.NamedTuple):
+    """
+    Returned by `ReactionDeduplicator.register` for events that have to be
+    handled. Must be passed to `ReactionDeduplicator.should_process` right
+    before the event is handled.
+    """
+
+    key: typing.Tuple[int, int, str]
+    seq: int
+    added: bool
+
+
+class ReactionDeduplicator:
+    """
+    Bounded, time-windowed cache of recent reaction events.
+
+    Events go through two stages:
+    - `register` is called as soon as the event arrives. Exact duplicates of
+      the previous event for the same (message, user, emoji) are dropped here.
+    - `should_process` is called right before the event is handled (i.e. after
+      acquiring the reaction lock). An event is dropped if a newer event for
+      the same key arrived in the meantime (the newer event carries the net
+      effect) or if the last handled event already had the same effect.
+      This collapses add/remove/add flapping into a single handled event.
+    """
+
+    def __init__(
+        self, window_seconds=DEDUPE_WINDOW_SECONDS, max_entries=DEDUPE_MAX_ENTRIES
+    ):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._seq = 0
+
+        # statistics
+        self.duplicates_suppressed = 0
+        self.flaps_collapsed = 0
+        self.no_ops_suppressed = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def register(
+        self, payload: discord.RawReactionActionEvent, added: bool
+    ) -> typing.Optional[ReactionTicket]:
+        """
+        Registers a newly arrived reaction event.
+        Returns None if the event is an exact duplicate and should be dropped.
+        """
+        now = time.monotonic()
+        key = (payload.message_id, payload.user_id, str(payload.emoji))
+
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _Entry()
+            self._entries[key] = entry
+            self._evict()
+        else:
+            self._entries.move_to_end(key)
+            if entry.seen_added == added and now - entry.seen_at < self.window_seconds:
+                self.duplicates_suppressed += 1
+                return None
+
+        self._seq += 1
+        entry.seq = self._seq
+        entry.seen_added = added
+        entry.seen_at = now
+        return ReactionTicket(key, self._seq, added)
+
+    def should_process(self, ticket: ReactionTicket) -> bool:
+        """
+        Returns True if and only if the event described by the ticket still
+        has to be handled.
+        Marks the event as handled if True is returned.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(ticket.key)
+        if entry is None:
+            return True  # evicted, can't tell
+
+        if entry.seq != ticket.seq:
+            self.flaps_collapsed += 1
+            return False  # superseded by a newer event
+
+        if (
+            entry.applied_added == ticket.added
+            and now - entry.applied_at < self.window_seconds
+        ):
+            self.no_ops_suppressed += 1
+            return False  # net effect is nothing
+
+        entry.applied_added = ticket.added
+        entry.applied_at = now
+        return True
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "tracked": len(self._entries),
+            "duplicates_suppressed": self.duplicates_suppressed,
+            "flaps_collapsed": self.flaps_collapsed,
+            "no_ops_suppressed": self.no_ops_suppressed,
+        }
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+reaction_deduplicator = ReactionDeduplicator()
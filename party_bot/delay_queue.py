@@ -0,0 +1,360 @@
+"""
+This module implements a small persistent delay queue that runs "call X at
+time T" jobs.
+
+Pending jobs are kept in an in-memory heap. Every change is appended to a
+compact log file (one JSON array per line) so that pending jobs survive bot
+restarts. The log is compacted when it is loaded and whenever it contains
+considerably more finished than pending jobs.
+
+Jobs refer to their function by name (`module:qualname`), so job arguments
+must be JSON-serializable. Functions that have to be passed as arguments can
+be converted using `callable_name` and `resolve_callable`.
+
+Jobs that are overdue when the queue is started (e.g. after downtime) are not
+executed all at once. Instead, they are drained in the background at a bounded
+pace, giving way to live events (see `synchronization.is_busy`). Overdue jobs
+of functions with a registered batch handler are merged into batches.
+"""
+
+import asyncio
+import heapq
+import importlib
+import json
+import logging
+import os
+import time
+import typing
+
+import synchronization
+import transaction
+
+logger = logging.getLogger(__name__)
+
+# Once a job is due, the runner waits this long and then executes all jobs
+# that are due by then together, followed by a single database commit. Jobs
+# are never executed before they are due.
+BATCH_WINDOW_SECONDS = 0.1
+
+# The log is compacted once it contains this many finished jobs and more
+# finished than pending jobs.
+COMPACT_MIN_FINISHED = 1000
+
+# Jobs that are overdue by more than this when the queue is started are
+# handled by the catch-up mode.
+CATCH_UP_THRESHOLD_SECONDS = 5
+
+# Catch-up mode: pause between starting two jobs (or batches) and maximum
+# amount of jobs (or batches) in flight.
+CATCH_UP_INTERVAL_SECONDS = 0.5
+CATCH_UP_MAX_IN_FLIGHT = 2
+
+# Catch-up mode: maximum time to wait for live events to finish before running
+# the next job anyway.
+CATCH_UP_MAX_YIELD_SECONDS = 5
+
+_ADD = "a"
+_DONE = "d"
+
+
+class Job(typing.NamedTuple):
+    id: int
+    due: float  # seconds since the epoch
+    func: str
+    args: list
+
+
+def callable_name(func: typing.Callable) -> str:
+    """
+    Returns the name under which a module-level function can be stored in the
+    delay queue.
+    """
+    return f"{func.__module__}:{func.__qualname__}"
+
+
+def resolve_callable(name: str) -> typing.Callable:
+    """
+    Returns the function stored under a name returned by `callable_name`.
+    """
+    module_name, qualname = name.split(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _encode(record) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+class DelayQueue:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._jobs = {}  # job id -> Job
+        self._heap = []  # (due, job id)
+        self._in_flight = {}  # job id -> Job, taken from the heap but not finished
+        self._next_id = 1
+        self._finished_in_log = 0
+        self._log = None
+        self._wakeup = None
+        self._runner = None
+        self._batch_handlers = {}  # function name -> (key, batch function, size)
+
+        # catch-up progress
+        self.backlog_total = 0
+        self.backlog_done = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def load(self) -> None:
+        """
+        Loads all pending jobs from the log file and compacts it.
+        """
+        if os.path.exists(self.filename):
+            with open(self.filename, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write at the end of the log
+                    if record[0] == _ADD:
+                        job = Job(*record[1:])
+                        self._jobs[job.id] = job
+                        self._next_id = max(self._next_id, job.id + 1)
+                    elif record[0] == _DONE:
+                        self._jobs.pop(record[1], None)
+
+        self._heap = [(job.due, job.id) for job in self._jobs.values()]
+        heapq.heapify(self._heap)
+        self.compact()
+
+    def register_batch_handler(
+        self,
+        func: typing.Callable,
+        batch_func: typing.Callable,
+        key: typing.Callable[[list], typing.Hashable],
+        max_batch_size: int,
+    ) -> None:
+        """
+        Allows overdue jobs of `func` to be executed in batches during catch-up.
+
+        Overdue jobs with the same `key(args)` are merged into batches of at
+        most `max_batch_size` jobs and `batch_func(list_of_args)` is called
+        once per batch instead of calling `func` once per job.
+        """
+        self._batch_handlers[callable_name(func)] = (batch_func, key, max_batch_size)
+
+    def start(self) -> None:
+        """
+        Starts executing jobs. Must be called from within the event loop.
+        """
+        self._wakeup = asyncio.Event()
+        overdue = self._pop_due(time.time() - CATCH_UP_THRESHOLD_SECONDS)
+        if len(overdue) > 0:
+            asyncio.ensure_future(self._catch_up(overdue))
+        self._runner = asyncio.ensure_future(self._run())
+
+    def running(self) -> bool:
+        return self._runner is not None
+
+    def catching_up(self) -> bool:
+        return self.backlog_done < self.backlog_total
+
+    def schedule(self, func: typing.Callable, args: list, delay: float) -> int:
+        """
+        Schedules `func(*args)` to be executed in `delay` seconds and returns
+        the ID of the job.
+        """
+        return self.schedule_at(callable_name(func), args, time.time() + delay)
+
+    def schedule_at(self, func_name: str, args: list, due: float) -> int:
+        job = Job(self._next_id, due, func_name, list(args))
+        self._next_id += 1
+        self._write([_ADD, *job])
+        self._jobs[job.id] = job
+
+        earliest = len(self._heap) == 0 or due < self._heap[0][0]
+        heapq.heappush(self._heap, (due, job.id))
+        if earliest and self._wakeup is not None:
+            self._wakeup.set()  # runner has to wake up earlier
+        return job.id
+
+    def cancel(self, job_id: int) -> None:
+        """
+        Removes a pending job. Raises a KeyError if there is no such job.
+        """
+        del self._jobs[job_id]  # heap entry is skipped when it falls due
+        self._write([_DONE, job_id])
+        self._finished_in_log += 1
+
+    def pending_jobs(self) -> typing.List[Job]:
+        """
+        Returns all jobs that are not finished yet, including jobs that are
+        being executed or caught up on right now.
+        """
+        jobs = list(self._jobs.values()) + list(self._in_flight.values())
+        return sorted(jobs, key=lambda job: job.due)
+
+    def overdue_count(self) -> int:
+        """
+        Returns the amount of pending jobs that are due already.
+        """
+        now = time.time()
+        return sum(1 for job in self._jobs.values() if job.due <= now)
+
+    def compact(self) -> None:
+        """
+        Rewrites the log file so that it only contains pending jobs.
+        """
+        if self._log is not None:
+            self._log.close()
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            for job in self.pending_jobs():
+                f.write(_encode([_ADD, *job]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+        self._finished_in_log = 0
+        self._log = open(self.filename, "a")
+
+    def _write(self, record):
+        self._log.write(_encode(record))
+        self._log.flush()
+
+    def _pop_due(self, until: float) -> typing.List[Job]:
+        jobs = []
+        while len(self._heap) > 0 and self._heap[0][0] <= until:
+            _, job_id = heapq.heappop(self._heap)
+            job = self._jobs.pop(job_id, None)
+            if job is not None:  # skip cancelled jobs
+                self._in_flight[job.id] = job
+                jobs.append(job)
+        return jobs
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if len(self._heap) == 0:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    continue  # an earlier job was scheduled
+                except asyncio.TimeoutError:
+                    pass
+
+            # collect jobs falling due shortly after by waiting for them
+            await asyncio.sleep(BATCH_WINDOW_SECONDS)
+            batch = self._pop_due(time.time())
+            if len(batch) > 0:
+                try:
+                    await self._execute(batch)
+                except Exception:
+                    # keep the runner alive, all later jobs depend on it
+                    logger.exception("Batch of %d scheduled jobs failed", len(batch))
+
+    async def _catch_up(self, jobs: typing.List[Job]) -> None:
+        units = self._merge_batches(jobs)
+        self.backlog_total = len(jobs)
+        self.backlog_done = 0
+        logger.info(
+            "Catching up on %d overdue jobs (%d after merging batches)",
+            len(jobs),
+            len(units),
+        )
+
+        in_flight = asyncio.Semaphore(CATCH_UP_MAX_IN_FLIGHT)
+        tasks = []
+        for batch_func, unit in units:
+            await self._yield_to_live_events()
+            await in_flight.acquire()
+            tasks.append(
+                asyncio.ensure_future(self._catch_up_unit(batch_func, unit, in_flight))
+            )
+            await asyncio.sleep(CATCH_UP_INTERVAL_SECONDS)
+        await asyncio.gather(*tasks)
+        logger.info("Caught up on %d overdue jobs", self.backlog_done)
+
+    def _merge_batches(self, jobs):
+        units = []
+        batches = {}
+        for job in jobs:
+            handler = self._batch_handlers.get(job.func)
+            if handler is None:
+                units.append((None, [job]))
+                continue
+            batch_func, key, max_batch_size = handler
+            batch = batches.get((job.func, key(job.args)))
+            if batch is None or len(batch) >= max_batch_size:
+                batch = []
+                batches[(job.func, key(job.args))] = batch
+                units.append((batch_func, batch))
+            batch.append(job)
+        return units
+
+    async def _yield_to_live_events(self):
+        deadline = time.monotonic() + CATCH_UP_MAX_YIELD_SECONDS
+        while synchronization.is_busy() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def _catch_up_unit(self, batch_func, jobs, in_flight):
+        try:
+            if batch_func is None:
+                await self._execute(jobs)
+            else:
+                await self._execute_batch_func(batch_func, jobs)
+        except Exception:
+            logger.exception("Batch of %d overdue jobs failed", len(jobs))
+        finally:
+            in_flight.release()
+
+        previous_percent = self.backlog_done * 10 // self.backlog_total
+        self.backlog_done += len(jobs)
+        if self.backlog_done * 10 // self.backlog_total > previous_percent:
+            logger.info(
+                "Catch-up: %d/%d jobs done", self.backlog_done, self.backlog_total
+            )
+
+    async def _execute_batch_func(self, batch_func, jobs):
+        try:
+            ret = batch_func([job.args for job in jobs])
+            if asyncio.iscoroutine(ret):
+                await ret
+        except Exception:
+            logger.exception("Batch of %d scheduled jobs failed", len(jobs))
+        self._finish(jobs)
+
+    async def _execute(self, batch: typing.List[Job]) -> None:
+        await asyncio.gather(*[self._execute_job(job) for job in batch])
+        self._finish(batch)
+
+    def _finish(self, batch: typing.List[Job]) -> None:
+        # If the commit fails, the exception propagates to the caller and the
+        # jobs stay pending (in flight), so they run again after a restart.
+        # The transaction is shared with all event handlers, so it is not
+        # aborted here.
+        transaction.commit()
+
+        for job in batch:
+            del self._in_flight[job.id]
+        self._log.writelines(_encode([_DONE, job.id]) for job in batch)
+        self._log.flush()
+        self._finished_in_log += len(batch)
+        if (
+            self._finished_in_log >= COMPACT_MIN_FINISHED
+            and self._finished_in_log > len(self._jobs)
+        ):
+            self.compact()
+
+    async def _execute_job(self, job: Job) -> None:
+        try:
+            ret = resolve_callable(job.func)(*job.args)
+            if asyncio.iscoroutine(ret):
+                await ret
+        except Exception:
+            logger.exception("Scheduled job %s%s failed", job.func, tuple(job.args))
@@ -9,17 +9,27 @@ import channelinformation
 import checks
 import config
 import discord
+import guild_settings
+import logging
 import party
 import re
+import rest
 import scheduling
-import sys
+import time
 import transaction
 import typing
 from database import db
+from deduplication import reaction_deduplicator, ReactionTicket
 from discord.utils import get
 from emojis import Emojis
+from load_shedding import reaction_load_shedder, shed_reaction_remover
+from logging_config import set_log_context
+from message_cache import managed_messages
 from reaction_payload import ReactionPayload, unwrap_payload
-from synchronization import synchronized
+from reaction_seeding import reaction_seeder
+from synchronization import synchronized, synchronized_per_key
+
+logger = logging.getLogger(__name__)
 
 # handle emoji reactions being added / deleted
 # Format:
@@ -36,7 +46,6 @@ party_emoji_handlers = {
 }
 
 
-@synchronized
 async def handle_react(payload: discord.RawReactionActionEvent, added: bool) -> None:
     """
     Executes the correct emoji handler for the specified `ReactionPayload`.
@@ -46,61 +55,141 @@ async def handle_react(payload: discord.RawReactionActionEvent, added: bool) ->
 
     For games channels, the generic games channels emoji handler is called.
 
-    Note that this function is synchronized.
-    Simultaneous calls to this function will be blocked and executed
-    sequentially.
+    Duplicate events and events that are superseded by a newer event for the
+    same message, user and emoji are dropped before doing any API calls (see
+    `deduplication.ReactionDeduplicator`). So are events that can't succeed
+    and events exceeding the channel's queue depth limits (see
+    `load_shedding`). The reactions of shed added events are removed in the
+    background.
+
+    This function itself is not synchronized, so events are filtered as soon
+    as they arrive. The remaining events in party matchmaking channels are
+    handled one at a time per member, together with the member's party
+    buttons (see `party.handle_party_interaction`). All other events are
+    handled one at a time by `_handle_react`, which is synchronized.
     """
-
-    rp = await unwrap_payload(payload)
-
-    if rp.member == rp.guild.me:
-        return  # ignore bot reactions
-
-    if checks.is_channel_inactive(rp.channel):
+    feature, channel_info = checks.get_channel_feature(payload.channel_id)
+    if feature == checks.ActivationState.INACTIVE:
         return  # ignore reactions in unrelated channels
 
-    # Track whether the reaction should be kept or removed
-    keep_reaction = False
+    if not reaction_load_shedder.admit(payload, added, feature, channel_info):
+        if added:
+            shed_reaction_remover.remove(payload)
+        return  # shed
+    try:
+        ticket = reaction_deduplicator.register(payload, added)
+        if ticket is None:
+            return  # duplicate event
+        if feature == checks.ActivationState.PARTY:
+            await _handle_party_react(payload, ticket)
+        else:
+            await _handle_react(payload, ticket)
+    finally:
+        reaction_load_shedder.done(payload)
 
-    if checks.is_party_channel(rp.channel):
-        if rp.message.author != rp.guild.me:
-            return  # ignore reactions on non-bot messages
 
-        # ignore reactions on messages other than the party message
-        # (identified by having exactly one embed)
-        if len(rp.message.embeds) != 1:
-            return
+@synchronized_per_key(
+    lambda payload, ticket: (payload.guild_id, payload.user_id), party.member_locks
+)
+async def _handle_party_react(
+    payload: discord.RawReactionActionEvent, ticket: ReactionTicket
+) -> None:
+    await _process_react(payload, ticket)
 
-        if str(rp.emoji) not in party_emoji_handlers:
-            await rp.message.remove_reaction(rp.emoji, rp.member)
-            return
 
-        # call appropriate handler
-        add, remove = party_emoji_handlers[str(rp.emoji)]
-        if added and add is not None:
-            keep_reaction = await add(rp)
-        elif not added and remove is not None:
-            await remove(rp)
+@synchronized
+async def _handle_react(
+    payload: discord.RawReactionActionEvent, ticket: ReactionTicket
+) -> None:
+    await _process_react(payload, ticket)
+
+
+async def _process_react(
+    payload: discord.RawReactionActionEvent, ticket: ReactionTicket
+) -> None:
+    added = ticket.added
+    feature, channel_info = checks.get_channel_feature(payload.channel_id)
+    if feature == checks.ActivationState.INACTIVE:
+        return  # channel was deactivated in the meantime
+    # shed events must not count as handled by the deduplicator, otherwise
+    # a retry of the reaction would be dropped as a no-op
+    if not reaction_load_shedder.still_relevant(payload, added, feature, channel_info):
+        if added:
+            shed_reaction_remover.remove(payload)
+        return  # party is gone or full by now
+
+    if not reaction_deduplicator.should_process(ticket):
+        return  # superseded or without net effect
+
+    if payload.user_id == config.bot.user.id:
+        return  # ignore bot reactions
 
-    if checks.is_side_games_channel(rp.channel) and added:
-        await handle_react_side_games(rp)
-        keep_reaction = False
+    start = time.perf_counter()
+    set_log_context(
+        guild_id=payload.guild_id,
+        channel_id=payload.channel_id,
+        message_id=payload.message_id,
+        member_id=payload.user_id,
+        handler="handle_react",
+    )
+    try:
+        rp = await unwrap_payload(payload)
 
-    if checks.is_event_channel(rp.channel) and added:
-        await handle_react_event_channel(rp)
+        # Track whether the reaction should be kept or removed
         keep_reaction = False
 
+        if feature == checks.ActivationState.PARTY:
+            if rp.message.author != rp.guild.me:
+                return  # ignore reactions on non-bot messages
+
+            # ignore reactions on messages other than the party message
+            # (identified by having exactly one embed)
+            if len(rp.message.embeds) != 1:
+                return
+
+            if str(rp.emoji) not in party_emoji_handlers:
+                await rp.message.remove_reaction(rp.emoji, rp.member)
+                return
+
+            # call appropriate handler
+            add, remove = party_emoji_handlers[str(rp.emoji)]
+            if added and add is not None:
+                keep_reaction = await add(rp)
+            elif not added and remove is not None:
+                await remove(rp)
+
+        if feature == checks.ActivationState.SIDE_GAMES and added:
+            await handle_react_side_games(rp, channel_info)
+            keep_reaction = False
+
+        if feature == checks.ActivationState.EVENT and added:
+            await handle_react_event_channel(rp)
+            keep_reaction = False
+    except rest.FAILURES:
+        # the handlers only record the steps that succeeded, keep them
+        transaction.commit()
+        logger.warning("Handling reaction failed.", exc_info=True)
+        return
+
+    # save database
+    transaction.commit()
+
     if not keep_reaction:
         try:
             await rp.message.remove_reaction(rp.emoji, rp.member)
         except discord.NotFound:
             pass  # message was already deleted
-
-    # save database
-    transaction.commit()
+    logger.debug(
+        "Handled reaction %s (added: %s)",
+        rp.emoji,
+        added,
+        extra={"latency": f"{(time.perf_counter() - start) * 1000:.0f}ms"},
+    )
 
 
-async def handle_react_side_games(rp: ReactionPayload) -> None:
+async def handle_react_side_games(
+    rp: ReactionPayload, channel_info: channelinformation.GamesChannelInformation
+) -> None:
     """
     Reaction handler for the side games voice channel feature.
     """
@@ -108,17 +197,12 @@ async def handle_react_side_games(rp: ReactionPayload) -> None:
     if game_name is None:
         return  # unknown emoji, ignore reaction
 
-    channel_info = db.games_channels[rp.channel.id]
-
     # check if user already created a party channel
     vc_id = channel_info.channel_owners.get(rp.member.id)
     if vc_id is not None:
         # make sure it's actually still there
         if rp.guild.get_channel(vc_id) is None:
-            print(
-                f"VC deletion was not tracked!\n" f"- Owner: {rp.member}\n",
-                file=sys.stderr,
-            )
+            logger.warning("VC deletion was not tracked! Owner: %s", rp.member)
             del channel_info.channel_owners[rp.member.id]
         else:
             message = await rp.channel.send(
@@ -136,18 +220,22 @@ async def handle_react_side_games(rp: ReactionPayload) -> None:
     )
     category = rp.guild.get_channel(channel_below.category_id)
 
-    vc = await rp.guild.create_voice_channel(
-        f"{game_name} - #{counter}", category=category
+    vc = await rest.call(
+        "create_channel",
+        rp.guild.create_voice_channel,
+        f"{game_name} - #{counter}",
+        category=category,
     )
-    await vc.edit(position=channel_below_position + 0)
+    # track the channel right away, the following calls may fail
     channel_info.channel_owners.update({rp.member.id: vc.id})
-    prot_delay_hours = config.GAMES_CHANNEL_GRACE_PERIOD_HOURS
+    prot_delay_hours = guild_settings.get(rp.guild.id).games_channel_grace_period_hours
     scheduling.channel_start_grace_period(
         vc,
         prot_delay_hours * 3600,
         delete_callback=side_games_deletion_callback,
         delete_callback_args=[rp.channel.id],
     )
+    await rest.call("edit_channel", vc.edit, position=channel_below_position + 0)
 
     message = await rp.channel.send(
         f"{rp.member.mention} "
@@ -189,18 +277,21 @@ async def handle_react_event_channel(rp: ReactionPayload) -> None:
         if channel.name.startswith(f"{game_name} - #"):
             counter += 1
 
-    vc = await rp.guild.create_voice_channel(
-        f"{game_name} - #{counter}", category=category
+    vc = await rest.call(
+        "create_channel",
+        rp.guild.create_voice_channel,
+        f"{game_name} - #{counter}",
+        category=category,
     )
+    # track the channel right away, the following calls may fail
     db.event_voice_channels.add(vc.id)
+    prot_delay_hours = guild_settings.get(rp.guild.id).event_channel_grace_period_hours
+    scheduling.channel_start_grace_period(vc, prot_delay_hours * 3600)
 
     if position:  # if True the channel will be created above channel_position
-        await vc.edit(position=channel_position + 0)
+        await rest.call("edit_channel", vc.edit, position=channel_position + 0)
     else:  # else (False) it will be created below channel_position
-        await vc.edit(position=channel_position + 1)
-
-    prot_delay_hours = config.EVENT_CHANNEL_GRACE_PERIOD_HOURS
-    scheduling.channel_start_grace_period(vc, prot_delay_hours * 3600)
+        await rest.call("edit_channel", vc.edit, position=channel_position + 1)
 
     message = await rp.channel.send(
         f"{rp.member.mention} "
@@ -233,6 +324,34 @@ def side_games_deletion_callback(voice_channel, games_channel_id):
             break
 
 
+def get_menu_emojis(message: discord.Message) -> typing.Optional[typing.List[str]]:
+    """
+    Scans the message for menu entries (see `activate_side_games` and
+    `activate_event_channel` commands) and returns the emojis of all entries
+    in menu order.
+    Note that the emojis are returned in their string representation (as
+    returned by `str(emoji)`).
+
+    Returns None for messages that can't be menu messages, i.e. messages made
+    by non-admins and messages in channels for which neither the side games
+    nor the event voice channel feature is enabled.
+    """
+    feature = checks.get_active_feature(message.channel)
+    if feature not in (
+        checks.ActivationState.SIDE_GAMES,
+        checks.ActivationState.EVENT,
+    ):
+        return None  # ignore messages in non-games channels
+    if not checks.is_admin(message.author):
+        return None  # ignore non-admin message
+    if checks.author_is_me(message):
+        return None  # ignore bot messages
+
+    if feature == checks.ActivationState.EVENT:
+        return list(get_emoji_event_channels_translations(message).keys())
+    return list(get_emoji_side_game_translations(message).keys())
+
+
 async def add_first_emojis(message):
     """
     Scans the message for menu entries (see `activate_side_games` command) and
@@ -242,23 +361,35 @@ async def add_first_emojis(message):
     Note that messages made by non-admins and messages in channels for which
     the side games voice channel feature is not enabled are ignored.
     """
-    if not checks.is_admin(message.author):
-        return  # ignore non-admin message
-    if checks.author_is_me(message):
-        return  # ignore bot messages
+    emojis = get_menu_emojis(message)
+    if emojis is None:
+        return
 
-    if checks.is_event_channel(message.channel):
-        translations = get_emoji_event_channels_translations(message)
-        for emoji in translations.keys():
-            await message.add_reaction(emoji)
-        return  # return if message in event channel
+    managed_messages.put(message)
+    reaction_seeder.seed(message, emojis)
 
-    if not checks.is_side_games_channel(message.channel):
-        return  # ignore messages in non-games channels
 
-    translations = get_emoji_side_game_translations(message)
-    for emoji in translations.keys():
-        await message.add_reaction(emoji)
+async def sync_menu_emojis(message):
+    """
+    Updates the bot's emoji reactions of an edited menu message.
+
+    Only emojis of new menu entries are added and only emojis of removed menu
+    entries are cleared. Reactions that are still part of the menu are left
+    untouched, so editing the text of a menu costs no reaction API calls.
+    """
+    emojis = get_menu_emojis(message)
+    if emojis is None:
+        return
+
+    present = {str(reaction.emoji): reaction for reaction in message.reactions}
+    for emoji, reaction in present.items():
+        if emoji not in emojis:
+            await message.clear_reaction(reaction.emoji)
+
+    missing = [
+        emoji for emoji in emojis if emoji not in present or not present[emoji].me
+    ]
+    reaction_seeder.seed(message, missing)
 
 
 def get_emoji_side_game_translations(message: discord.Message) -> typing.Dict[str, str]:
@@ -7,9 +7,11 @@ This module defines
   This error handler should be called from `bot.on_command_error`.
 """
 
-import traceback
+import logging
 from discord.ext import commands
 
+logger = logging.getLogger(__name__)
+
 
 class ChannelAlreadyActiveError(commands.CommandError):
     pass
@@ -27,6 +29,14 @@ class NoActivePartyError(commands.CommandError):
     pass
 
 
+class ProfilingAlreadyRunningError(commands.CommandError):
+    pass
+
+
+class AdminLockoutError(commands.CommandError):
+    pass
+
+
 async def handle_error(ctx: commands.Context, error: commands.CommandError) -> None:
     """
     Global error handler.
@@ -84,6 +94,17 @@ async def handle_error(ctx: commands.Context, error: commands.CommandError) -> N
         )
         return
 
+    if isinstance(error, ProfilingAlreadyRunningError):
+        await ctx.send(f"{ctx.author.mention} A profiling session is already running.")
+        return
+
+    if isinstance(error, AdminLockoutError):
+        await ctx.send(
+            f"{ctx.author.mention} You must have at least one of the new admin "
+            f"roles, otherwise you would lock yourself out."
+        )
+        return
+
     # Unknown command
     if isinstance(error, commands.CommandNotFound):
         return  # ignore
@@ -94,4 +115,14 @@ async def handle_error(ctx: commands.Context, error: commands.CommandError) -> N
         f"Please contact the programming team and tell us what you did "
         f"to produce this error."
     )
-    traceback.print_exception(type(error), error, error.__traceback__)
+    logger.error(
+        "Unhandled error in command %s",
+        ctx.command,
+        exc_info=(type(error), error, error.__traceback__),
+        extra={
+            "guild_id": ctx.guild.id if ctx.guild is not None else None,
+            "channel_id": ctx.channel.id,
+            "member_id": ctx.author.id,
+            "handler": "on_command_error",
+        },
+    )
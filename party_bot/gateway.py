@@ -0,0 +1,48 @@
+"""
+This module configures which gateway events the bot receives and which
+members discord.py keeps in memory.
+
+`GATEWAY_PROFILE` selects one of
+- "lean" (default): only the events the handlers need (guilds, messages and
+  reactions in guilds, voice states and member updates). Presences and typing
+  events are not received, guilds are not chunked at startup and only members
+  that are connected to a voice channel are cached. All other members are
+  resolved lazily from event payloads or fetched on demand.
+- "full": all events and all members, as in previous versions. Use this if
+  something relies on the member cache being complete.
+"""
+
+import config
+import discord
+
+GATEWAY_PROFILE = getattr(config, "GATEWAY_PROFILE", "lean")
+
+
+def get_intents() -> discord.Intents:
+    if GATEWAY_PROFILE == "full":
+        return discord.Intents.all()
+    return discord.Intents(
+        guilds=True,
+        # role changes invalidate the admin cache (see `checks.is_admin`)
+        members=True,
+        voice_states=True,
+        guild_messages=True,
+        guild_reactions=True,
+        # prefix commands
+        message_content=True,
+    )
+
+
+def get_member_cache_flags() -> discord.MemberCacheFlags:
+    if GATEWAY_PROFILE == "full":
+        return discord.MemberCacheFlags.all()
+    # voice channel members are needed to notice empty party voice channels
+    return discord.MemberCacheFlags(voice=True, joined=False)
+
+
+def chunk_guilds_at_startup() -> bool:
+    return GATEWAY_PROFILE == "full"
+
+
+def member_cache_size(bot) -> int:
+    return sum(len(guild.members) for guild in bot.guilds)
@@ -0,0 +1,156 @@
+"""
+This module implements per-guild settings, so that a single bot process can
+serve several communities with different admin roles, grace periods etc.
+
+Guilds only store the settings they override (in `db.guild_settings`), all
+other settings fall back to `config.py`. Settings are read through `get`,
+which returns an immutable `GuildSettings` snapshot. Snapshots are cached per
+guild and replaced as a whole whenever a setting changes, so reading a
+setting costs a single dict lookup and handlers never see half-applied
+changes.
+
+Settings are edited with the `settings`, `setting` and `resetsetting`
+commands.
+"""
+
+import config
+import discord
+import re
+import typing
+from BTrees.OOBTree import OOBTree
+from database import db
+
+
+class GuildSettings(typing.NamedTuple):
+    admin_roles: typing.FrozenSet[int]
+    party_channel_grace_period_seconds: int
+    games_channel_grace_period_hours: int
+    event_channel_grace_period_hours: int
+    message_delete_delay_seconds: int
+
+
+class AdminLockoutError(ValueError):
+    """
+    Raised when new admin roles would lock out the member changing them.
+    """
+
+
+def _parse_role_ids(value: str, invoker: discord.Member) -> typing.Tuple[int, ...]:
+    # role IDs or role mentions of roles of the guild, separated by spaces
+    role_ids = tuple(int(id) for id in re.findall(r"\d+", value))
+    if len(role_ids) == 0:
+        raise ValueError(value)
+    if any(invoker.guild.get_role(role_id) is None for role_id in role_ids):
+        raise ValueError(value)
+    if not any(invoker.get_role(role_id) is not None for role_id in role_ids):
+        raise AdminLockoutError(value)
+    return role_ids
+
+
+def _parse_duration(value: str, invoker: discord.Member) -> int:
+    duration = int(value)
+    if duration < 0:
+        raise ValueError(value)
+    return duration
+
+
+# setting -> parses a command argument of the invoking member into the value
+# stored in the database
+_PARSERS = {
+    "admin_roles": _parse_role_ids,
+    "party_channel_grace_period_seconds": _parse_duration,
+    "games_channel_grace_period_hours": _parse_duration,
+    "event_channel_grace_period_hours": _parse_duration,
+    "message_delete_delay_seconds": _parse_duration,
+}
+
+NAMES = GuildSettings._fields
+
+_DEFAULTS = GuildSettings(
+    admin_roles=frozenset(config.BOT_ADMIN_ROLES),
+    party_channel_grace_period_seconds=config.PARTY_CHANNEL_GRACE_PERIOD_SECONDS,
+    games_channel_grace_period_hours=config.GAMES_CHANNEL_GRACE_PERIOD_HOURS,
+    event_channel_grace_period_hours=config.EVENT_CHANNEL_GRACE_PERIOD_HOURS,
+    message_delete_delay_seconds=config.MESSAGE_DELETE_DELAY_SECONDS,
+)
+
+# guild id -> snapshot
+_snapshots: typing.Dict[int, GuildSettings] = {}
+
+
+def get(guild_id: typing.Optional[int]) -> GuildSettings:
+    """
+    Returns the settings of the guild. Returns the defaults from `config.py`
+    if `guild_id` is None (e.g. for direct messages).
+    """
+    if guild_id is None:
+        return _DEFAULTS
+    settings = _snapshots.get(guild_id)
+    if settings is None:
+        settings = _snapshots[guild_id] = _build(guild_id)
+    return settings
+
+
+def _build(guild_id: int) -> GuildSettings:
+    overrides = db.guild_settings.get(guild_id)
+    if overrides is None:
+        return _DEFAULTS
+    values = {}
+    for name, value in overrides.items():
+        if name not in _PARSERS:
+            continue  # setting of an earlier version
+        if name == "admin_roles":
+            value = frozenset(value)
+        values[name] = value
+    return _DEFAULTS._replace(**values)
+
+
+def overrides(guild_id: int) -> typing.Dict[str, typing.Any]:
+    """
+    Returns the settings the guild overrides, as stored in the database.
+    """
+    return dict(db.guild_settings.get(guild_id, {}))
+
+
+def set_setting(invoker: discord.Member, name: str, value: str) -> None:
+    """
+    Overrides a setting of the invoker's guild. The change has to be committed
+    by the caller, followed by a call to `refresh`.
+
+    Raises KeyError if the setting doesn't exist and ValueError if the value
+    is invalid, i.e. AdminLockoutError if the invoker would lose their admin
+    permissions.
+    """
+    guild_id = invoker.guild.id
+    parsed_value = _PARSERS[name](value, invoker)
+    stored = db.guild_settings.get(guild_id)
+    if stored is None:
+        stored = db.guild_settings[guild_id] = OOBTree()
+    stored[name] = parsed_value
+
+
+def reset_setting(guild_id: int, name: str) -> None:
+    """
+    Resets a setting of the guild to the default from `config.py`. The change
+    has to be committed by the caller, followed by a call to `refresh`.
+
+    Raises KeyError if the setting doesn't exist.
+    """
+    if name not in _PARSERS:
+        raise KeyError(name)
+    stored = db.guild_settings.get(guild_id)
+    if stored is not None:
+        stored.pop(name, None)
+        if len(stored) == 0:
+            del db.guild_settings[guild_id]
+
+
+def refresh(guild_id: int) -> GuildSettings:
+    """
+    Replaces the cached snapshot of the guild's settings after a change was
+    committed and returns the new settings. Until then, handlers keep seeing
+    the committed settings.
+    """
+    # swap in a new snapshot instead of changing the old one
+    settings = _snapshots[guild_id] = _build(guild_id)
+    return settings
@@ -0,0 +1,150 @@
+"""
+This module implements a local HTTP endpoint for health checks.
+
+- `GET /livez` returns 200 as long as the event loop is responsive.
+- `GET /readyz` returns 200 once the bot's state is ready, it is connected to
+  the gateway and the scheduler is running.
+- `GET /stats` returns live statistics as JSON (see `_collect_stats`).
+
+Requests are answered by a server thread from a snapshot that the event loop
+publishes every `SNAPSHOT_INTERVAL_SECONDS`, so probing the endpoint never
+waits for or runs anything on the event loop. A snapshot that is older than
+`STALE_SNAPSHOT_SECONDS` means the event loop is stuck.
+
+The endpoint is disabled if `HEALTH_CHECK_PORT` is set to None.
+"""
+
+import asyncio
+import checks
+import config
+import database
+import gateway
+import http.server
+import json
+import logging
+import math
+import scheduling
+import startup
+import threading
+import time
+from deduplication import reaction_deduplicator
+from load_shedding import reaction_load_shedder, shed_reaction_remover
+from loop_monitor import loop_monitor
+from message_cache import managed_messages
+from rest import circuit_breaker
+from slot_ledger import slot_ledger
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_HOST = getattr(config, "HEALTH_CHECK_HOST", "127.0.0.1")
+HEALTH_CHECK_PORT = getattr(config, "HEALTH_CHECK_PORT", 8765)
+
+SNAPSHOT_INTERVAL_SECONDS = 5
+STALE_SNAPSHOT_SECONDS = 3 * SNAPSHOT_INTERVAL_SECONDS
+
+# Replaced as a whole by the event loop, only read by the server thread
+_snapshot = None
+_server = None
+
+
+def _collect_stats(bot) -> dict:
+    latency = bot.latency
+    return {
+        "time": time.time(),
+        "ready": startup.is_ready() and bot.is_ready() and not bot.is_closed(),
+        "gateway": {
+            "connected": bot.is_ready() and not bot.is_closed(),
+            "latency_ms": round(latency * 1000) if math.isfinite(latency) else None,
+        },
+        "event_loop": {"max_lag_ms": round(loop_monitor.max_lag * 1000)},
+        "reactions": {
+            **reaction_load_shedder.stats(),
+            **shed_reaction_remover.stats(),
+            **reaction_deduplicator.stats(),
+        },
+        "rest": {
+            "circuit_open": circuit_breaker.is_open(),
+            "consecutive_failures": circuit_breaker.consecutive_failures,
+        },
+        "scheduler": scheduling.scheduler_stats(),
+        "database": {"last_commit": database.last_commit_time()},
+        "caches": {
+            "database_objects": database.cache_size(),
+            "admin": checks.admin_cache_size(),
+            "managed_messages": managed_messages.stats(),
+            "party_slots": len(slot_ledger),
+            "messages": len(bot.cached_messages),
+            "members": gateway.member_cache_size(bot),
+        },
+    }
+
+
+async def _publish_snapshots(bot):
+    global _snapshot
+    while True:
+        try:
+            _snapshot = _collect_stats(bot)
+        except Exception:
+            logger.exception("Could not collect health statistics.")
+        await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+
+
+class _HealthRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        snapshot = _snapshot
+        alive = (
+            snapshot is not None
+            and time.time() - snapshot["time"] < STALE_SNAPSHOT_SECONDS
+        )
+        if self.path == "/livez":
+            self._respond(200 if alive else 503, {"alive": alive})
+        elif self.path == "/readyz":
+            ready = (
+                alive
+                and snapshot["ready"]
+                and snapshot["scheduler"].get("running", False)
+            )
+            self._respond(200 if ready else 503, {"ready": ready})
+        elif self.path == "/stats":
+            self._respond(200 if snapshot is not None else 503, snapshot or {})
+        else:
+            self._respond(404, {})
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # probes would flood the log
+
+
+def start(bot) -> None:
+    """
+    Starts publishing snapshots and serving the endpoint. Must be called from
+    within the event loop. Calling this again has no effect.
+    """
+    global _server
+    if _server is not None or HEALTH_CHECK_PORT is None:
+        return
+    try:
+        _server = http.server.ThreadingHTTPServer(
+            (HEALTH_CHECK_HOST, HEALTH_CHECK_PORT), _HealthRequestHandler
+        )
+    except OSError:
+        # e.g. the port is in use, the bot works fine without the endpoint
+        logger.exception(
+            "Could not serve health checks on %s:%d",
+            HEALTH_CHECK_HOST,
+            HEALTH_CHECK_PORT,
+        )
+        return
+    asyncio.ensure_future(_publish_snapshots(bot))
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    logger.info(
+        "Serving health checks on http://%s:%d", HEALTH_CHECK_HOST, HEALTH_CHECK_PORT
+    )
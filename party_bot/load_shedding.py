@@ -0,0 +1,232 @@
+"""
+This module implements backpressure for reaction events.
+
+Reaction events are handled one at a time per member or channel feature (see
+`emoji_handling.handle_react`), so during reaction storms (raids, event
+sign-ups) they queue up behind the locks. Events are shed before doing any API calls if
+- they target a party message that no longer exists (STALE),
+- they are joins for a party that is already full (FULL),
+- the channel's queue is longer than `QUEUE_DEPTH_SOFT_LIMIT` and the same
+  member already has an event queued in the channel (COLLAPSED), or
+- the channel's queue is longer than `QUEUE_DEPTH_HARD_LIMIT` (OVERLOAD).
+
+Only added reactions are shed because of queue depth. Removed reactions are
+always handled, since dropping them would leave members in parties they left.
+STALE and FULL are checked again right before an event is handled, since the
+party may have changed while the event was queued.
+
+The reactions of shed added events are removed in the background by
+`ShedReactionRemover`, one at a time and giving way to live events.
+"""
+
+import asyncio
+import checks
+import collections
+import config
+import discord
+import logging
+import synchronization
+import time
+import typing
+from checks import ActivationState
+from emojis import Emojis
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH_SOFT_LIMIT = getattr(config, "REACTION_QUEUE_DEPTH_SOFT_LIMIT", 20)
+QUEUE_DEPTH_HARD_LIMIT = getattr(config, "REACTION_QUEUE_DEPTH_HARD_LIMIT", 50)
+
+# Reactions of shed events waiting for removal. The oldest ones are dropped
+# (i.e. their reactions stay) once the queue is full.
+SHED_REMOVAL_QUEUE_SIZE = 1000
+
+# Maximum time to wait for live events to finish before removing the next
+# reaction anyway.
+SHED_REMOVAL_MAX_YIELD_SECONDS = 5
+
+STALE = "stale"
+FULL = "full"
+COLLAPSED = "collapsed"
+OVERLOAD = "overload"
+_REASONS = (STALE, FULL, COLLAPSED, OVERLOAD)
+
+# emojis that only make sense on party messages (as opposed to the menu)
+_PARTY_MESSAGE_EMOJIS = (
+    Emojis.WHITE_CHECK_MARK,
+    Emojis.FAST_FORWARD,
+    Emojis.NO_ENTRY_SIGN,
+)
+
+
+class ReactionLoadShedder:
+    def __init__(
+        self, soft_limit=QUEUE_DEPTH_SOFT_LIMIT, hard_limit=QUEUE_DEPTH_HARD_LIMIT
+    ):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        # channel id -> events admitted but not handled yet
+        self._depth = collections.Counter()
+        # (channel id, user id) -> events admitted but not handled yet
+        self._pending = collections.Counter()
+
+        # statistics
+        self.shed = collections.Counter()  # reason -> amount of events
+        self.max_depth = 0
+
+    def admit(
+        self,
+        payload: discord.RawReactionActionEvent,
+        added: bool,
+        feature: ActivationState,
+        channel_info,
+    ) -> bool:
+        """
+        Decides whether a newly arrived event gets queued.
+        If True is returned, `done` must be called once the event was handled.
+        """
+        reason = self._obsolete_reason(payload, added, feature, channel_info)
+        if reason is None and added:
+            depth = self._depth[payload.channel_id]
+            if depth >= self.hard_limit:
+                reason = OVERLOAD
+            elif (
+                depth >= self.soft_limit
+                and self._pending[(payload.channel_id, payload.user_id)] > 0
+            ):
+                reason = COLLAPSED
+        if reason is not None:
+            self.shed[reason] += 1
+            return False
+
+        self._depth[payload.channel_id] += 1
+        self._pending[(payload.channel_id, payload.user_id)] += 1
+        self.max_depth = max(self.max_depth, self._depth[payload.channel_id])
+        return True
+
+    def still_relevant(
+        self,
+        payload: discord.RawReactionActionEvent,
+        added: bool,
+        feature: ActivationState,
+        channel_info,
+    ) -> bool:
+        """
+        Decides whether a queued event still has to be handled. Must be called
+        right before the event is handled.
+        """
+        reason = self._obsolete_reason(payload, added, feature, channel_info)
+        if reason is not None:
+            self.shed[reason] += 1
+            return False
+        return True
+
+    def done(self, payload: discord.RawReactionActionEvent) -> None:
+        _decrement(self._depth, payload.channel_id)
+        _decrement(self._pending, (payload.channel_id, payload.user_id))
+
+    def _obsolete_reason(self, payload, added, feature, channel_info):
+        if feature != ActivationState.PARTY:
+            return None
+        emoji = str(payload.emoji)
+        if emoji not in _PARTY_MESSAGE_EMOJIS:
+            return None
+        if not channel_info.is_party_message(payload.message_id):
+            return STALE
+        if (
+            added
+            and emoji == Emojis.WHITE_CHECK_MARK
+            and channel_info.party_size(payload.message_id) >= channel_info.max_slots
+        ):
+            return FULL
+        return None
+
+    def queue_depth(self) -> int:
+        return sum(self._depth.values())
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "queued": self.queue_depth(),
+            "max_queued_per_channel": self.max_depth,
+            **{f"shed_{reason}": self.shed[reason] for reason in _REASONS},
+        }
+
+
+def _decrement(counter, key):
+    counter[key] -= 1
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class ShedReactionRemover:
+    """
+    Removes the reactions of shed added events, so that they don't suggest
+    that the bot acted on them.
+    """
+
+    def __init__(self, max_size=SHED_REMOVAL_QUEUE_SIZE):
+        self._queue = collections.deque(maxlen=max_size)
+        self._task = None
+
+        # statistics
+        self.removed = 0
+
+    def remove(self, payload: discord.RawReactionActionEvent) -> None:
+        """
+        Queues the removal of the reaction of a shed added event.
+        """
+        self._queue.append(payload)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while len(self._queue) > 0:
+            await _yield_to_live_events()
+            payload = self._queue.popleft()
+            if not _has_to_be_removed(payload):
+                continue
+            channel = config.bot.get_channel(payload.channel_id)
+            if channel is None:
+                continue
+            try:
+                await channel.get_partial_message(payload.message_id).remove_reaction(
+                    payload.emoji, discord.Object(payload.user_id)
+                )
+                self.removed += 1
+            except discord.NotFound:
+                pass  # message was deleted
+            except discord.HTTPException:
+                logger.warning("Could not remove shed reaction.", exc_info=True)
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "shed_removal_queued": len(self._queue),
+            "shed_reactions_removed": self.removed,
+        }
+
+
+def _has_to_be_removed(payload: discord.RawReactionActionEvent) -> bool:
+    if payload.user_id == config.bot.user.id:
+        return False  # e.g. the bot seeding a party message
+    feature, channel_info = checks.get_channel_feature(payload.channel_id)
+    if feature != ActivationState.PARTY:
+        return feature != ActivationState.INACTIVE
+    if str(payload.emoji) not in _PARTY_MESSAGE_EMOJIS:
+        return True
+    if not channel_info.is_party_message(payload.message_id):
+        return False  # party message is gone
+    # the member may have joined the party through a later event
+    return not (
+        str(payload.emoji) == Emojis.WHITE_CHECK_MARK
+        and channel_info.get_party_message_id_of_user(discord.Object(payload.user_id))
+        == payload.message_id
+    )
+
+
+async def _yield_to_live_events():
+    deadline = time.monotonic() + SHED_REMOVAL_MAX_YIELD_SECONDS
+    while synchronization.is_busy() and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+
+reaction_load_shedder = ReactionLoadShedder()
+shed_reaction_remover = ShedReactionRemover()
@@ -0,0 +1,186 @@
+"""
+This module configures logging for the bot.
+
+Log records are put on a queue by the event loop thread and written to stderr
+by a background thread, so logging never blocks the event loop on I/O.
+
+Modules log through `logging.getLogger(__name__)`. Records can carry the
+context fields listed in `CONTEXT_FIELDS`, either passed explicitly through
+`extra={...}` or set for the current task with `log_context` or
+`set_log_context`. Repeated warnings are rate-limited (see
+`RateLimitFilter`).
+"""
+
+import contextlib
+import contextvars
+import logging
+import logging.handlers
+import queue
+import time
+import typing
+
+import config
+
+# Levels per logger name ("" is the root logger).
+# Can be overridden with LOG_LEVELS in the bot configuration.
+DEFAULT_LOG_LEVELS = {
+    "": "INFO",
+    "discord": "WARNING",
+}
+
+# Identical warnings (same logger, message and arguments) are only logged once
+# per window. The amount of suppressed repeats is appended to the next record.
+RATE_LIMIT_WINDOW_SECONDS = 60
+
+# Note: "message" is reserved by `logging.LogRecord`, hence the "_id" suffixes
+CONTEXT_FIELDS = (
+    "guild_id",
+    "channel_id",
+    "message_id",
+    "member_id",
+    "handler",
+    "latency",
+)
+
+_context = contextvars.ContextVar("log_context", default={})
+
+_listener = None
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """
+    Adds the given context fields to all records logged by the current task
+    within the `with` block.
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def set_log_context(**fields):
+    """
+    Adds the given context fields to all records logged by the current task
+    from now on. Event handlers run in their own task, so the fields don't
+    leak into other events.
+    """
+    _context.set({**_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the fields set through `log_context` and `set_log_context` to log
+    records.
+    """
+
+    def filter(self, record):
+        for field, value in _context.get().items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Suppresses repeats of identical warnings and errors within
+    `RATE_LIMIT_WINDOW_SECONDS`.
+
+    Entries of messages that weren't logged within the window are evicted
+    once per window, so the filter only remembers recent messages. Repeats
+    suppressed in the last window of an evicted message are not reported.
+    """
+
+    def __init__(self, window_seconds=RATE_LIMIT_WINDOW_SECONDS):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self._last_logged = {}  # key -> (time, suppressed repeats)
+        self._next_eviction = time.monotonic() + window_seconds
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or record.exc_info is not None:
+            return True
+        try:
+            key = (record.name, record.msg, tuple(map(str, record.args or ())))
+        except TypeError:
+            return True
+
+        now = time.monotonic()
+        if now >= self._next_eviction:
+            self._evict(now)
+        last = self._last_logged.get(key)
+        if last is not None and now - last[0] < self.window_seconds:
+            self._last_logged[key] = (last[0], last[1] + 1)
+            return False
+
+        if last is not None and last[1] > 0:
+            record.repeated = last[1]
+        self._last_logged[key] = (now, 0)
+        return True
+
+    def _evict(self, now):
+        self._last_logged = {
+            key: last
+            for key, last in self._last_logged.items()
+            if now - last[0] < self.window_seconds
+        }
+        self._next_eviction = now + self.window_seconds
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats records as `time level logger: message key=value ...`.
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [
+            f"{field}={getattr(record, field)}"
+            for field in CONTEXT_FIELDS + ("repeated",)
+            if getattr(record, field, None) is not None
+        ]
+        if len(fields) == 0:
+            return line
+        first_line, newline, rest = line.partition("\n")
+        return f"{first_line} {' '.join(fields)}{newline}{rest}"
+
+
+def configure_logging(levels: typing.Optional[typing.Dict[str, str]] = None) -> None:
+    """
+    Sets up queue-backed logging. Calling this more than once has no effect.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+
+    levels = levels or {**DEFAULT_LOG_LEVELS, **getattr(config, "LOG_LEVELS", {})}
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """
+    Writes all queued records and stops the background thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
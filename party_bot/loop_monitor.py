@@ -0,0 +1,162 @@
+"""
+This module implements a monitor for event loop lag.
+
+Anything that blocks the event loop (database commits, file I/O, heavy
+computations) delays all other event handlers. The monitor consists of
+- a heartbeat task that measures how late the event loop wakes it up and
+  records the lag in a histogram, and
+- a watchdog thread that notices when the heartbeat is overdue by more than
+  `SLOW_CALLBACK_THRESHOLD_SECONDS` and captures the stack of the event loop
+  thread together with the asyncio task that is blocking it.
+
+Use `summary` for a short overview and `dump` for a full report including the
+stacks of the slowest callbacks (see the `looplag` command).
+"""
+
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+import typing
+
+import config
+
+LOOP_MONITOR_OUTPUT_DIR = getattr(config, "LOOP_MONITOR_OUTPUT_DIR", "profiles")
+
+# Interval between two heartbeats
+HEARTBEAT_INTERVAL_SECONDS = 0.1
+
+# Callbacks that block the event loop for longer than this are recorded
+SLOW_CALLBACK_THRESHOLD_SECONDS = 0.1
+
+# Amount of slow callbacks kept for the report
+MAX_SLOW_CALLBACKS = 50
+
+# Upper bounds of the lag histogram buckets in milliseconds
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class SlowCallback(typing.NamedTuple):
+    timestamp: float
+    duration: float
+    handler: str
+    stack: typing.List[str]
+
+
+class LoopMonitor:
+    def __init__(self):
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.max_lag = 0.0
+        self.slow_callbacks = collections.deque(maxlen=MAX_SLOW_CALLBACKS)
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = None
+        self._beat = 0
+        self._captured_beat = None
+        self._capture = None
+        self._task = None
+
+    def start(self) -> None:
+        """
+        Starts the monitor. Must be called from within the event loop.
+        Calling this again while the monitor is running has no effect.
+        """
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        threading.Thread(target=self._watchdog, daemon=True).start()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + HEARTBEAT_INTERVAL_SECONDS
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            now = time.monotonic()
+            self._record_lag(max(0.0, now - expected))
+            self._last_beat = now
+            self._beat += 1
+
+    def _record_lag(self, lag):
+        lag_ms = lag * 1000
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if lag_ms <= bound:
+                break
+        else:
+            i = len(HISTOGRAM_BUCKETS_MS)
+        self.histogram[i] += 1
+        self.max_lag = max(self.max_lag, lag)
+
+        capture = self._capture
+        if capture is not None:
+            self._capture = None
+            self.slow_callbacks.append(capture._replace(duration=lag))
+
+    def _watchdog(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL_SECONDS / 2)
+            overdue = time.monotonic() - self._last_beat - HEARTBEAT_INTERVAL_SECONDS
+            beat = self._beat
+            if overdue < SLOW_CALLBACK_THRESHOLD_SECONDS or beat == self._captured_beat:
+                continue
+
+            # loop is blocked, capture what it is doing (once per blocked beat)
+            self._captured_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            task = asyncio.current_task(self._loop)
+            handler = task.get_coro().__qualname__ if task is not None else "<callback>"
+            stack = traceback.format_stack(frame) if frame is not None else []
+            self._capture = SlowCallback(time.time(), overdue, handler, stack)
+
+    def summary(self) -> str:
+        total = sum(self.histogram) or 1
+        lines = [f"Event loop lag (max {self.max_lag * 1000:.0f}ms):"]
+        lower = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS_MS + [None], self.histogram):
+            if count > 0:
+                label = f"{lower}-{bound}ms" if bound is not None else f">{lower}ms"
+                lines.append(f"- {label}: {count} ({100 * count / total:.1f}%)")
+            lower = bound
+
+        handlers = collections.Counter(c.handler for c in self.slow_callbacks)
+        if len(handlers) > 0:
+            lines.append(f"Slow callbacks (>{SLOW_CALLBACK_THRESHOLD_SECONDS}s):")
+            for handler, count in handlers.most_common(5):
+                lines.append(f"- {handler}: {count}")
+        return "\n".join(lines)
+
+    async def dump(self) -> str:
+        """
+        Writes a full report including the stacks of all recorded slow
+        callbacks in a worker thread and returns the filename. Must be called
+        from within the event loop.
+        """
+        # copy on the loop thread, which appends to the deque
+        summary = self.summary()
+        slow_callbacks = list(self.slow_callbacks)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, _write_report, summary, slow_callbacks
+        )
+
+
+def _write_report(summary: str, slow_callbacks: typing.List[SlowCallback]) -> str:
+    os.makedirs(LOOP_MONITOR_OUTPUT_DIR, exist_ok=True)
+    filename = os.path.join(
+        LOOP_MONITOR_OUTPUT_DIR, time.strftime("loop-monitor-%Y%m%d-%H%M%S.txt")
+    )
+    with open(filename, "w") as f:
+        f.write(summary + "\n\n")
+        for c in sorted(slow_callbacks, key=lambda c: -c.duration):
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(c.timestamp))
+            f.write(f"{timestamp} UTC, {c.duration * 1000:.0f}ms in {c.handler}\n")
+            f.writelines(c.stack)
+            f.write("\n")
+    return filename
+
+
+loop_monitor = LoopMonitor()
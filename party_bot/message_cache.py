@@ -0,0 +1,118 @@
+"""
+This module implements a cache of managed messages, i.e. messages whose
+reactions or buttons the bot handles: party messages, menus and notices the
+bot posted.
+
+Messages are added when they are sent (see `on_message` in `bot.py`), edited
+by the bot or fetched on a cache miss (only if they are managed, see
+`is_managed`), and removed when they are deleted or
+edited by someone else. The least recently used messages are evicted once the
+cache holds `MANAGED_MESSAGE_CACHE_SIZE` messages.
+
+Note that the reactions of cached messages are not kept up to date. Fetch the
+message if you need them.
+"""
+
+import checks
+import collections
+import config
+import discord
+import message_registry
+import rest
+import typing
+
+MANAGED_MESSAGE_CACHE_SIZE = getattr(config, "MANAGED_MESSAGE_CACHE_SIZE", 1000)
+
+
+def is_managed(message: discord.Message) -> bool:
+    """
+    Returns True if and only if the message is a party message, a menu (see
+    `emoji_handling.get_menu_emojis`) or a message tracked by
+    `message_registry`.
+    """
+    feature, channel_info = checks.get_channel_feature(message.channel.id)
+    if feature == checks.ActivationState.PARTY and channel_info.is_party_message(
+        message.id
+    ):
+        return True
+    if (
+        feature in (checks.ActivationState.SIDE_GAMES, checks.ActivationState.EVENT)
+        and checks.is_admin(message.author)
+        and not checks.author_is_me(message)
+    ):
+        return True
+    return message_registry.is_tracked(message)
+
+
+class ManagedMessageCache:
+    def __init__(self, max_size=MANAGED_MESSAGE_CACHE_SIZE):
+        self.max_size = max_size
+        # message id -> message, least recently used first
+        self._messages: typing.OrderedDict[int, discord.Message] = (
+            collections.OrderedDict()
+        )
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, message_id: int) -> typing.Optional[discord.Message]:
+        message = self._messages.get(message_id)
+        if message is not None:
+            self._messages.move_to_end(message_id)
+        return message
+
+    def put(self, message: discord.Message) -> None:
+        """
+        Adds the message or replaces an older version of it.
+        """
+        self._messages[message.id] = message
+        self._messages.move_to_end(message.id)
+        while len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)
+
+    def invalidate(self, message_id: int) -> None:
+        self._messages.pop(message_id, None)
+
+    def invalidate_edited(self, payload: discord.RawMessageUpdateEvent) -> None:
+        """
+        Called when a message got edited. Keeps the cached message only if it
+        already is the edited version, i.e. if the bot made the edit.
+        """
+        message = self._messages.get(payload.message_id)
+        if message is None:
+            return
+        edited_at = discord.utils.parse_time(payload.data.get("edited_timestamp"))
+        if edited_at is None or edited_at != message.edited_at:
+            self.invalidate(payload.message_id)
+
+    async def fetch(
+        self, channel: discord.TextChannel, message_id: int
+    ) -> discord.Message:
+        """
+        Returns the cached message, fetching it if it is not cached. Fetched
+        messages are only cached if they are managed, so reactions to
+        arbitrary messages do not evict the managed ones.
+        """
+        message = self.get(message_id)
+        if message is not None:
+            self.hits += 1
+            return message
+        self.misses += 1
+        message = await rest.call("fetch_message", channel.fetch_message, message_id)
+        if is_managed(message):
+            self.put(message)
+        return message
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "cached": len(self._messages),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+managed_messages = ManagedMessageCache()
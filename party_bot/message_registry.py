@@ -0,0 +1,106 @@
+"""
+This module keeps track of the messages the bot posted in a channel (menus,
+party messages, notices), so that they can be deleted by ID when the channel
+gets reconfigured or deactivated, instead of searching the channel history.
+
+Tracking is enabled per channel with `delete_tracked_messages`. Tracked
+message IDs are stored in `db.bot_messages` and forgotten as soon as the
+messages get deleted.
+"""
+
+import checks
+import discord
+import typing
+from BTrees.LLBTree import LLTreeSet
+from database import db
+from datetime import datetime, timedelta, timezone
+
+
+def track_message(message: discord.Message) -> bool:
+    """
+    Tracks a message posted by the bot if tracking is enabled for its channel.
+    Returns True if and only if the message is now tracked.
+    """
+    message_ids = db.bot_messages.get(message.channel.id)
+    if message_ids is None:
+        return False
+    message_ids.add(message.id)
+    return True
+
+
+def is_tracked(message: discord.Message) -> bool:
+    """
+    Returns True if and only if the message is tracked (see `track_message`).
+    """
+    message_ids = db.bot_messages.get(message.channel.id)
+    return message_ids is not None and message.id in message_ids
+
+
+def forget_messages(channel_id: int, message_ids: typing.Iterable[int]) -> bool:
+    """
+    Called when messages in a channel got deleted.
+    Returns True if and only if any tracked message was affected.
+    """
+    tracked_ids = db.bot_messages.get(channel_id)
+    if tracked_ids is None:
+        return False
+    forgotten = False
+    for message_id in message_ids:
+        if message_id in tracked_ids:
+            tracked_ids.remove(message_id)
+            forgotten = True
+    return forgotten
+
+
+async def delete_tracked_messages(
+    channel: discord.TextChannel, keep_tracking: bool = True
+) -> None:
+    """
+    Deletes all tracked messages of the channel using bulk deletes where
+    possible. Afterwards, the channel's messages are tracked from scratch, or
+    not at all if `keep_tracking` is False.
+
+    Channels that were activated before messages were tracked fall back to
+    searching the last 100 messages for messages posted by the bot.
+    """
+    message_ids = db.bot_messages.pop(channel.id, None)
+    if keep_tracking:
+        db.bot_messages[channel.id] = LLTreeSet()
+
+    if message_ids is None:
+        await channel.purge(limit=100, check=checks.author_is_me)
+    else:
+        await delete_messages(channel, list(message_ids))
+
+
+async def delete_messages(
+    channel: discord.TextChannel, message_ids: typing.List[int]
+) -> None:
+    """
+    Deletes the given messages of a channel, using a single bulk delete per
+    100 messages where possible. Messages that were already deleted are
+    ignored.
+    """
+    # bulk deletes only work for messages that are younger than 14 days
+    bulk_limit = discord.utils.time_snowflake(
+        datetime.now(timezone.utc) - timedelta(days=13, hours=23)
+    )
+    recent = [id for id in message_ids if id > bulk_limit]
+    old = [id for id in message_ids if id <= bulk_limit]
+
+    remaining = []
+    for i in range(0, len(recent), 100):
+        chunk = recent[i : i + 100]
+        if len(chunk) < 2:
+            remaining += chunk  # bulk deletes need at least two messages
+            continue
+        try:
+            await channel.delete_messages([discord.Object(id) for id in chunk])
+        except discord.HTTPException:
+            remaining += chunk  # fall back to deleting messages one by one
+
+    for id in remaining + old:
+        try:
+            await channel.get_partial_message(id).delete()
+        except discord.NotFound:
+            pass  # message was already deleted, ignore
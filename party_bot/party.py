@@ -1,5 +1,19 @@
 """
 This module implements most of the party matchmaking feature.
+
+Party actions of different members run concurrently (see `member_locks`), but
+all handlers share the database transaction of the event loop. Every
+`transaction.commit()` therefore publishes the database changes of all
+handlers made so far, including those of party actions that are still in
+flight. Handlers only commit once they are done, also when a REST call failed,
+and party actions keep each of their changes consistent on its own:
+- a change that records the side effect of a REST call is made right after
+  the call succeeded (see `rest`), and
+- the only change made ahead of a call, adding a joining member to the party
+  message index (see `slot_ledger.reserve`), is undone if the call fails.
+If the bot stops while a join is in flight, the member stays in the index
+until the party message gets deleted. The members of a party are always read
+from its party message (see `Party.from_party_message`).
 """
 
 # necessary for typing factory methods
@@ -7,13 +21,36 @@ from __future__ import annotations
 
 import asyncio
 import checks
-import config
 import discord
+import guild_settings
+import logging
+import rest
 import scheduling
+import transaction
+import typing
 from database import db
 from emojis import Emojis
+from logging_config import set_log_context
+from message_cache import managed_messages
+from party_events import EventKind, event_log
 from reaction_payload import ReactionPayload
+from reaction_seeding import reaction_seeder
+from slot_ledger import slot_ledger
 from strings import Strings
+from synchronization import KeyedLock, synchronized_per_key
+from voice_channel_pool import voice_channel_pool
+
+logger = logging.getLogger(__name__)
+
+_party_view = None
+
+# serializes the edits of each party message, see `Party.add_member`
+_party_message_locks = KeyedLock()
+
+# (guild id, member id) -> lock, serializes the party actions of each member
+# in the order in which they arrived (see `handle_party_interaction` and
+# `emoji_handling.handle_react`)
+member_locks = KeyedLock()
 
 
 class Party:
@@ -25,11 +62,12 @@ class Party:
     create party messages.
     """
 
-    def __init__(self, channel, leader, slots_left, members=set()):
+    def __init__(self, channel, leader, slots_left, members=set(), use_buttons=False):
         self.channel = channel
         self.leader = leader
         self.slots_left = slots_left
         self.members = members
+        self.use_buttons = use_buttons
 
     async def from_party_message(message: discord.Message) -> Party:
         """
@@ -45,20 +83,21 @@ class Party:
         members = set()
         for f in embed.fields:
             if f.name == Strings.PARTY_LEADER:
-                leader = await guild.fetch_member(_user_snowflake_to_id(f.value))
+                leader = await _get_member(guild, _user_snowflake_to_id(f.value))
             if f.name == Strings.PARTY_MEMBERS:
                 if f.value == "None":
                     continue
                 members = f.value.split(" ")
                 members = [
-                    await guild.fetch_member(_user_snowflake_to_id(id))
+                    await _get_member(guild, _user_snowflake_to_id(id))
                     for id in members
                 ]
                 members = set(members)
             if f.name == Strings.SLOTS_LEFT:
                 slots_left = int(f.value)
 
-        return Party(channel, leader, slots_left, members)
+        use_buttons = len(message.components) > 0
+        return Party(channel, leader, slots_left, members, use_buttons)
 
     def to_embed(self) -> discord.Embed:
         """
@@ -67,14 +106,24 @@ class Party:
         used to reconstruct this party object using `from_party_message`.
         """
 
+        if self.use_buttons:
+            instructions = (
+                "Click Join to join the party. "
+                "The party leader can start the party early with Start "
+                "or close it with Close."
+            )
+        else:
+            instructions = (
+                f"React with {Emojis.WHITE_CHECK_MARK} to join the party. "
+                f"The party leader can start the party early with "
+                f"{Emojis.FAST_FORWARD} or close it with "
+                f"{Emojis.NO_ENTRY_SIGN}."
+            )
         embed = discord.Embed.from_dict(
             {
                 "color": 0x00FF00,
                 "description": f"{self.leader.mention} has just launched a party!\n"
-                f"React with {Emojis.WHITE_CHECK_MARK} to join the party. "
-                f"The party leader can start the party early with "
-                f"{Emojis.FAST_FORWARD} or close it with "
-                f"{Emojis.NO_ENTRY_SIGN}.",
+                + instructions,
             }
         )
         embed.add_field(
@@ -97,15 +146,21 @@ class Party:
         Adds a member to this party, updating this object and the party
         message.
 
+        Edits of the same party message are serialized. Each edit starts from
+        the latest version of the party message, so members that join or leave
+        at the same time don't overwrite each other. This object is updated to
+        the edited version.
 
         Note that this function does not check whether the party is full or
         whether the member is already part of the party.
         It also does not trigger party creation when the amount of free slots
         reach zero.
         """
-        self.members.add(user)
-        self.slots_left -= 1
-        await party_message.edit(embed=self.to_embed())
+        async with _party_message_locks(party_message.id):
+            await self._reload(party_message)
+            self.members.add(user)
+            self.slots_left -= 1
+            await self._update_party_message(party_message)
 
     async def remove_member(
         self, user: discord.Member, party_message: discord.Message
@@ -119,94 +174,317 @@ class Party:
         If a non-party-member is removed from the party using this function,
         then `slots_left` will have an invalid value.
         """
-        self.members.remove(user)
-        self.slots_left += 1
-        await party_message.edit(embed=self.to_embed())
-
+        async with _party_message_locks(party_message.id):
+            await self._reload(party_message)
+            self.members.discard(user)
+            self.slots_left += 1
+            await self._update_party_message(party_message)
+
+    async def _reload(self, party_message: discord.Message) -> None:
+        # the cached party message is the latest version, see `_update_party_message`
+        latest = await managed_messages.fetch(party_message.channel, party_message.id)
+        party = await Party.from_party_message(latest)
+        self.leader = party.leader
+        self.members = party.members
+        self.slots_left = party.slots_left
+
+    async def _update_party_message(self, party_message: discord.Message) -> None:
+        # later actions have to see the edited party message
+        try:
+            edited_message = await rest.call(
+                "edit_message", party_message.edit, embed=self.to_embed()
+            )
+        except Exception:
+            # the edit may have happened anyway
+            managed_messages.invalidate(party_message.id)
+            raise
+        managed_messages.put(edited_message)
+
+
+class PartyActionRejected(Exception):
+    """
+    Raised by party actions (`join_party`, `leave_party`, ...) when the member
+    is not allowed to perform the action.
 
-async def add_member_emoji_handler(rp: ReactionPayload) -> bool:
+    `reason` is addressed to the member. With reactions, it is only posted in
+    the channel if `notify` is set; otherwise the removed reaction is feedback
+    enough. With buttons, it is always shown to the member (and only to them).
     """
-    Emoji handler that implements the party join feature.
 
-    Will add a member to the party and trigger voice channel creation when the
+    def __init__(self, reason: str, notify: bool = False):
+        super().__init__(reason)
+        self.reason = reason
+        self.notify = notify
+
+
+async def join_party(
+    party: Party, party_message: discord.Message, member: discord.Member
+) -> None:
+    """
+    Adds a member to the party and triggers voice channel creation when the
     party is full.
 
-    If the member that reacted is the party leader, the emoji is simply removed
-    and no further action is taken.
+    The slot is reserved in the `slot_ledger` before the party message gets
+    edited, so joins that are in flight at the same time can't overfill the
+    party and the party is started exactly once, after the last of them.
 
-    If the member is already part of another party, either as member or leader,
-    an error message is printed and the emoji is removed.
+    Raises `PartyActionRejected` if the party is full, if the member is the
+    party leader or if the member is already part of another party, either as
+    member or leader.
     """
+    channel = party_message.channel
+    channel_info = db.party_channels[channel.id]
 
-    party = await Party.from_party_message(rp.message)
-    message = rp.message
-    channel = rp.channel
+    if member == party.leader:  # leader can't join as member
+        raise PartyActionRejected("you can't join your own party.")
+    if channel_info.is_in_party(member):
+        raise PartyActionRejected(
+            "you are already in another party! "
+            "Leave that party before trying to join another.",
+            notify=True,
+        )
+    if not slot_ledger.reserve(channel_info, party_message, member):
+        raise PartyActionRejected("this party is already full.")
+    try:
+        await party.add_member(member, party_message)
+    except BaseException:
+        channel_info.clear_party_message_of_user(member)
+        raise
+    finally:
+        slot_ledger.end(party_message.id)
+    event_log.record(EventKind.MEMBER_JOINED, channel.id, party_message.id, member.id)
+    if slot_ledger.claim_full(channel_info, party_message.id):
+        await _start_party(party_message)
+
+
+async def leave_party(
+    party: Party, party_message: discord.Message, member: discord.Member
+) -> None:
+    """
+    Removes a member from the party.
+
+    Raises `PartyActionRejected` if the member is not a member of the party or
+    the party is being started or closed.
+    """
+    channel = party_message.channel
     channel_info = db.party_channels[channel.id]
 
-    if party.slots_left < 1 or rp.member == party.leader:  # leader can't join as member
-        return False  # remove reaction
-    if await channel_info.get_party_message_of_user(rp.member) is not None:
-        delete_message = await channel.send(
-            f"{rp.member.mention}, you are "
-            f"already in another party! "
-            f"Leave that party before trying "
-            f"to join another."
+    if member == party.leader:
+        raise PartyActionRejected(
+            "you are the leader of this party. Close the party instead."
         )
-        scheduling.message_delayed_delete(delete_message)
-        return False  # remove reaction
-    channel_info.set_party_message_of_user(rp.member, message)
-    await party.add_member(rp.member, rp.message)
-    if party.slots_left < 1:
-        await handle_full_party(party, rp.message)
-    return True  # keep reaction
+    if member not in party.members:
+        raise PartyActionRejected("you are not a member of this party.")
+    if not slot_ledger.begin(party_message.id):
+        raise PartyActionRejected("this party is already starting.")
+
+    try:
+        await party.remove_member(member, party_message)
+    except BaseException as e:
+        slot_ledger.end(party_message.id)
+        # the member is still in the party, which joins may have filled by now
+        if isinstance(e, Exception) and slot_ledger.claim_full(
+            channel_info, party_message.id
+        ):
+            await _start_party(party_message)
+        raise
+    channel_info.clear_party_message_of_user(member)
+    slot_ledger.end(party_message.id)
+    event_log.record(EventKind.MEMBER_LEFT, channel.id, party_message.id, member.id)
+
+
+class PartyView(discord.ui.View):
+    """
+    Buttons of party messages in channels that use buttons instead of
+    reactions (see `PartyChannelInformation.use_buttons`).
 
+    The view is persistent: it has no timeout and all buttons have fixed custom
+    IDs, so a single instance handles the buttons of all party messages,
+    including those sent before the bot was restarted.
+    """
 
-async def remove_member_emoji_handler(rp: ReactionPayload) -> None:
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    @discord.ui.button(
+        label="Join", style=discord.ButtonStyle.success, custom_id="party:join"
+    )
+    async def join_button(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await handle_party_interaction(interaction, join_party)
+
+    @discord.ui.button(
+        label="Leave", style=discord.ButtonStyle.secondary, custom_id="party:leave"
+    )
+    async def leave_button(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await handle_party_interaction(interaction, leave_party)
+
+    @discord.ui.button(
+        label="Start", style=discord.ButtonStyle.primary, custom_id="party:start"
+    )
+    async def start_button(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await handle_party_interaction(interaction, force_start)
+
+    @discord.ui.button(
+        label="Close", style=discord.ButtonStyle.danger, custom_id="party:close"
+    )
+    async def close_button(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        await handle_party_interaction(interaction, close)
+
+
+def get_party_view() -> PartyView:
     """
-    Emoji handler that implements the party leave feature.
+    Returns the persistent party message view. Must be called from within the
+    event loop. The view has to be registered with `bot.add_view` on startup
+    to handle clicks on party messages sent before the bot was restarted.
+    """
+    global _party_view
+    if _party_view is None:
+        _party_view = PartyView()
+    return _party_view
+
+
+async def handle_party_interaction(
+    interaction: discord.Interaction,
+    action: typing.Callable[[Party, discord.Message, discord.Member], typing.Any],
+) -> None:
+    """
+    Performs a party action (`join_party`, `leave_party`, ...) for the member
+    that clicked a party message button.
+
+    Unlike reactions, clicks don't need to be undone and rejections are
+    answered with a message that only the member can see.
+
+    Party actions of the same member are handled one at a time, together with
+    the member's party reactions (see `member_locks`). Actions of different
+    members run concurrently, the `slot_ledger` keeps them consistent.
+    """
+    # acknowledge right away, waiting for the lock may take longer than
+    # Discord waits for a response
+    await interaction.response.defer()
+    await _handle_party_interaction(interaction, action)
+
+
+@synchronized_per_key(
+    lambda interaction, action: (interaction.guild_id, interaction.user.id),
+    member_locks,
+)
+async def _handle_party_interaction(interaction, action) -> None:
+    member = interaction.user
+    feature, channel_info = checks.get_channel_feature(interaction.channel_id)
+    if feature != checks.ActivationState.PARTY or not channel_info.is_party_message(
+        interaction.message.id
+    ):
+        await interaction.followup.send(
+            f"{member.mention}, this party is no longer open.", ephemeral=True
+        )
+        return
+
+    set_log_context(
+        guild_id=interaction.guild_id,
+        channel_id=interaction.channel_id,
+        message_id=interaction.message.id,
+        member_id=member.id,
+        handler="handle_party_interaction",
+    )
+    try:
+        # the message of the interaction is outdated if an earlier click
+        # changed the party
+        message = await managed_messages.fetch(
+            interaction.channel, interaction.message.id
+        )
+        party = await Party.from_party_message(message)
+        await action(party, message, member)
+    except PartyActionRejected as rejection:
+        await interaction.followup.send(
+            f"{member.mention}, {rejection.reason}", ephemeral=True
+        )
+        return
+    except rest.FAILURES:
+        # party actions only record the steps that succeeded, keep them
+        transaction.commit()
+        logger.warning("Party action failed.", exc_info=True)
+        await interaction.followup.send(
+            f"{member.mention}, Discord is having trouble right now. "
+            f"Please try again later.",
+            ephemeral=True,
+        )
+        return
+
+    # save database
+    transaction.commit()
 
-    Will remove a member from the party.
 
-    Since emoji reactions are handled sequentially but not in FIFO order, there
-    is a small chance that the leave event is handled before the join event.
-    In that case, the leave event is silently ignored.
-    Note that this will cause the member to be part of the party.
-    Since that member probably can't un-react without reacting first, the party
-    has to be closed and re-opened to fix it.
+async def add_member_emoji_handler(rp: ReactionPayload) -> bool:
+    """
+    Emoji handler that implements the party join feature (see `join_party`).
 
-    TODO: ensure FIFO order for the synchronization lock
+    If the member is already part of another party, an error message is
+    printed. If the member can't join for any reason, the emoji is removed.
     """
 
     party = await Party.from_party_message(rp.message)
-    channel = rp.channel
-    channel_info = db.party_channels[channel.id]
+    try:
+        await join_party(party, rp.message, rp.member)
+    except PartyActionRejected as rejection:
+        if rejection.notify:
+            delete_message = await rp.channel.send(
+                f"{rp.member.mention}, {rejection.reason}"
+            )
+            scheduling.message_delayed_delete(delete_message)
+        return False  # remove reaction
+    return True  # keep reaction
 
-    # This shouldn't happen. If it does, ignore it
-    # See function documentation above
-    if rp.member not in party.members or rp.member == party.leader:
-        return
 
-    await party.remove_member(rp.member, rp.message)
-    channel_info.clear_party_message_of_user(rp.member)
+async def remove_member_emoji_handler(rp: ReactionPayload) -> None:
+    """
+    Emoji handler that implements the party leave feature (see `leave_party`).
 
+    The reaction events of a member are handled one at a time in the order in
+    which they arrived (see `member_locks`; waiters of an `asyncio.Lock`
+    acquire it in FIFO order), so a leave event is never handled before the
+    member's join event. The leave is rejected, and ignored, if the join was
+    rejected or the party is being started or closed.
+    """
+
+    party = await Party.from_party_message(rp.message)
+    try:
+        await leave_party(party, rp.message, rp.member)
+    except PartyActionRejected:
+        pass  # see above
 
-async def handle_full_party(party: Party, party_message: discord.Message) -> None:
+
+async def handle_full_party(
+    party: Party, party_message: discord.Message, forced: bool = False
+) -> None:
     """
-    Called by `Party.add_member` when a party reaches zero open slots.
-    Deletes the party message and creates a party voice channel.
+    Called by `join_party` when a party reaches zero open slots, or with
+    `forced` set when the party leader force starts the party.
+    Deletes the party message and claims a party voice channel from the pool
+    (see `voice_channel_pool`), creating one if the pool is empty.
     Will inform all party members by posting a message in the party matchmaking
     channel.
+
+    If the party message can't be deleted, the party stays open and the voice
+    channel is recycled (see `recycle_party_voice_channel`).
     """
     channel = party_message.channel
     guild = party_message.guild
     channel_info = db.party_channels[channel.id]
-    division_admin = guild.get_role(channel_info.division_admin_id) or guild.get_member(
-        channel_info.division_admin_id
-    )
-    channel_above, channel_above_position = await channel_info.fetch_channel_above(
-        guild
-    )
-    category = guild.get_channel(channel_above.category_id)
+    settings = guild_settings.get(guild.id)
+    division_admin = guild.get_role(channel_info.division_admin_id)
+    if division_admin is None:  # division admin is a member
+        try:
+            division_admin = await _get_member(guild, channel_info.division_admin_id)
+        except discord.NotFound:
+            pass  # left the guild
 
     overwrites = {
         guild.default_role: discord.PermissionOverwrite(
@@ -223,10 +501,14 @@ async def handle_full_party(party: Party, party_message: discord.Message) -> Non
     )
 
     # allow bot admins
-    for role_id in config.BOT_ADMIN_ROLES:
+    for role_id in settings.admin_roles:
         role = party_message.guild.get_role(role_id)
         if role is None:
-            print(f"[WARN] Bot admin role {role_id} does not exist.")
+            logger.warning(
+                "Bot admin role %s does not exist.",
+                role_id,
+                extra={"guild_id": guild.id},
+            )
             continue
         overwrites.update(
             {role: discord.PermissionOverwrite(read_messages=True, connect=True)}
@@ -242,90 +524,191 @@ async def handle_full_party(party: Party, party_message: discord.Message) -> Non
             }
         )
 
+    # reserve the party number, so that parties started concurrently get
+    # different numbers
     counter = channel_info.voice_channel_counter
     channel_info.voice_channel_counter += 1
-    vc = await guild.create_voice_channel(
-        f"{channel_info.game_name} " f"- Party - #{counter}",
-        category=category,
-        overwrites=overwrites,
-    )
-    await vc.edit(position=channel_above_position + 1)
+    name = f"{channel_info.game_name} " f"- Party - #{counter}"
+    try:
+        vc = await voice_channel_pool.claim(channel_info, guild, name, overwrites)
+        position = None
+        if vc is None:  # no pooled channel available
+            channel_above, channel_above_position = (
+                await channel_info.fetch_channel_above(guild)
+            )
+            vc = await rest.call(
+                "create_channel",
+                guild.create_voice_channel,
+                name,
+                category=guild.get_channel(channel_above.category_id),
+                overwrites=overwrites,
+            )
+            position = channel_above_position + 1
+    except rest.FAILURES:
+        _return_party_number(channel_info, counter)
+        raise
     channel_info.active_voice_channels.add(vc.id)
 
-    # delete original party message
-    mentions = f"{party.leader.mention} " + " ".join([m.mention for m in party.members])
-    for m in party.members:
-        db.party_channels[channel.id].clear_party_message_of_user(m)
-    db.party_channels[channel.id].clear_party_message_of_user(party.leader)
-    await party_message.delete()
+    try:
+        if position is not None:
+            await rest.call("edit_channel", vc.edit, position=position)
+        # delete original party message
+        await _delete_party_message(party_message)
+    except rest.FAILURES:
+        # the party stays open, recycle the voice channel right away
+        _return_party_number(channel_info, counter)
+        scheduling.channel_start_grace_period(
+            vc,
+            0,
+            delete_callback_args=[channel.id],
+            release_callback=recycle_party_voice_channel,
+        )
+        raise
+
+    channel_info.forget_party_message(party_message.id)
+    event_log.record(
+        EventKind.STARTED_FORCED if forced else EventKind.STARTED_FULL,
+        channel.id,
+        party_message.id,
+        vc.id,
+    )
+    scheduling.channel_start_grace_period(
+        vc,
+        settings.party_channel_grace_period_seconds,
+        delete_callback_args=[channel.id],
+        release_callback=recycle_party_voice_channel,
+    )
 
     # send additional message, notifying members
+    mentions = f"{party.leader.mention} " + " ".join([m.mention for m in party.members])
     message = await channel.send(
         f"{mentions}. Matchmaking done. "
         f"Connect to {vc.mention}. "
         f"You have "
-        f"{config.PARTY_CHANNEL_GRACE_PERIOD_SECONDS} "
+        f"{settings.party_channel_grace_period_seconds} "
         f"seconds to join. "
         f"After that, the channel gets deleted as soon as it "
         f"empties out."
     )
-    scheduling.channel_start_grace_period(vc, config.PARTY_CHANNEL_GRACE_PERIOD_SECONDS)
     scheduling.message_delayed_delete(message)
 
 
-async def force_start_party(rp: ReactionPayload) -> None:
+def _return_party_number(channel_info, counter: int) -> None:
     """
-    Emoji handler that implements the party force start feature.
-
-    If the reacting member is not the party leader or the party has no members
-    (excluding the party leader), the emoji is removed and no further action is
-    taken.
+    Called when starting the party with the given number failed. The number
+    is handed out again, unless a later party took the next number already.
     """
-
-    party = await Party.from_party_message(rp.message)
-    # only leader can start the party
-    # and don't start empty parties
-    if rp.member != party.leader or len(party.members) == 0:
-        await rp.message.remove_reaction(Emojis.FAST_FORWARD, rp.member)
-        return
-
-    await handle_full_party(party, rp.message)
+    if channel_info.voice_channel_counter == counter + 1:
+        channel_info.voice_channel_counter = counter
 
 
-async def close_party(rp: ReactionPayload) -> None:
+async def force_start(
+    party: Party, party_message: discord.Message, member: discord.Member
+) -> None:
     """
-    Emoji handler that implements the party close feature.
+    Starts the party early.
 
-    If the reacting member is not the party leader or a bot admin as specified
-    in `config.BOT_ADMIN_ROLES`, the emoji is removed and no further action is
-    taken.
-
-    Otherwise, the party message the party affiliations (membership,
-    leadership) are deleted and an appropriate message is posted to the party
-    matchmaking channel.
+    Raises `PartyActionRejected` if the member is not the party leader, the
+    party has no members (excluding the party leader) or the party is already
+    starting or has members joining it right now.
+    """
+    if member != party.leader:
+        raise PartyActionRejected("only the party leader can start the party.")
+    if len(party.members) == 0:
+        raise PartyActionRejected("you can't start a party without members.")
+    if not slot_ledger.claim(party_message.id):
+        raise PartyActionRejected("this party is already starting.")
+
+    await _start_party(party_message, forced=True)
+
+
+async def _start_party(party_message: discord.Message, forced: bool = False) -> None:
+    # must only be called after starting the party was claimed in the ledger
+    try:
+        # other members may have joined or left since the caller read the
+        # party message
+        latest = await managed_messages.fetch(party_message.channel, party_message.id)
+        party = await Party.from_party_message(latest)
+        if len(party.members) == 0:
+            raise PartyActionRejected("you can't start a party without members.")
+        await handle_full_party(party, party_message, forced)
+    except BaseException:
+        slot_ledger.unclaim(party_message.id)
+        raise
+    slot_ledger.forget(party_message.id)
+
+
+async def close(
+    party: Party, party_message: discord.Message, member: discord.Member
+) -> None:
     """
+    Closes the party. The party message and the party affiliations
+    (membership, leadership) are deleted and an appropriate message is posted
+    to the party matchmaking channel.
 
-    party = await Party.from_party_message(rp.message)
+    Raises `PartyActionRejected` if the member is not the party leader or a
+    bot admin (see `checks.is_admin`), or if members are joining or leaving
+    the party right now.
+    """
     channel = party.channel
-    if party.leader != rp.member and not checks.is_admin(rp.member):
-        await rp.message.remove_reaction(Emojis.NO_ENTRY_SIGN, rp.member)
-        return
-    if rp.member != party.leader:
+    if party.leader != member and not checks.is_admin(member):
+        raise PartyActionRejected("only the party leader can close the party.")
+    if not slot_ledger.claim(party_message.id):
+        raise PartyActionRejected(
+            "members are joining or leaving this party right now. Try again."
+        )
+    try:
+        await _delete_party_message(party_message)
+    except BaseException:
+        slot_ledger.unclaim(party_message.id)
+        raise
+    slot_ledger.forget(party_message.id)
+    db.party_channels[channel.id].forget_party_message(party_message.id)
+    event_log.record(EventKind.CLOSED, channel.id, party_message.id, member.id)
+
+    if member != party.leader:
         message = await channel.send(
-            f"> {rp.member.mention} has just force "
+            f"> {member.mention} has just force "
             f"closed {party.leader.mention}'s party!"
         )
     else:
         message = await channel.send(
-            f"> {rp.member.mention} has just " f"disbanded their party!\n"
+            f"> {member.mention} has just " f"disbanded their party!\n"
         )
-    await rp.message.delete()
-    for m in party.members:
-        db.party_channels[channel.id].clear_party_message_of_user(m)
-    db.party_channels[channel.id].clear_party_message_of_user(party.leader)
     scheduling.message_delayed_delete(message)
 
 
+async def force_start_party(rp: ReactionPayload) -> None:
+    """
+    Emoji handler that implements the party force start feature (see
+    `force_start`).
+
+    If the party can't be started, the emoji is removed and no further action
+    is taken.
+    """
+
+    party = await Party.from_party_message(rp.message)
+    try:
+        await force_start(party, rp.message, rp.member)
+    except PartyActionRejected:
+        await rp.message.remove_reaction(Emojis.FAST_FORWARD, rp.member)
+
+
+async def close_party(rp: ReactionPayload) -> None:
+    """
+    Emoji handler that implements the party close feature (see `close`).
+
+    If the reacting member is not allowed to close the party, the emoji is
+    removed and no further action is taken.
+    """
+
+    party = await Party.from_party_message(rp.message)
+    try:
+        await close(party, rp.message, rp.member)
+    except PartyActionRejected:
+        await rp.message.remove_reaction(Emojis.NO_ENTRY_SIGN, rp.member)
+
+
 async def start_party(rp: ReactionPayload) -> None:
     """
     Emoji handler that implements the party creation feature.
@@ -346,7 +729,7 @@ async def start_party(rp: ReactionPayload) -> None:
         return
     channel_info = db.party_channels[channel.id]
 
-    if await channel_info.get_party_message_of_user(rp.member) is not None:
+    if channel_info.is_in_party(rp.member):
         delete_message = await channel.send(
             f"{rp.member.mention}, you are "
             f"already in another party! "
@@ -357,12 +740,90 @@ async def start_party(rp: ReactionPayload) -> None:
         return
 
     max_slots = channel_info.max_slots
-    party = Party(channel, rp.member, max_slots - 1)
-    message = await channel.send(embed=party.to_embed())
-    await message.add_reaction(Emojis.WHITE_CHECK_MARK)
-    await message.add_reaction(Emojis.FAST_FORWARD)
-    await message.add_reaction(Emojis.NO_ENTRY_SIGN)
+    party = Party(
+        channel, rp.member, max_slots - 1, use_buttons=channel_info.use_buttons
+    )
+    if channel_info.use_buttons:
+        message = await channel.send(embed=party.to_embed(), view=get_party_view())
+    else:
+        message = await channel.send(embed=party.to_embed())
     channel_info.set_party_message_of_user(rp.member, message)
+    event_log.record(EventKind.CREATED, channel.id, message.id, rp.member.id)
+    if not channel_info.use_buttons:
+        # don't wait for the reactions, the party is usable right away
+        reaction_seeder.seed(
+            message,
+            [Emojis.WHITE_CHECK_MARK, Emojis.FAST_FORWARD, Emojis.NO_ENTRY_SIGN],
+        )
+
+
+def handle_party_messages_deleted(channel_id: int, message_ids) -> bool:
+    """
+    Called when messages in a channel got deleted.
+
+    Clears the party affiliations (membership, leadership) of all deleted party
+    messages, so that users can join or create other parties right away.
+    Returns True if and only if any party message was affected.
+    """
+    for message_id in message_ids:
+        slot_ledger.forget(message_id)
+
+    feature, channel_info = checks.get_channel_feature(channel_id)
+    if feature != checks.ActivationState.PARTY:
+        return False
+
+    forgotten = False
+    for message_id in message_ids:
+        forgotten |= channel_info.forget_party_message(message_id)
+    return forgotten
+
+
+_reconciliation = None
+
+
+def reconcile_party_messages(bot) -> None:
+    """
+    Must be called from `on_ready`. Starts checking in the background whether
+    the party messages of all party matchmaking channels still exist.
+
+    Deletions are tracked through gateway events (see
+    `handle_party_messages_deleted`), this catches party messages that got
+    deleted while the bot was offline.
+    """
+    global _reconciliation
+    if _reconciliation is not None and not _reconciliation.done():
+        return
+    _reconciliation = asyncio.ensure_future(_reconcile_party_messages(bot))
+
+
+async def _reconcile_party_messages(bot) -> None:
+    forgotten = 0
+    for channel_id, channel_info in list(db.party_channels.items()):
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            continue
+        for message_id in channel_info.party_message_ids():
+            if managed_messages.get(message_id) is not None:
+                continue
+            try:
+                message = await rest.call(
+                    "fetch_message", channel.fetch_message, message_id
+                )
+            except discord.NotFound:
+                if handle_party_messages_deleted(channel_id, [message_id]):
+                    transaction.commit()
+                    forgotten += 1
+            except rest.FAILURES as e:
+                logger.warning(
+                    "Could not check party message %d in %d: %r",
+                    message_id,
+                    channel_id,
+                    e,
+                )
+            else:
+                managed_messages.put(message)
+    if forgotten > 0:
+        logger.info("Forgot %d party messages deleted while offline", forgotten)
 
 
 async def handle_party_emptied(
@@ -371,20 +832,55 @@ async def handle_party_emptied(
     """
     Called when a party voice channel emptied out.
 
-    Will delete channel if it is older than the grace period defined in
-    `config.PARTY_CHANNEL_GRACE_PERIOD_SECONDS`.
+    Will recycle the channel (see `recycle_party_voice_channel`) if it is older
+    than the grace period of its guild (see `guild_settings`).
     """
 
     # grace period for new channels
     if voice_channel.id in scheduling.channel_ids_grace_period:
         return
 
-    await voice_channel.delete()
-    db.party_channels[matchmaking_channel_id].active_voice_channels.remove(
-        voice_channel.id
+    await recycle_party_voice_channel(voice_channel, matchmaking_channel_id)
+
+
+async def recycle_party_voice_channel(
+    voice_channel: discord.VoiceChannel, matchmaking_channel_id: int
+) -> None:
+    """
+    Returns an emptied party voice channel to the pool of its party matchmaking
+    channel, or deletes it if the pool is full or the matchmaking channel got
+    deactivated.
+    """
+    channel_info = db.party_channels.get(matchmaking_channel_id)
+    if (
+        channel_info is None
+        or voice_channel.id not in channel_info.active_voice_channels
+    ):
+        await rest.call("delete_channel", voice_channel.delete)
+        return
+
+    channel_info.active_voice_channels.remove(voice_channel.id)
+    await voice_channel_pool.release(channel_info, voice_channel)
+    event_log.record(
+        EventKind.VOICE_CHANNEL_EMPTIED, matchmaking_channel_id, 0, voice_channel.id
     )
 
 
+async def _delete_party_message(party_message: discord.Message) -> None:
+    try:
+        await rest.call("delete_message", party_message.delete)
+    except discord.NotFound:
+        pass  # deleted already, e.g. by an attempt that timed out
+
+
+async def _get_member(guild: discord.Guild, member_id: int) -> discord.Member:
+    # the member cache saves a REST call per party member
+    member = guild.get_member(member_id)
+    if member is None:
+        member = await rest.call("fetch_member", guild.fetch_member, member_id)
+    return member
+
+
 def _user_snowflake_to_id(snowflake: str) -> int:
     """
     Extracts the user ID from a user mention in snowflake notation.
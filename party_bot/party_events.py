@@ -0,0 +1,202 @@
+"""
+This module implements the party lifecycle event log and the analytics
+computed from it (see the `partystats` command).
+
+Events are fixed-size binary records (see `EVENT_DTYPE`) that are buffered in
+memory and appended to `PARTY_EVENT_LOG_FILENAME` in batches. The log is
+loaded as a NumPy structured array, so all statistics are computed with
+vectorized operations on its columns.
+
+Columns:
+- time: seconds since the epoch
+- kind: one of the `EventKind` values
+- channel_id: ID of the party matchmaking channel
+- party_id: ID of the party message (0 for VOICE_CHANNEL_EMPTIED)
+- subject_id: ID of the member that joined / left / created / closed the party,
+  or ID of the party voice channel for STARTED_* and VOICE_CHANNEL_EMPTIED
+"""
+
+import asyncio
+import enum
+import os
+import struct
+import time
+import typing
+
+import numpy as np
+
+import config
+
+PARTY_EVENT_LOG_FILENAME = getattr(
+    config, "PARTY_EVENT_LOG_FILENAME", "party-events.bin"
+)
+
+# Buffered events are written once this many have been recorded or when the
+# flush interval has passed, whichever happens first.
+FLUSH_BATCH_SIZE = 256
+FLUSH_INTERVAL_SECONDS = 60
+
+EVENT_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("kind", "u1"),
+        ("channel_id", "<i8"),
+        ("party_id", "<i8"),
+        ("subject_id", "<i8"),
+    ]
+)
+_RECORD = struct.Struct("<dBqqq")
+assert _RECORD.size == EVENT_DTYPE.itemsize
+
+
+class EventKind(enum.IntEnum):
+    CREATED = 1
+    MEMBER_JOINED = 2
+    MEMBER_LEFT = 3
+    STARTED_FULL = 4
+    STARTED_FORCED = 5
+    CLOSED = 6
+    VOICE_CHANNEL_EMPTIED = 7
+
+
+class PartyEventLog:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._buffer = bytearray()
+        self._flush_task = None
+
+    def record(
+        self, kind: EventKind, channel_id: int, party_id: int, subject_id: int = 0
+    ) -> None:
+        self._buffer += _RECORD.pack(
+            time.time(), kind, channel_id, party_id, subject_id
+        )
+        if len(self._buffer) >= FLUSH_BATCH_SIZE * _RECORD.size:
+            self._schedule_flush()
+
+    def start(self) -> None:
+        """
+        Starts flushing buffered events periodically. Must be called from
+        within the event loop. Calling this again has no effect.
+        """
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        data, self._buffer = bytes(self._buffer), bytearray()
+        if len(data) > 0:
+            asyncio.get_event_loop().run_in_executor(None, self._write, data)
+
+    def _write(self, data: bytes) -> None:
+        with open(self.filename, "ab") as f:
+            f.write(data)
+
+    def flush(self) -> None:
+        """
+        Writes all buffered events synchronously (e.g. on shutdown).
+        """
+        data, self._buffer = bytes(self._buffer), bytearray()
+        if len(data) > 0:
+            self._write(data)
+
+    def load(self, since: float = 0) -> np.ndarray:
+        """
+        Returns all events recorded after `since` as a structured array.
+        """
+        if os.path.exists(self.filename):
+            size = os.path.getsize(self.filename)
+            count = size // EVENT_DTYPE.itemsize  # ignore torn writes
+            events = np.fromfile(self.filename, dtype=EVENT_DTYPE, count=count)
+        else:
+            events = np.empty(0, dtype=EVENT_DTYPE)
+        buffered = np.frombuffer(bytes(self._buffer), dtype=EVENT_DTYPE)
+        events = np.concatenate([events, buffered])
+        return events[events["time"] >= since]
+
+
+class GameStatistics(typing.NamedTuple):
+    created: int
+    started_full: int
+    started_forced: int
+    closed: int
+    wait_percentiles: typing.Optional[typing.Tuple[float, float, float]]
+    hourly_demand: np.ndarray  # parties created per hour of day (UTC)
+
+
+def compute_statistics(events: np.ndarray) -> typing.Dict[int, GameStatistics]:
+    """
+    Computes statistics per party matchmaking channel:
+    - how many parties were created, started (full or forced) and closed,
+    - 50th, 90th and 99th percentile of the time from creation to start,
+    - parties created per hour of the day.
+    """
+    stats = {}
+    kinds = events["kind"]
+    started_kinds = np.isin(kinds, [EventKind.STARTED_FULL, EventKind.STARTED_FORCED])
+    for channel_id in np.unique(events["channel_id"]):
+        in_channel = events["channel_id"] == channel_id
+        created = events[in_channel & (kinds == EventKind.CREATED)]
+        started = events[in_channel & started_kinds]
+
+        # join started parties with their creation by party id
+        if len(created) > 0:
+            created = created[np.argsort(created["party_id"], kind="stable")]
+            index = np.searchsorted(created["party_id"], started["party_id"])
+            index = np.minimum(index, len(created) - 1)
+            matched = created["party_id"][index] == started["party_id"]
+            waits = started["time"][matched] - created["time"][index[matched]]
+        else:
+            waits = np.empty(0)
+        wait_percentiles = (
+            tuple(np.percentile(waits, [50, 90, 99])) if len(waits) > 0 else None
+        )
+
+        hours = (created["time"] // 3600 % 24).astype(np.int64)
+        stats[int(channel_id)] = GameStatistics(
+            created=len(created),
+            started_full=int(
+                np.count_nonzero(started["kind"] == EventKind.STARTED_FULL)
+            ),
+            started_forced=int(
+                np.count_nonzero(started["kind"] == EventKind.STARTED_FORCED)
+            ),
+            closed=int(np.count_nonzero(in_channel & (kinds == EventKind.CLOSED))),
+            wait_percentiles=wait_percentiles,
+            hourly_demand=np.bincount(hours, minlength=24),
+        )
+    return stats
+
+
+def format_statistics(
+    stats: typing.Dict[int, GameStatistics], game_names: typing.Dict[int, str]
+) -> str:
+    if len(stats) == 0:
+        return "No party events recorded."
+
+    lines = []
+    for channel_id, s in stats.items():
+        name = game_names.get(channel_id, f"channel {channel_id}")
+        fill_rate = 100 * s.started_full / s.created if s.created > 0 else 0
+        lines.append(f"**{name}**: {s.created} parties, {fill_rate:.0f}% filled up")
+        lines.append(
+            f"- {s.started_full} started full, {s.started_forced} force started, "
+            f"{s.closed} closed"
+        )
+        if s.wait_percentiles is not None:
+            p50, p90, p99 = (round(p / 60, 1) for p in s.wait_percentiles)
+            lines.append(f"- Minutes until start: p50 {p50}, p90 {p90}, p99 {p99}")
+        if s.created > 0:
+            peak = int(np.argmax(s.hourly_demand))
+            lines.append(
+                f"- Peak hour: {peak:02d}:00 UTC "
+                f"({s.hourly_demand[peak]} parties created)"
+            )
+    return "\n".join(lines)
+
+
+event_log = PartyEventLog(PARTY_EVENT_LOG_FILENAME)
@@ -0,0 +1,192 @@
+"""
+This module implements on-demand profiling of the running bot (see the
+`profile` command).
+
+A profiling session collects:
+- a deterministic profile of everything running on the event loop thread,
+  written as a pstats file (`<name>.pstats`),
+- stack samples of the event loop thread, grouped by the asyncio task that
+  was running, written in collapsed stack format (`<name>.collapsed`),
+- wall-clock time spent waiting for REST calls, ZODB commits and the
+  synchronization locks, written in collapsed stack format with one count per
+  millisecond (`<name>.waits.collapsed`).
+
+Collapsed stack files can be turned into flamegraphs with e.g. `flamegraph.pl`
+or speedscope.
+"""
+
+import asyncio
+import collections
+import cProfile
+import os
+import sys
+import threading
+import time
+
+import config
+import synchronization
+import transaction
+
+PROFILE_OUTPUT_DIR = getattr(config, "PROFILE_OUTPUT_DIR", "profiles")
+
+# Interval between two stack samples of the event loop thread
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+_session = None
+
+
+def is_running() -> bool:
+    return _session is not None
+
+
+def start() -> None:
+    """
+    Starts a profiling session. Must be called from within the event loop.
+    """
+    global _session
+    if _session is not None:
+        raise RuntimeError("Profiling session already running")
+    _session = _ProfilingSession(asyncio.get_event_loop())
+    _session.start()
+
+
+async def stop() -> str:
+    """
+    Stops the running profiling session, writes all output files and returns
+    a short summary.
+    """
+    global _session
+    session = _session
+    _session = None
+    session.stop()
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, session.write_output)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class _ProfilingSession:
+    def __init__(self, loop):
+        self.loop = loop
+        self.name = time.strftime("profile-%Y%m%d-%H%M%S")
+        self.profile = cProfile.Profile()
+        self.samples = collections.Counter()  # collapsed stack -> samples
+        self.waits = collections.Counter()  # collapsed stack -> seconds
+        self.duration = 0
+
+        self._thread_id = threading.get_ident()
+        self._stop_sampling = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._original_commit = None
+        self._original_request = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._instrument()
+        self._sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self._stop_sampling.set()
+        self._sampler.join()
+        self._uninstrument()
+        self.duration = time.perf_counter() - self._started
+
+    def _instrument(self):
+        self._original_commit = transaction.commit
+        self._original_request = config.bot.http.request
+
+        original_commit = self._original_commit
+        original_request = self._original_request
+
+        def timed_commit(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original_commit(*args, **kwargs)
+            finally:
+                self._record_wait("zodb_commit", time.perf_counter() - start)
+
+        async def timed_request(route, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await original_request(route, *args, **kwargs)
+            finally:
+                self._record_wait(
+                    f"rest;{route.method} {route.path}", time.perf_counter() - start
+                )
+
+        def lock_wait_observer(func_name, seconds):
+            self._record_wait(f"lock_wait;{func_name}", seconds)
+
+        transaction.commit = timed_commit
+        config.bot.http.request = timed_request
+        synchronization.lock_wait_observer = lock_wait_observer
+
+    def _uninstrument(self):
+        transaction.commit = self._original_commit
+        # remove the instance attribute, falling back to the class method
+        del config.bot.http.request
+        synchronization.lock_wait_observer = None
+
+    def _record_wait(self, stack, seconds):
+        task = asyncio.current_task(self.loop)
+        task_name = task.get_coro().__qualname__ if task is not None else "<loop>"
+        self.waits[f"{task_name};{stack}"] += seconds
+
+    def _sample(self):
+        while not self._stop_sampling.wait(SAMPLE_INTERVAL_SECONDS):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self.loop)
+            if task is None:
+                root = "<loop>"
+            else:
+                root = f"task {task.get_coro().__qualname__}"
+
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(root)
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write_output(self) -> str:
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        prefix = os.path.join(PROFILE_OUTPUT_DIR, self.name)
+
+        self.profile.dump_stats(prefix + ".pstats")
+        with open(prefix + ".collapsed", "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(prefix + ".waits.collapsed", "w") as f:
+            for stack, seconds in self.waits.most_common():
+                f.write(f"{stack} {round(seconds * 1000)}\n")
+
+        return self._summary(prefix)
+
+    def _summary(self, prefix) -> str:
+        totals = collections.Counter()
+        for stack, seconds in self.waits.items():
+            totals[stack.split(";")[1]] += seconds
+        busy_samples = sum(
+            count
+            for stack, count in self.samples.items()
+            if not stack.startswith("<loop>")
+        )
+        total_samples = sum(self.samples.values()) or 1
+
+        lines = [
+            f"Profiled for {self.duration:.1f}s, output written to `{prefix}.*`.",
+            f"- Event loop busy running tasks: "
+            f"{100 * busy_samples / total_samples:.1f}% of samples",
+        ]
+        for category in ["rest", "zodb_commit", "lock_wait"]:
+            lines.append(f"- {category}: {totals[category]:.3f}s")
+        return "\n".join(lines)
@@ -1,4 +1,6 @@
 import config
+import rest
+from message_cache import managed_messages
 
 
 class ReactionPayload:
@@ -13,13 +15,17 @@ class ReactionPayload:
     Instead, use the `unwrap_payload` function.
     """
 
-    # this might be a bit heavy on the API
     async def _init(self, payload):
         self.guild = config.bot.get_guild(payload.guild_id)
-        self.member = await self.guild.fetch_member(payload.user_id)
+        # added reactions carry the member, removed reactions only the user id
+        self.member = payload.member or self.guild.get_member(payload.user_id)
+        if self.member is None:
+            self.member = await rest.call(
+                "fetch_member", self.guild.fetch_member, payload.user_id
+            )
         self.emoji = payload.emoji
         self.channel = config.bot.get_channel(payload.channel_id)
-        self.message = await self.channel.fetch_message(payload.message_id)
+        self.message = await managed_messages.fetch(self.channel, payload.message_id)
 
 
 async def unwrap_payload(payload):
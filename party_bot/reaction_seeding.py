@@ -0,0 +1,97 @@
+"""
+This module implements the seeding of the bot's own emoji reactions on menu and
+party messages.
+
+Adding reactions with `await message.add_reaction(...)` in the handlers costs a
+full round trip per emoji before the handler can continue. Instead, the
+`ReactionSeeder` adds them in the background: requests are started in menu
+order, paced to the reaction route's rate limit per channel, and up to
+`MAX_IN_FLIGHT_PER_MESSAGE` requests of a message are in flight at the same
+time, so slow round trips don't slow down seeding. Reactions still show up in
+menu order: the requests of a message share discord.py's rate limit bucket,
+which sends them one after another in the order in which they were started.
+"""
+
+import asyncio
+import logging
+import time
+import typing
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# Discord allows one reaction per channel every 250ms
+REACTION_INTERVAL_SECONDS = 0.25
+
+# Maximum amount of concurrent reaction requests, in total and per message
+MAX_IN_FLIGHT = 4
+MAX_IN_FLIGHT_PER_MESSAGE = 2
+
+
+class ReactionSeeder:
+    def __init__(self, interval=REACTION_INTERVAL_SECONDS, max_in_flight=MAX_IN_FLIGHT):
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self._semaphore = None
+        self._next_slot = {}  # channel id -> time of next free slot
+        self._tasks = set()
+
+    def seed(self, message: discord.Message, emojis: typing.Iterable) -> asyncio.Task:
+        """
+        Adds the emojis as reactions to the message in the given order.
+
+        Returns immediately. The returned task completes once all reactions
+        have been added and may be awaited if necessary.
+        """
+        task = asyncio.ensure_future(self._seed(message, list(emojis)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _reserve_slot(self, channel_id: int) -> float:
+        now = time.monotonic()
+        # forget channels without reserved slots
+        for id in [id for id, slot in self._next_slot.items() if slot <= now]:
+            del self._next_slot[id]
+        slot = max(now, self._next_slot.get(channel_id, now))
+        self._next_slot[channel_id] = slot + self.interval
+        return slot
+
+    async def _seed(self, message, emojis) -> bool:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT_PER_MESSAGE)
+
+        requests = []
+        for emoji in emojis:
+            await in_flight.acquire()
+            delay = self._reserve_slot(message.channel.id) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if any(request.done() and not request.result() for request in requests):
+                in_flight.release()
+                break  # message is gone, stop seeding
+            requests.append(asyncio.ensure_future(self._add(message, emoji, in_flight)))
+        return all(await asyncio.gather(*requests))
+
+    async def _add(self, message, emoji, in_flight) -> bool:
+        try:
+            async with self._semaphore:
+                await message.add_reaction(emoji)
+            return True
+        except discord.NotFound:
+            return False  # message was already deleted
+        except discord.HTTPException as e:
+            logger.warning(
+                "Could not add reaction %s: %s",
+                emoji,
+                e,
+                extra={"channel_id": message.channel.id, "message_id": message.id},
+            )
+            return True  # e.g. unknown emoji, carry on with the others
+        finally:
+            in_flight.release()
+
+
+reaction_seeder = ReactionSeeder()
@@ -0,0 +1,257 @@
+"""
+This module implements a resilience layer for Discord REST calls made by the
+event handlers.
+
+`call` runs a REST call with
+- a timeout per route (`ROUTE_TIMEOUTS`), which also bounds discord.py's own
+  retries of server errors,
+- up to `MAX_RETRIES` retries with jittered exponential backoff for server
+  errors (5xx) and timeouts, for idempotent routes only, and
+- a circuit breaker shared by all routes: after `BREAKER_THRESHOLD`
+  consecutive server errors or timeouts, all calls fail fast with
+  `CircuitOpenError` for `BREAKER_COOLDOWN_SECONDS`. Afterwards, a single
+  trial call decides whether the circuit closes again.
+
+Rate limits are not failures. discord.py waits for them inside the call, so
+the timeout only starts once the request is sent and is extended by the
+`Retry-After` of every 429 response (see `http_trace`, which the bot has to
+pass to discord.py). discord.py raises `discord.RateLimited` instead of
+waiting longer than `MAX_RATELIMIT_WAIT_SECONDS`; such calls fail without
+being retried or counted by the circuit breaker.
+
+Handlers catch `FAILURES` and commit the database changes made so far (see
+`emoji_handling.handle_react`). The transaction is not rolled back, since the
+calls that succeeded before the failure can't be rolled back either. Instead,
+handlers record a side effect in the database right after the call that caused
+it succeeded, and undo database changes made ahead of a call if it fails.
+"""
+
+import aiohttp
+import asyncio
+import contextvars
+import discord
+import logging
+import random
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+# route -> (timeout in seconds, idempotent)
+ROUTE_TIMEOUTS = {
+    "fetch_member": (5, True),
+    "fetch_message": (5, True),
+    "edit_message": (5, True),
+    "delete_message": (5, True),
+    "edit_channel": (10, True),
+    "delete_channel": (10, True),
+    "create_channel": (10, False),
+}
+DEFAULT_ROUTE_TIMEOUT = (5, False)
+
+MAX_RETRIES = 2
+BACKOFF_BASE_SECONDS = 0.5
+
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN_SECONDS = 30
+
+# Passed to discord.py as `max_ratelimit_timeout` (30 is its minimum)
+MAX_RATELIMIT_WAIT_SECONDS = 30
+
+
+class CircuitOpenError(discord.DiscordException):
+    """
+    Raised instead of making a REST call while Discord appears to be down.
+    """
+
+
+# Exceptions a REST call made through `call` may raise
+FAILURES = (
+    discord.HTTPException,
+    discord.RateLimited,
+    asyncio.TimeoutError,
+    CircuitOpenError,
+)
+
+
+class CircuitBreaker:
+    def __init__(
+        self, threshold=BREAKER_THRESHOLD, cooldown_seconds=BREAKER_COOLDOWN_SECONDS
+    ):
+        self.threshold = threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_call(self) -> None:
+        """
+        Raises `CircuitOpenError` if the call has to fail fast.
+        """
+        if self.opened_at is None:
+            return
+        if time.monotonic() - self.opened_at < self.cooldown_seconds:
+            raise CircuitOpenError()
+        if self._trial_running:
+            raise CircuitOpenError()
+        self._trial_running = True  # half open, let this call through
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("Discord API recovered, closing circuit breaker.")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self._trial_running or (
+            self.opened_at is None and self.consecutive_failures >= self.threshold
+        ):
+            logger.warning(
+                "Discord API is failing, opening circuit breaker for %ds.",
+                self.cooldown_seconds,
+            )
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def record_other(self) -> None:
+        # the call did not tell us anything about the API's health
+        self._trial_running = False
+
+
+circuit_breaker = CircuitBreaker()
+
+
+def _is_server_failure(e: BaseException) -> bool:
+    if isinstance(e, asyncio.TimeoutError):
+        return True
+    return isinstance(e, discord.HTTPException) and e.status >= 500
+
+
+class _Deadline:
+    """
+    Deadline of a REST call, moved by the `http_trace` hooks of the requests
+    the call sends.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        # until the first request is sent, discord.py waits for rate limit
+        # buckets, which it bounds by MAX_RATELIMIT_WAIT_SECONDS
+        self.at = time.monotonic() + MAX_RATELIMIT_WAIT_SECONDS + timeout
+        self.sent = False
+        self.moved = asyncio.Event()
+
+    def move(self, at: float) -> None:
+        self.at = at
+        self.moved.set()
+
+
+_deadline: contextvars.ContextVar[typing.Optional[_Deadline]] = contextvars.ContextVar(
+    "rest_deadline", default=None
+)
+
+
+async def _on_request_start(session, context, params) -> None:
+    deadline = _deadline.get()
+    if deadline is not None and not deadline.sent:
+        deadline.sent = True
+        deadline.move(time.monotonic() + deadline.timeout)
+
+
+async def _on_request_end(session, context, params) -> None:
+    deadline = _deadline.get()
+    if deadline is not None and params.response.status == 429:
+        # discord.py sleeps for the rate limit and retries
+        try:
+            retry_after = float(params.response.headers.get("Retry-After", 0))
+        except ValueError:
+            return
+        deadline.move(deadline.at + retry_after)
+
+
+def http_trace() -> aiohttp.TraceConfig:
+    """
+    Returns the `http_trace` to pass to the bot, which keeps rate limits out
+    of the timeouts of `call`.
+    """
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_request_end.append(_on_request_end)
+    return trace
+
+
+async def _with_timeout(
+    timeout: float, func: typing.Callable, args, kwargs
+) -> typing.Any:
+    deadline = _Deadline(timeout)
+    token = _deadline.set(deadline)
+    try:
+        # the task runs in a copy of the current context, i.e. with `deadline`
+        task = asyncio.ensure_future(func(*args, **kwargs))
+    finally:
+        _deadline.reset(token)
+
+    try:
+        while not task.done():
+            remaining = deadline.at - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            deadline.moved.clear()
+            moved = asyncio.ensure_future(deadline.moved.wait())
+            try:
+                await asyncio.wait(
+                    [task, moved],
+                    timeout=remaining,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                moved.cancel()
+    except BaseException:
+        task.cancel()
+        raise
+    return task.result()
+
+
+async def call(route: str, func: typing.Callable, *args, **kwargs) -> typing.Any:
+    """
+    Returns `await func(*args, **kwargs)`, made resilient as described in the
+    module documentation. Raises one of `FAILURES` if the call failed.
+    """
+    timeout, idempotent = ROUTE_TIMEOUTS.get(route, DEFAULT_ROUTE_TIMEOUT)
+    retries = MAX_RETRIES if idempotent else 0
+    attempt = 0
+    while True:
+        circuit_breaker.before_call()
+        try:
+            result = await _with_timeout(timeout, func, args, kwargs)
+        except discord.RateLimited as e:
+            # discord.py refused to wait that long, the API itself is fine
+            circuit_breaker.record_other()
+            logger.warning("REST call %s rate limited for %.0fs", route, e.retry_after)
+            raise
+        except Exception as e:
+            if not _is_server_failure(e):
+                if isinstance(e, discord.HTTPException) and e.status != 429:
+                    circuit_breaker.record_success()  # the API did respond
+                else:
+                    circuit_breaker.record_other()
+                raise
+            circuit_breaker.record_failure()
+            if attempt >= retries or circuit_breaker.is_open():
+                logger.warning("REST call %s failed: %r", route, e)
+                raise
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, BACKOFF_BASE_SECONDS * 2**attempt))
+            continue
+        except BaseException:
+            # e.g. the handler got cancelled, which must not leave a trial call
+            # of the circuit breaker running forever
+            circuit_breaker.record_other()
+            raise
+        circuit_breaker.record_success()
+        return result
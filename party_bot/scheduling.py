@@ -1,37 +1,86 @@
-import asyncio
 import config
 import discord
-import pytz
-import sys
-import transaction
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from datetime import datetime, timedelta
+import guild_settings
+import io
+import logging
+import message_registry
+import os
+import pickle
+import sqlite3
+from datetime import timedelta
+from delay_queue import DelayQueue, callable_name, resolve_callable
+
+logger = logging.getLogger(__name__)
 
 # tracks channels that are not to be deleted because they're within grace period
 # held in memory because persistency is not necessary
 channel_ids_grace_period = set()
 
-jobstores = {
-    "default": SQLAlchemyJobStore(url="sqlite:///" + config.SCHEDULER_DB_FILENAME)
-}
+SCHEDULER_QUEUE_FILENAME = getattr(
+    config, "SCHEDULER_QUEUE_FILENAME", "scheduler-queue.log"
+)
 
 _scheduler = None
 
 
-def init_scheduler():
-    """Initializes the scheduler. Must be run **after**
-    config has been initialized."""
-    sys.stdout.write("Starting scheduler...")
+def load_scheduler():
+    """Loads all pending jobs. Only does file I/O and may be run in a worker
+    thread. Jobs can be scheduled as soon as this has completed."""
+    logger.info("Loading scheduler")
     global _scheduler
-    _scheduler = AsyncIOScheduler(
-        jobstores=jobstores, job_defaults={"misfire_grace_time": None}
+    scheduler = DelayQueue(SCHEDULER_QUEUE_FILENAME)
+    scheduler.load()
+    _scheduler = scheduler
+    _import_legacy_jobs()
+    _scheduler.register_batch_handler(
+        _message_delayed_delete,
+        _message_delayed_delete_batch,
+        key=lambda args: args[1],  # channel id
+        max_batch_size=100,
     )
-    _scheduler.start()
-    sys.stdout.write("done\n")
+    logger.info("Scheduler loaded with %d pending jobs", len(_scheduler))
+
+
+def start_scheduler():
+    """Starts executing jobs. Must be run **after** the scheduler has been
+    loaded and the bot is connected, since jobs rely on the bot's cache.
+    Calling this again has no effect."""
+    if not _scheduler.running():
+        _scheduler.start()
+
+
+def scheduler_stats() -> dict:
+    if _scheduler is None:
+        return {"loaded": False}
+    return {
+        "loaded": True,
+        "running": _scheduler.running(),
+        "pending": len(_scheduler),
+        "overdue": _scheduler.overdue_count(),
+        "catching_up": _scheduler.catching_up(),
+    }
+
 
+def export_jobs() -> list:
+    """
+    Returns all pending jobs as plain data (see `snapshot`), including overdue
+    jobs that are still being caught up on.
+    """
+    return [[job.due, job.func, job.args] for job in _scheduler.pending_jobs()]
 
-def message_delayed_delete(message, delay=config.MESSAGE_DELETE_DELAY_SECONDS):
+
+def import_jobs(jobs: list) -> None:
+    """
+    Schedules the jobs returned by `export_jobs`, keeping their due times.
+    """
+    for due, func_name, args in jobs:
+        _scheduler.schedule_at(func_name, args, due)
+
+
+def message_delayed_delete(message, delay=None):
+    if delay is None:
+        guild_id = message.guild.id if message.guild is not None else None
+        delay = guild_settings.get(guild_id).message_delete_delay_seconds
     return delayed_execute(
         _message_delayed_delete,
         [message.id, message.channel.id],
@@ -42,53 +91,122 @@ def message_delayed_delete(message, delay=config.MESSAGE_DELETE_DELAY_SECONDS):
 async def _message_delayed_delete(message_id, channel_id):
     channel = config.bot.get_channel(channel_id)
     try:
-        message = await channel.fetch_message(message_id)
-        await message.delete()
+        # deleting doesn't need the message's content
+        await channel.get_partial_message(message_id).delete()
     except discord.NotFound:
         pass  # message was already deleted, ignore
 
 
+async def _message_delayed_delete_batch(args_list):
+    """
+    Batch handler for overdue `_message_delayed_delete` jobs of one channel.
+    Deletes the messages using a single bulk delete where possible.
+    """
+    channel = config.bot.get_channel(args_list[0][1])
+    if channel is None:
+        return  # channel was deleted
+
+    await message_registry.delete_messages(channel, [args[0] for args in args_list])
+
+
 def channel_start_grace_period(
-    voice_channel, grace_period_seconds, delete_callback=None, delete_callback_args=[]
+    voice_channel,
+    grace_period_seconds,
+    delete_callback=None,
+    delete_callback_args=[],
+    release_callback=None,
 ):
+    """
+    Protects a voice channel from being deleted for the grace period.
+    If the channel is still empty afterwards, it is deleted and
+    `delete_callback(voice_channel, *delete_callback_args)` is called.
+    If `release_callback` is given, the channel is not deleted but passed to
+    `await release_callback(voice_channel, *delete_callback_args)` instead.
+    """
     channel_ids_grace_period.add(voice_channel.id)
+    if delete_callback is not None:
+        delete_callback = callable_name(delete_callback)
+    if release_callback is not None:
+        release_callback = callable_name(release_callback)
     delayed_execute(
         _remove_grace_protection,
-        [voice_channel.id, delete_callback, delete_callback_args],
+        [voice_channel.id, delete_callback, delete_callback_args, release_callback],
         timedelta(seconds=grace_period_seconds),
     )
 
 
 async def _remove_grace_protection(
-    voice_channel_id, delete_callback, delete_callback_args
+    voice_channel_id, delete_callback, delete_callback_args, release_callback=None
 ):
     voice_channel = config.bot.get_channel(voice_channel_id)
+    channel_ids_grace_period.discard(voice_channel_id)
 
     if voice_channel is not None and len(voice_channel.members) == 0:
+        if release_callback is not None:
+            await resolve_callable(release_callback)(
+                voice_channel, *delete_callback_args
+            )
+            return
         await voice_channel.delete()
         if delete_callback is not None:
-            delete_callback(voice_channel, *delete_callback_args)
-
-    channel_ids_grace_period.discard(voice_channel_id)
+            resolve_callable(delete_callback)(voice_channel, *delete_callback_args)
 
 
 def delayed_execute(func, args, timedelta):
-    exec_time = datetime.now(config.TIMEZONE) + timedelta
+    """
+    Executes `func(*args)` after `timedelta` has passed, even if the bot gets
+    restarted in the meantime. The database is committed after execution.
+    Returns the job ID that can be passed to `deschedule`.
+    """
+    return _scheduler.schedule(func, args, timedelta.total_seconds())
 
-    id = _scheduler.add_job(
-        _execute_wrapper, "date", args=[func] + args, run_date=exec_time
-    ).id
-    return id
 
+def deschedule(job_id):
+    _scheduler.cancel(job_id)
 
-# wrap function to include transaction.commit
-async def _execute_wrapper(func, *args, **kwargs):
-    ret = func(*args, **kwargs)
-    if asyncio.iscoroutine(ret):
-        ret = await ret
-    transaction.commit()
-    return ret
 
+class _LegacyObject:
+    """Placeholder for APScheduler objects in legacy job states."""
 
-def deschedule(job_id):
-    _scheduler.remove_job(job_id)
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+
+class _LegacyJobUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module.split(".")[0] == "apscheduler":
+            return _LegacyObject
+        return super().find_class(module, name)
+
+
+def _import_legacy_jobs():
+    """
+    Moves pending jobs from the SQLite job store used by previous versions
+    (`config.SCHEDULER_DB_FILENAME`) to the delay queue.
+    """
+    filename = getattr(config, "SCHEDULER_DB_FILENAME", None)
+    if filename is None or not os.path.exists(filename):
+        return
+
+    connection = sqlite3.connect(filename)
+    try:
+        rows = connection.execute(
+            "SELECT next_run_time, job_state FROM apscheduler_jobs"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []  # no jobs were ever scheduled
+    finally:
+        connection.close()
+
+    for next_run_time, job_state in rows:
+        state = _LegacyJobUnpickler(io.BytesIO(job_state)).load()
+        func, *args = state["args"]
+        if func is _remove_grace_protection and args[1] is not None:
+            args[1] = callable_name(args[1])
+        _scheduler.schedule_at(callable_name(func), args, next_run_time)
+
+    os.replace(filename, filename + ".imported")
+    logger.info("Imported %d jobs from legacy job store %s", len(rows), filename)
@@ -0,0 +1,107 @@
+"""
+This module implements the slot accounting of open parties.
+
+Party actions of different members run concurrently (see
+`party.handle_party_interaction`), and joining or leaving a party takes
+several REST calls. The ledger keeps them from overfilling a party and makes
+sure that a party is started or closed exactly once, while no other action of
+that party is in flight.
+
+The slots themselves are not counted here. A party is full once its party
+message has `max_slots` users in the party message index of the channel (see
+`PartyChannelInformation.party_size`). `reserve` checks that and adds the
+member to the index without yielding to the event loop, so it is atomic with
+respect to all other handlers. The ledger only keeps, in memory,
+- the amount of joins and leaves in flight per party (`begin` / `end`), and
+- the parties that are being started or closed (`claim`).
+
+After the last action in flight ended, `claim_full` claims starting the party
+if it is full. Starting early or closing the party is claimed with `claim`,
+which fails while actions are in flight. A party stays claimed until it is
+forgotten (`forget`) or the start or close failed (`unclaim`).
+"""
+
+import collections
+import typing
+
+
+class PartySlotLedger:
+    def __init__(self):
+        # party message id -> joins and leaves in flight
+        self._in_flight: typing.Counter[int] = collections.Counter()
+        # party message ids of parties being started or closed
+        self._claimed: typing.Set[int] = set()
+
+    def begin(self, message_id: int) -> bool:
+        """
+        Registers a join or leave of the party that is about to start.
+        Returns False if the party is being started or closed.
+        Every successful `begin` must be followed by an `end`.
+        """
+        if message_id in self._claimed:
+            return False
+        self._in_flight[message_id] += 1
+        return True
+
+    def end(self, message_id: int) -> None:
+        self._in_flight[message_id] -= 1
+        if self._in_flight[message_id] <= 0:
+            del self._in_flight[message_id]
+
+    def reserve(self, channel_info, party_message, member) -> bool:
+        """
+        Begins a join: adds the member to the party message index of the
+        channel if the party has a free slot and is not being started or
+        closed. Returns False otherwise.
+
+        If adding the member to the party message fails, the caller has to
+        remove the member from the index again. Either way, it has to call
+        `end` afterwards.
+        """
+        if channel_info.party_size(party_message.id) >= channel_info.max_slots:
+            return False
+        if not self.begin(party_message.id):
+            return False
+        channel_info.set_party_message_of_user(member, party_message)
+        return True
+
+    def claim_full(self, channel_info, message_id: int) -> bool:
+        """
+        Claims starting the party if it is full, no joins or leaves are in
+        flight and it is not claimed already.
+
+        Returns True if and only if the caller has to start the party. Call
+        this after `end`ing a join.
+        """
+        if channel_info.party_size(message_id) < channel_info.max_slots:
+            return False
+        return self.claim(message_id)
+
+    def claim(self, message_id: int) -> bool:
+        """
+        Claims starting or closing the party.
+        Returns False if joins or leaves are in flight or the party is claimed
+        already.
+        """
+        if message_id in self._in_flight or message_id in self._claimed:
+            return False
+        self._claimed.add(message_id)
+        return True
+
+    def unclaim(self, message_id: int) -> None:
+        """
+        Releases a claim, if starting or closing the party failed.
+        """
+        self._claimed.discard(message_id)
+
+    def forget(self, message_id: int) -> None:
+        """
+        Called when the party message got deleted.
+        """
+        self._claimed.discard(message_id)
+
+    def __len__(self) -> int:
+        return len(self._claimed.union(self._in_flight))
+
+
+slot_ledger = PartySlotLedger()
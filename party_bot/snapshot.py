@@ -0,0 +1,225 @@
+"""
+This module implements snapshots of the bot's state, e.g. to move the bot to
+another host.
+
+A snapshot contains all channel information objects, the remaining database
+containers and all pending scheduled jobs, taken at the same point in time.
+Snapshots consist of a fixed header (see `_HEADER`) followed by the state as
+plain data (no classes), pickled and compressed with zlib.
+
+Snapshots are exported with the `exportstate` command or offline with
+    python snapshot.py export <filename>
+and restored into an empty database and scheduler queue (as configured in
+`config.py`) with
+    python snapshot.py restore <filename>
+The restored state is committed in a single transaction.
+"""
+
+import asyncio
+import database
+import io
+import logging
+import os
+import pickle
+import scheduling
+import struct
+import sys
+import time
+import transaction
+import typing
+import zlib
+from BTrees.LLBTree import LLTreeSet
+from BTrees.LOBTree import LOBTree
+from BTrees.OOBTree import OOBTree
+from channelinformation import GamesChannelInformation, PartyChannelInformation
+from database import db
+from synchronization import synchronized
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"PBSNAP"
+# Increase whenever the snapshot layout changes incompatibly
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Oldest database schema version of snapshots that can be restored. Later
+# versions only added containers, which are restored empty from older
+# snapshots.
+MIN_SCHEMA_VERSION = 4
+
+# magic, format version, database schema version, creation time
+_HEADER = struct.Struct("<6sHHd")
+
+
+class _PlainDataUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(
+            f"Snapshots only contain plain data, found {module}.{name}"
+        )
+
+
+def collect_state() -> dict:
+    """
+    Returns the bot's state as plain data.
+    """
+    return {
+        "party_channels": [info.to_snapshot() for info in db.party_channels.values()],
+        "games_channels": [info.to_snapshot() for info in db.games_channels.values()],
+        "event_channels": list(db.event_channels),
+        "event_voice_channels": list(db.event_voice_channels),
+        "bot_messages": [
+            [channel_id, list(message_ids)]
+            for channel_id, message_ids in db.bot_messages.items()
+        ],
+        "guild_settings": [
+            [guild_id, dict(settings)]
+            for guild_id, settings in db.guild_settings.items()
+        ],
+        "jobs": scheduling.export_jobs(),
+    }
+
+
+def encode(state: dict) -> bytes:
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, database.SCHEMA_VERSION, time.time()
+    )
+    return header + zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+
+
+def decode(data: bytes) -> dict:
+    magic, format_version, schema_version, _ = _HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a snapshot file.")
+    if format_version > SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format version {format_version}.")
+    if not MIN_SCHEMA_VERSION <= schema_version <= database.SCHEMA_VERSION:
+        raise ValueError(
+            f"Unsupported database schema version {schema_version} "
+            f"(supported: {MIN_SCHEMA_VERSION} to {database.SCHEMA_VERSION})."
+        )
+    body = zlib.decompress(data[_HEADER.size :])
+    return _PlainDataUnpickler(io.BytesIO(body)).load()
+
+
+def _summary(state: dict) -> str:
+    return (
+        f"{len(state['party_channels'])} party channels, "
+        f"{len(state['games_channels'])} games channels, "
+        f"{len(state['event_channels'])} event channels, "
+        f"{len(state['jobs'])} scheduled jobs"
+    )
+
+
+@synchronized
+async def _collect_state_synchronized() -> dict:
+    # synchronized handlers can't be halfway through changing the state in the
+    # meantime. Party actions (see `party`) don't wait for this, but record
+    # each of their steps as soon as it succeeded.
+    return collect_state()
+
+
+async def export_snapshot(filename: str) -> str:
+    """
+    Writes a snapshot of the running bot's state to `filename` and returns a
+    summary including the timings.
+    """
+    start = time.perf_counter()
+    state = await _collect_state_synchronized()
+    collected = time.perf_counter()
+
+    def write():
+        data = encode(state)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            f.write(data)
+        os.replace(tmp_filename, filename)
+        return len(data)
+
+    size = await asyncio.get_event_loop().run_in_executor(None, write)
+    done = time.perf_counter()
+    summary = (
+        f"Exported {_summary(state)} to `{filename}` ({size / 1024:.1f} KiB): "
+        f"collected in {collected - start:.2f}s, written in {done - collected:.2f}s"
+    )
+    logger.info(summary)
+    return summary
+
+
+def restore_state(state: dict) -> None:
+    """
+    Loads the state returned by `collect_state` into the (empty) database
+    and scheduler queue and commits it in a single transaction.
+    """
+    party_channels = LOBTree()
+    for data in state["party_channels"]:
+        party_channels[data["id"]] = PartyChannelInformation.from_snapshot(data)
+    games_channels = LOBTree()
+    for data in state["games_channels"]:
+        games_channels[data["id"]] = GamesChannelInformation.from_snapshot(data)
+    bot_messages = LOBTree()
+    for channel_id, message_ids in state["bot_messages"]:
+        bot_messages[channel_id] = LLTreeSet(message_ids)
+    guild_settings = LOBTree()
+    # snapshots of previous versions don't contain guild settings
+    for guild_id, settings in state.get("guild_settings", []):
+        guild_settings[guild_id] = OOBTree(settings)
+
+    db.party_channels = party_channels
+    db.games_channels = games_channels
+    db.event_channels = LLTreeSet(state["event_channels"])
+    db.event_voice_channels = LLTreeSet(state["event_voice_channels"])
+    db.bot_messages = bot_messages
+    db.guild_settings = guild_settings
+    db.schema_version = database.SCHEMA_VERSION
+    transaction.commit()
+
+    scheduling.import_jobs(state["jobs"])
+
+
+def _has_state() -> bool:
+    return (
+        len(db.party_channels) > 0
+        or len(db.games_channels) > 0
+        or len(db.event_channels) > 0
+        or len(db.guild_settings) > 0
+        or len(scheduling.export_jobs()) > 0
+    )
+
+
+def _main(argv: typing.List[str]) -> int:
+    if len(argv) != 3 or argv[1] not in ("export", "restore"):
+        print(f"Usage: {argv[0]} export|restore <filename>", file=sys.stderr)
+        return 2
+    command, filename = argv[1:]
+
+    start = time.perf_counter()
+    database.open_database(database.open_storage())
+    scheduling.load_scheduler()
+    opened = time.perf_counter()
+
+    if command == "export":
+        state = collect_state()
+        data = encode(state)
+        with open(filename, "wb") as f:
+            f.write(data)
+        print(f"Exported {_summary(state)} ({len(data) / 1024:.1f} KiB)")
+    else:
+        if _has_state():
+            print("Refusing to restore into a database that is not empty.")
+            return 1
+        with open(filename, "rb") as f:
+            try:
+                state = decode(f.read())
+            except ValueError as e:
+                print(f"Can't restore {filename}: {e}")
+                return 1
+        restore_state(state)
+        print(f"Restored {_summary(state)}")
+
+    done = time.perf_counter()
+    database.connection.db().close()
+    print(f"Opening took {opened - start:.2f}s, {command} took {done - opened:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,113 @@
+"""
+This module implements the bot's startup sequence.
+
+Opening the database, loading the scheduler and logging in to Discord are
+independent of each other and run concurrently. Gateway events that arrive
+before the bot's state is ready are held back by event handlers decorated with
+`after_ready`.
+
+The duration of each startup phase is recorded in `timings` and logged once
+the bot is ready.
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+
+import checks
+import config
+import database
+import scheduling
+
+logger = logging.getLogger(__name__)
+
+# phase -> duration in seconds
+timings = {}
+
+_started = None
+_state_ready = asyncio.Event()
+
+
+@contextlib.contextmanager
+def timed(phase: str):
+    """
+    Records the duration of the `with` block as startup phase `phase`.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - start
+
+
+def is_ready() -> bool:
+    return _state_ready.is_set()
+
+
+def after_ready(handler):
+    """
+    Event handler decorator that holds back events until the bot's state
+    (database, scheduler) is ready.
+    """
+
+    @functools.wraps(handler)
+    async def wrapped_handler(*args, **kwargs):
+        if not _state_ready.is_set():
+            await _state_ready.wait()
+        return await handler(*args, **kwargs)
+
+    return wrapped_handler
+
+
+async def _open_database():
+    loop = asyncio.get_running_loop()
+    with timed("database"):
+        storage = await loop.run_in_executor(None, database.open_storage)
+        database.open_database(storage)
+        checks.build_feature_registry()
+
+
+async def _load_scheduler():
+    loop = asyncio.get_running_loop()
+    with timed("scheduler"):
+        await loop.run_in_executor(None, scheduling.load_scheduler)
+
+
+async def run(bot, token: str) -> None:
+    """
+    Starts the bot and runs it until it is closed.
+    """
+    global _started
+    _started = time.perf_counter()
+    config.init_config(bot)
+
+    async with bot:
+        state = asyncio.gather(_open_database(), _load_scheduler())
+        with timed("login"):
+            await bot.login(token)
+        gateway = asyncio.ensure_future(bot.connect())
+
+        try:
+            await state
+        except BaseException:
+            gateway.cancel()
+            raise
+        _state_ready.set()
+        await gateway
+
+
+def gateway_ready() -> None:
+    """
+    Must be called from `on_ready`. Records the total startup time and logs
+    the durations of all startup phases (only once).
+    """
+    if "total" in timings or _started is None:
+        return
+    timings["gateway"] = time.perf_counter() - _started - timings["login"]
+    timings["total"] = time.perf_counter() - _started
+    logger.info(
+        "Startup completed: %s",
+        ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()),
+    )
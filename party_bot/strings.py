@@ -4,3 +4,5 @@ class Strings:
     SLOTS_LEFT = "Slots left"
     OPEN_PARTIES = "OPEN_PARTIES"
     CLOSED_PARTIES = "CLOSED_PARTIES"
+    BUTTONS = "BUTTONS"
+    REACTIONS = "REACTIONS"
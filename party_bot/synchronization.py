@@ -3,6 +3,89 @@ This module provides synchronization utilities to avoid race conditions.
 """
 
 import asyncio
+import contextlib
+import time
+
+# Called with the function name and the seconds spent waiting for the lock
+# whenever a synchronized function acquires its lock. Set by `profiling`.
+lock_wait_observer = None
+
+# number of calls to synchronized functions that are running or waiting
+_active_calls = 0
+
+# lock shared by all synchronized functions
+_lock = asyncio.Lock()
+
+
+def is_busy() -> bool:
+    """
+    Returns True if and only if any synchronized function (including
+    `synchronized_per_key`) is currently running or waiting for its lock.
+    Background work can use this to give way to live event handling.
+    """
+    return _active_calls > 0
+
+
+class KeyedLock:
+    """
+    Provides a separate lock per key. Locks are created on demand and dropped
+    once no task holds or waits for them.
+    """
+
+    def __init__(self):
+        # key -> (lock, amount of tasks holding or waiting for it)
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key):
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+def synchronized_per_key(key, locks=None):
+    """
+    Function decorator that ensures that calls of the decorated function with
+    the same `key(*args, **kws)` are executed sequentially. Calls with
+    different keys run concurrently, also with functions decorated with
+    `synchronized`.
+
+    Functions that share the `KeyedLock` passed as `locks` are synchronized
+    with each other.
+    """
+    if locks is None:
+        locks = KeyedLock()
+
+    def decorator(func):
+        async def synced_func(*args, **kws):
+            global _active_calls
+            _active_calls += 1
+            try:
+                start = time.perf_counter()
+                async with locks(key(*args, **kws)):
+                    if lock_wait_observer is not None:
+                        lock_wait_observer(func.__name__, time.perf_counter() - start)
+                    return await func(*args, **kws)
+            finally:
+                _active_calls -= 1
+
+        synced_func.__name__ = func.__name__
+        return synced_func
+
+    return decorator
 
 
 def synchronized(func, lock=None):
@@ -14,11 +97,19 @@ def synchronized(func, lock=None):
     Two functions may execute in a different order than they were called.
     """
 
-    func.__lock__ = lock or asyncio.Lock()
+    func.__lock__ = lock or _lock
 
     async def synced_func(*args, **kws):
-        async with func.__lock__:
-            return await func(*args, **kws)
+        global _active_calls
+        _active_calls += 1
+        try:
+            start = time.perf_counter()
+            async with func.__lock__:
+                if lock_wait_observer is not None:
+                    lock_wait_observer(func.__name__, time.perf_counter() - start)
+                return await func(*args, **kws)
+        finally:
+            _active_calls -= 1
 
     synced_func.__name__ = func.__name__
     return synced_func
@@ -0,0 +1,22 @@
+"""
+Test setup. Tests import the bot's modules like the bot does, from the
+`party_bot` directory. The bot configuration (`config.py`) is not part of the
+repository, so tests use `config-sample.py` instead.
+
+Run the tests from the repository root with
+    python -m pytest party_bot/tests
+"""
+
+import importlib.util
+import os
+import sys
+
+_BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _BOT_DIR)
+
+_spec = importlib.util.spec_from_file_location(
+    "config", os.path.join(_BOT_DIR, "config-sample.py")
+)
+config = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(config)
+sys.modules["config"] = config
@@ -0,0 +1,104 @@
+import types
+
+import pytest
+
+import deduplication
+from deduplication import ReactionDeduplicator
+
+WINDOW = deduplication.DEDUPE_WINDOW_SECONDS
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(deduplication.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def deduplicator(clock):
+    return ReactionDeduplicator()
+
+
+def _payload(message_id=1, user_id=2, emoji="✅"):
+    return types.SimpleNamespace(message_id=message_id, user_id=user_id, emoji=emoji)
+
+
+def test_duplicate_event_is_dropped(deduplicator, clock):
+    assert deduplicator.register(_payload(), True) is not None
+    clock.now += WINDOW / 2
+    assert deduplicator.register(_payload(), True) is None
+    assert deduplicator.duplicates_suppressed == 1
+
+
+def test_repeated_event_after_the_window_is_fresh(deduplicator, clock):
+    ticket = deduplicator.register(_payload(), True)
+    assert deduplicator.should_process(ticket)
+
+    clock.now += WINDOW + 1
+    ticket = deduplicator.register(_payload(), True)
+    assert ticket is not None
+    assert deduplicator.should_process(ticket)
+
+
+def test_events_of_other_users_messages_and_emojis_are_fresh(deduplicator):
+    payloads = [
+        _payload(),
+        _payload(user_id=3),
+        _payload(message_id=4),
+        _payload(emoji="⏩"),
+    ]
+    tickets = [deduplicator.register(payload, True) for payload in payloads]
+    assert all(ticket is not None for ticket in tickets)
+    assert all(deduplicator.should_process(ticket) for ticket in tickets)
+
+
+def test_superseded_event_is_dropped(deduplicator):
+    added = deduplicator.register(_payload(), True)
+    removed = deduplicator.register(_payload(), False)
+
+    assert not deduplicator.should_process(added)
+    assert deduplicator.should_process(removed)
+    assert deduplicator.flaps_collapsed == 1
+
+
+def test_flapping_without_net_effect_is_dropped(deduplicator):
+    ticket = deduplicator.register(_payload(), True)
+    assert deduplicator.should_process(ticket)
+
+    removed = deduplicator.register(_payload(), False)
+    added = deduplicator.register(_payload(), True)
+
+    assert not deduplicator.should_process(removed)
+    assert not deduplicator.should_process(added)
+    assert deduplicator.no_ops_suppressed == 1
+
+
+def test_unprocessed_event_does_not_suppress_a_retry(deduplicator):
+    # an event that was registered but shed before `should_process`
+    deduplicator.register(_payload(), True)
+    removed = deduplicator.register(_payload(), False)
+    assert deduplicator.should_process(removed)
+
+    added = deduplicator.register(_payload(), True)
+    assert added is not None
+    assert deduplicator.should_process(added)
+
+
+def test_oldest_entries_are_evicted(clock):
+    deduplicator = ReactionDeduplicator(max_entries=2)
+    deduplicator.register(_payload(message_id=1), True)
+    deduplicator.register(_payload(message_id=2), True)
+    deduplicator.register(_payload(message_id=3), True)
+
+    assert len(deduplicator) == 2
+    # the first event is forgotten, so its duplicate is not recognized
+    assert deduplicator.register(_payload(message_id=1), True) is not None
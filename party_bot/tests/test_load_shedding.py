@@ -0,0 +1,187 @@
+import asyncio
+import types
+
+import pytest
+
+import checks
+import config
+import deduplication
+import emoji_handling
+import load_shedding
+from checks import ActivationState
+from emojis import Emojis
+from load_shedding import ReactionLoadShedder
+
+CHANNEL_ID = 10
+PARTY_MESSAGE_ID = 100
+
+
+class _ChannelInfo:
+    def __init__(self, max_slots=3, size=1):
+        self.max_slots = max_slots
+        self.size = size
+        self.party_message_ids = {PARTY_MESSAGE_ID}
+
+    def is_party_message(self, message_id):
+        return message_id in self.party_message_ids
+
+    def party_size(self, message_id):
+        return self.size
+
+
+def _payload(user_id=2, emoji=Emojis.WHITE_CHECK_MARK, message_id=PARTY_MESSAGE_ID):
+    return types.SimpleNamespace(
+        guild_id=1,
+        channel_id=CHANNEL_ID,
+        message_id=message_id,
+        user_id=user_id,
+        emoji=emoji,
+    )
+
+
+@pytest.fixture
+def shedder():
+    return ReactionLoadShedder(soft_limit=2, hard_limit=4)
+
+
+def _admit(shedder, payload, added=True, channel_info=None):
+    return shedder.admit(
+        payload, added, ActivationState.PARTY, channel_info or _ChannelInfo()
+    )
+
+
+def test_soft_limit_collapses_events_of_queued_members(shedder):
+    assert _admit(shedder, _payload(user_id=2))
+    assert _admit(shedder, _payload(user_id=3))
+
+    # at the soft limit, members with a queued event are shed
+    assert not _admit(shedder, _payload(user_id=2))
+    assert shedder.shed[load_shedding.COLLAPSED] == 1
+    # other members are still admitted
+    assert _admit(shedder, _payload(user_id=4))
+
+
+def test_below_soft_limit_members_can_queue_several_events(shedder):
+    assert _admit(shedder, _payload(user_id=2))
+    assert _admit(shedder, _payload(user_id=2))
+
+
+def test_hard_limit_sheds_all_added_events(shedder):
+    for user_id in range(2, 6):
+        assert _admit(shedder, _payload(user_id=user_id))
+
+    assert not _admit(shedder, _payload(user_id=6))
+    assert shedder.shed[load_shedding.OVERLOAD] == 1
+    # removed reactions are always handled
+    assert _admit(shedder, _payload(user_id=6), added=False)
+
+
+def test_done_frees_queue_slots(shedder):
+    payloads = [_payload(user_id=user_id) for user_id in range(2, 6)]
+    for payload in payloads:
+        assert _admit(shedder, payload)
+    for payload in payloads:
+        shedder.done(payload)
+
+    assert shedder.queue_depth() == 0
+    assert _admit(shedder, _payload(user_id=2))
+
+
+def test_stale_and_full_parties_are_shed(shedder):
+    assert not _admit(shedder, _payload(message_id=PARTY_MESSAGE_ID + 1))
+    assert not _admit(shedder, _payload(), channel_info=_ChannelInfo(size=3))
+    assert shedder.shed[load_shedding.STALE] == 1
+    assert shedder.shed[load_shedding.FULL] == 1
+    # leaving a full party is still handled
+    assert _admit(shedder, _payload(), added=False, channel_info=_ChannelInfo(size=3))
+
+
+def test_other_features_are_only_shed_by_queue_depth(shedder):
+    channel_info = None
+    for user_id in range(2, 6):
+        assert shedder.admit(
+            _payload(user_id=user_id), True, ActivationState.SIDE_GAMES, channel_info
+        )
+    assert not shedder.admit(
+        _payload(user_id=6), True, ActivationState.SIDE_GAMES, channel_info
+    )
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """
+    Runs `emoji_handling.handle_react` with fresh shedding and deduplication
+    state for a party channel. Returns the payloads that reached the handlers
+    and the payloads whose reactions were queued for removal.
+    """
+    handled = []
+    removed = []
+    channel_info = _ChannelInfo()
+
+    async def unwrap_payload(payload):
+        handled.append(payload)
+        await asyncio.sleep(0.01)  # fetching the message
+        raise asyncio.TimeoutError()  # handled like a failed REST call
+
+    monkeypatch.setattr(
+        config, "bot", types.SimpleNamespace(user=types.SimpleNamespace(id=0)), False
+    )
+    monkeypatch.setattr(
+        checks,
+        "get_channel_feature",
+        lambda channel_id: (ActivationState.PARTY, channel_info),
+    )
+    monkeypatch.setattr(emoji_handling, "unwrap_payload", unwrap_payload)
+    monkeypatch.setattr(emoji_handling, "reaction_load_shedder", ReactionLoadShedder())
+    monkeypatch.setattr(
+        emoji_handling, "reaction_deduplicator", deduplication.ReactionDeduplicator()
+    )
+    monkeypatch.setattr(
+        emoji_handling,
+        "shed_reaction_remover",
+        types.SimpleNamespace(remove=removed.append),
+    )
+    return types.SimpleNamespace(
+        payloads=handled, removed=removed, channel_info=channel_info
+    )
+
+
+async def _handle_all(*events):
+    await asyncio.gather(
+        *[emoji_handling.handle_react(payload, added) for payload, added in events]
+    )
+
+
+def test_shed_event_does_not_suppress_the_retry(handled):
+    # the party is full when the join arrives
+    handled.channel_info.size = 3
+    asyncio.run(_handle_all((_payload(), True)))
+    assert handled.payloads == []
+    assert handled.removed == [_payload()]
+
+    # a slot frees up and the member reacts again
+    handled.channel_info.size = 2
+    asyncio.run(_handle_all((_payload(), False), (_payload(), True)))
+    assert handled.payloads == [_payload(), _payload()]
+
+
+def test_event_shed_while_queued_does_not_suppress_the_retry(handled, monkeypatch):
+    # the party fills up while the join is queued
+    shedder = emoji_handling.reaction_load_shedder
+    still_relevant = shedder.still_relevant
+    monkeypatch.setattr(shedder, "still_relevant", lambda *args: False)
+    asyncio.run(_handle_all((_payload(), True)))
+    assert handled.payloads == []
+    assert handled.removed == [_payload()]
+
+    # a slot frees up and the member quickly removes and adds the reaction
+    # while another of their events is handled, so the removal is superseded
+    monkeypatch.setattr(shedder, "still_relevant", still_relevant)
+    asyncio.run(
+        _handle_all(
+            (_payload(emoji=Emojis.FAST_FORWARD), True),
+            (_payload(), False),
+            (_payload(), True),
+        )
+    )
+    assert handled.payloads == [_payload(emoji=Emojis.FAST_FORWARD), _payload()]
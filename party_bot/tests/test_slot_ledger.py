@@ -0,0 +1,144 @@
+import asyncio
+import types
+
+import pytest
+
+from channelinformation import PartyChannelInformation
+from slot_ledger import PartySlotLedger
+
+LEADER = types.SimpleNamespace(id=1)
+PARTY_MESSAGE = types.SimpleNamespace(id=100)
+
+
+def _member(user_id):
+    return types.SimpleNamespace(id=user_id)
+
+
+@pytest.fixture
+def ledger():
+    return PartySlotLedger()
+
+
+def _channel_info(max_slots, members=()):
+    # party message with the leader and the given members
+    party_members = [(LEADER.id, PARTY_MESSAGE.id)]
+    party_members += [(member.id, PARTY_MESSAGE.id) for member in members]
+    return PartyChannelInformation.from_snapshot(
+        {
+            "id": 10,
+            "reference_channel_id": 11,
+            "game_name": "Game",
+            "max_slots": max_slots,
+            "voice_channel_counter": 1,
+            "open_parties": True,
+            "division_admin_id": 12,
+            "party_members": party_members,
+            "active_voice_channels": [],
+        }
+    )
+
+
+async def _join(ledger, channel_info, member, fail=False):
+    """
+    Joins like `party.join_party` does, with a party message edit that yields
+    to the event loop and optionally fails. Returns (joined, start claimed).
+    """
+    if not ledger.reserve(channel_info, PARTY_MESSAGE, member):
+        return False, False
+    try:
+        await asyncio.sleep(0)  # editing the party message
+        if fail:
+            raise asyncio.TimeoutError()
+    except asyncio.TimeoutError:
+        channel_info.clear_party_message_of_user(member)
+        return False, False
+    finally:
+        ledger.end(PARTY_MESSAGE.id)
+    return True, ledger.claim_full(channel_info, PARTY_MESSAGE.id)
+
+
+async def _join_all(ledger, channel_info, members, failing=()):
+    return await asyncio.gather(
+        *[
+            _join(ledger, channel_info, member, fail=member in failing)
+            for member in members
+        ]
+    )
+
+
+def test_two_joiners_one_slot(ledger):
+    channel_info = _channel_info(max_slots=3, members=[_member(2)])
+    a, b = _member(3), _member(4)
+
+    results = asyncio.run(_join_all(ledger, channel_info, [a, b]))
+
+    assert results == [(True, True), (False, False)]
+    assert channel_info.party_size(PARTY_MESSAGE.id) == 3
+    assert not channel_info.is_in_party(b)
+
+
+def test_start_is_claimed_once_after_the_last_join(ledger):
+    channel_info = _channel_info(max_slots=4)
+    members = [_member(user_id) for user_id in range(2, 7)]
+
+    results = asyncio.run(_join_all(ledger, channel_info, members))
+
+    assert [joined for joined, _ in results].count(True) == 3
+    # only the last join to end claims the start
+    assert [claimed for _, claimed in results] == [False, False, True, False, False]
+    assert channel_info.party_size(PARTY_MESSAGE.id) == 4
+
+
+def test_failed_join_releases_the_slot(ledger):
+    channel_info = _channel_info(max_slots=3, members=[_member(2)])
+    a, b = _member(3), _member(4)
+
+    results = asyncio.run(_join_all(ledger, channel_info, [a], failing=[a]))
+
+    assert results == [(False, False)]
+    assert not channel_info.is_in_party(a)
+    assert channel_info.party_size(PARTY_MESSAGE.id) == 2
+    assert len(ledger) == 0
+
+    results = asyncio.run(_join_all(ledger, channel_info, [b]))
+
+    assert results == [(True, True)]
+
+
+def test_no_start_while_a_failing_join_is_in_flight(ledger):
+    channel_info = _channel_info(max_slots=3)
+    a, b = _member(2), _member(3)
+
+    results = asyncio.run(_join_all(ledger, channel_info, [a, b], failing=[b]))
+
+    # the party was full while b was in flight, but b's slot got released
+    assert results == [(True, False), (False, False)]
+    assert channel_info.party_size(PARTY_MESSAGE.id) == 2
+
+
+def test_claim_fails_while_actions_are_in_flight(ledger):
+    assert ledger.begin(PARTY_MESSAGE.id)
+    assert not ledger.claim(PARTY_MESSAGE.id)
+    ledger.end(PARTY_MESSAGE.id)
+    assert ledger.claim(PARTY_MESSAGE.id)
+
+
+def test_claimed_party_rejects_actions_until_unclaimed(ledger):
+    channel_info = _channel_info(max_slots=3)
+    assert ledger.claim(PARTY_MESSAGE.id)
+
+    assert not ledger.claim(PARTY_MESSAGE.id)
+    assert not ledger.begin(PARTY_MESSAGE.id)
+    assert not ledger.reserve(channel_info, PARTY_MESSAGE, _member(2))
+    assert not channel_info.is_in_party(_member(2))
+
+    ledger.unclaim(PARTY_MESSAGE.id)
+    assert ledger.reserve(channel_info, PARTY_MESSAGE, _member(2))
+    ledger.end(PARTY_MESSAGE.id)
+
+
+def test_forget_drops_all_state(ledger):
+    assert ledger.claim(PARTY_MESSAGE.id)
+    assert len(ledger) == 1
+    ledger.forget(PARTY_MESSAGE.id)
+    assert len(ledger) == 0
@@ -0,0 +1,238 @@
+"""
+This module implements a pool of pre-created party voice channels per party
+matchmaking channel.
+
+Creating and deleting channels are among the slowest and most rate-limited
+Discord API routes. Instead, party voice channels are taken from a pool of
+hidden voice channels right below the reference channel (see `claim`), which
+takes a single edit to apply the party's name and permission overwrites.
+Emptied party voice channels are hidden again and returned to the pool (see
+`release`). They keep their name while pooled, since Discord only allows
+`RENAME_LIMIT` renames of a channel per `RENAME_WINDOW_SECONDS`; channels
+that used up their renames are skipped by `claim`.
+
+The pool size follows demand: the target size of a pool is the amount of
+parties started in its matchmaking channel within the last
+`DEMAND_WINDOW_SECONDS`, bounded by `POOL_MIN_SIZE` and `POOL_MAX_SIZE`.
+Pools are topped up in the background after a channel was claimed, surplus
+channels are deleted when they are released.
+
+The IDs of pooled channels are stored in
+`PartyChannelInformation.pooled_voice_channels`.
+"""
+
+import asyncio
+import collections
+import config
+import discord
+import logging
+import rest
+import time
+import transaction
+import typing
+from database import db
+from synchronization import synchronized
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_SIZE = getattr(config, "PARTY_VOICE_CHANNEL_POOL_MIN_SIZE", 1)
+POOL_MAX_SIZE = getattr(config, "PARTY_VOICE_CHANNEL_POOL_MAX_SIZE", 5)
+
+# Parties started within this window determine the target pool size
+DEMAND_WINDOW_SECONDS = 30 * 60
+
+# Discord's rate limit of channel renames
+RENAME_LIMIT = 2
+RENAME_WINDOW_SECONDS = 10 * 60
+
+
+def _pooled_name(channel_info) -> str:
+    return f"{channel_info.game_name} - Party"
+
+
+def _hidden_overwrites(guild: discord.Guild) -> dict:
+    return {
+        guild.default_role: discord.PermissionOverwrite(
+            read_messages=False, connect=False
+        ),
+        guild.me: discord.PermissionOverwrite(read_messages=True, connect=True),
+    }
+
+
+class VoiceChannelPool:
+    def __init__(self):
+        # matchmaking channel ID -> times at which channels were claimed
+        self._claims = collections.defaultdict(collections.deque)
+        # matchmaking channel ID -> refill task
+        self._refills = {}
+        # voice channel ID -> times at which the channel was renamed
+        self._renames = collections.defaultdict(collections.deque)
+
+    def _can_rename(self, voice_channel_id: int) -> bool:
+        renames = self._renames[voice_channel_id]
+        horizon = time.monotonic() - RENAME_WINDOW_SECONDS
+        while len(renames) > 0 and renames[0] < horizon:
+            renames.popleft()
+        if len(renames) == 0:
+            del self._renames[voice_channel_id]
+            return True
+        return len(renames) < RENAME_LIMIT
+
+    def target_size(self, matchmaking_channel_id: int) -> int:
+        claims = self._claims[matchmaking_channel_id]
+        horizon = time.monotonic() - DEMAND_WINDOW_SECONDS
+        while len(claims) > 0 and claims[0] < horizon:
+            claims.popleft()
+        return max(POOL_MIN_SIZE, min(POOL_MAX_SIZE, len(claims)))
+
+    async def claim(
+        self, channel_info, guild: discord.Guild, name: str, overwrites: dict
+    ) -> typing.Optional[discord.VoiceChannel]:
+        """
+        Takes a voice channel from the pool of the matchmaking channel and
+        applies the given name and permission overwrites.
+
+        Returns None if the pool has no channel that can be renamed right now
+        or the channel could not be edited. In that case, the caller has to
+        create the voice channel itself.
+        """
+        self._claims[channel_info.id].append(time.monotonic())
+        try:
+            for voice_channel_id in list(channel_info.pooled_voice_channels):
+                voice_channel = guild.get_channel(voice_channel_id)
+                if voice_channel is None:
+                    # deleted manually
+                    channel_info.pooled_voice_channels.remove(voice_channel_id)
+                    continue
+                renamed = voice_channel.name != name
+                if renamed and not self._can_rename(voice_channel_id):
+                    continue
+                channel_info.pooled_voice_channels.remove(voice_channel_id)
+                if renamed:
+                    # counts even if the edit fails, it may have been applied
+                    self._renames[voice_channel_id].append(time.monotonic())
+                try:
+                    if renamed:
+                        await rest.call(
+                            "edit_channel",
+                            voice_channel.edit,
+                            name=name,
+                            overwrites=overwrites,
+                        )
+                    else:
+                        await rest.call(
+                            "edit_channel", voice_channel.edit, overwrites=overwrites
+                        )
+                except discord.NotFound:
+                    continue  # deleted manually
+                except rest.FAILURES as e:
+                    # keep the channel pooled, the next claim applies the
+                    # name and overwrites again
+                    channel_info.pooled_voice_channels.add(voice_channel_id)
+                    logger.warning(
+                        "Could not claim pooled voice channel %d: %r",
+                        voice_channel_id,
+                        e,
+                        extra={"guild_id": guild.id, "channel_id": channel_info.id},
+                    )
+                    return None
+                return voice_channel
+            return None
+        finally:
+            self.refill(channel_info, guild)
+
+    async def release(self, channel_info, voice_channel: discord.VoiceChannel) -> None:
+        """
+        Hides an emptied party voice channel and returns it to the pool of the
+        matchmaking channel, or deletes it if the pool is full. The channel
+        keeps its name, see the module documentation.
+        """
+        guild = voice_channel.guild
+        if len(channel_info.pooled_voice_channels) >= self.target_size(channel_info.id):
+            await rest.call("delete_channel", voice_channel.delete)
+            self._renames.pop(voice_channel.id, None)
+            return
+
+        _, channel_above_position = await channel_info.fetch_channel_above(guild)
+        await rest.call(
+            "edit_channel",
+            voice_channel.edit,
+            overwrites=_hidden_overwrites(guild),
+            position=channel_above_position + 1,
+        )
+        channel_info.pooled_voice_channels.add(voice_channel.id)
+
+    def refill(self, channel_info, guild: discord.Guild) -> None:
+        """
+        Tops up the pool of the matchmaking channel to its target size in the
+        background. Does nothing if the pool is being refilled already.
+        """
+        task = self._refills.get(channel_info.id)
+        if task is None or task.done():
+            self._refills[channel_info.id] = asyncio.ensure_future(
+                self._refill(channel_info, guild)
+            )
+
+    async def _refill(self, channel_info, guild):
+        try:
+            while len(channel_info.pooled_voice_channels) < self.target_size(
+                channel_info.id
+            ):
+                channel_above, channel_above_position = (
+                    await channel_info.fetch_channel_above(guild)
+                )
+                voice_channel = await guild.create_voice_channel(
+                    _pooled_name(channel_info),
+                    category=guild.get_channel(channel_above.category_id),
+                    overwrites=_hidden_overwrites(guild),
+                )
+                await voice_channel.edit(position=channel_above_position + 1)
+                if not await _add_to_pool(channel_info, voice_channel):
+                    return
+        except discord.HTTPException:
+            logger.warning(
+                "Could not refill the party voice channel pool.",
+                exc_info=True,
+                extra={"guild_id": guild.id, "channel_id": channel_info.id},
+            )
+
+    async def drain(self, channel_info, guild: discord.Guild) -> None:
+        """
+        Deletes all pooled voice channels of the matchmaking channel, e.g.
+        when the channel gets deactivated. Must be called after the channel
+        information was removed from the database, so that a running refill
+        deletes the channels it creates instead of pooling them.
+        """
+        for voice_channel_id in list(channel_info.pooled_voice_channels):
+            channel_info.pooled_voice_channels.remove(voice_channel_id)
+            self._renames.pop(voice_channel_id, None)
+            voice_channel = guild.get_channel(voice_channel_id)
+            if voice_channel is None:
+                continue
+            try:
+                await voice_channel.delete()
+            except discord.NotFound:
+                pass  # deleted manually
+
+    def fill_all(self, bot) -> None:
+        """
+        Starts filling the pools of all party matchmaking channels.
+        """
+        for channel_id, channel_info in db.party_channels.items():
+            channel = bot.get_channel(channel_id)
+            if channel is not None:
+                self.refill(channel_info, channel.guild)
+
+
+@synchronized
+async def _add_to_pool(channel_info, voice_channel: discord.VoiceChannel) -> bool:
+    if db.party_channels.get(channel_info.id) is not channel_info:
+        # channel was deactivated or reconfigured in the meantime
+        await voice_channel.delete()
+        return False
+    channel_info.pooled_voice_channels.add(voice_channel.id)
+    transaction.commit()
+    return True
+
+
+voice_channel_pool = VoiceChannelPool()